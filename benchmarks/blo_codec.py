@@ -0,0 +1,338 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import platform
+import subprocess
+from contextlib import redirect_stdout
+from statistics import median
+
+# Times the BLO codec on generated layouts: parsing, writing, converting to and from JSON and a full
+# round trip BLO -> JSON -> BLO, and checks that the written files are byte-identical to the input.
+# Results are written as JSON so that the numbers of two versions can be compared:
+#
+#   python benchmarks/blo_codec.py --output before.json
+#   (switch to the other version)
+#   python benchmarks/blo_codec.py --output after.json --compare before.json
+#
+# Without --panes etc. a set of preset layouts is measured. Exits with 1 if an output isn't
+# byte-identical or, with --compare, if an operation got slower than --threshold allows.
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from lib.blo.readblo2 import ScreenBlo, Information, Node, Pane, Window, Picture, Textbox, TextureNames, FontNames
+from lib.blo.mat1.mat1 import MAT1, MaterialInitData
+from lib.blo.mat1.datatypes import (Color, ChannelControl, TexCoordInfo, TexMatrix, FontNumber, TevKColor,
+                                    TevOrder, TevColor, TevStage, TevSwapMode, TevSwapModeTable,
+                                    AlphaCompare, Blend)
+from lib.blo.mat1.enums import CullModeSetting
+
+# name: (panes, depth, materials, textures)
+PRESETS = {
+    "small": (100, 4, 20, 10),
+    "medium": (1000, 8, 100, 50),
+    "large": (5000, 12, 400, 200),
+    "deep": (2000, 1000, 50, 20),
+}
+
+OPERATIONS = ("from_file", "write", "serialize", "deserialize", "write_json", "from_json", "round_trip")
+
+
+def random_data(r, cls):
+    return bytes(r.randrange(256) for i in range(cls.size))
+
+
+def unknown_data(cls, data, index=None):
+    obj = cls(index)
+    obj.data = data
+    return obj
+
+
+def make_material(r, name, textures):
+    material = MaterialInitData()
+    material.name = name
+    material.indirectdata = None
+    material.flag = r.choice((1, 4))
+    material.cullmode = CullModeSetting(r.randrange(3))
+    material.color_channel_count = r.randrange(2)
+    material.tex_gen_count = r.randrange(3)
+    material.tev_stage_count = r.randrange(1, 4)
+    material.dither = r.randrange(2)
+    material.unk = 0
+
+    material.matcolors = [Color(*(r.randrange(256) for i in range(4))), None]
+    material.color_channels = [None if r.random() < 0.3 else unknown_data(ChannelControl, random_data(r, ChannelControl))
+                               for i in range(4)]
+    # Entries of these two arrays are referenced by index, the data has to be the same for the same index
+    material.tex_coord_generators = [None]*8
+    for i in range(2):
+        index = r.randrange(4)
+        material.tex_coord_generators[i] = unknown_data(TexCoordInfo, bytes((1, 4, 0x3C + index, 0xFF)), index)
+    material.tex_matrices = [None if r.random() < 0.8 else unknown_data(TexMatrix, random_data(r, TexMatrix))
+                             for i in range(8)]
+    material.textures = [r.randrange(textures) if i < 2 else None for i in range(8)]
+    material.font = None if r.random() < 0.7 else unknown_data(FontNumber, b"\x00\x00")
+    material.tevkcolors = [None if r.random() < 0.5 else unknown_data(TevKColor, random_data(r, TevKColor))
+                           for i in range(4)]
+    material.tevkcolor_selects = [r.randrange(0x20) for i in range(16)]
+    material.tevkalpha_selects = [r.randrange(0x20) for i in range(16)]
+    material.tevorders = [unknown_data(TevOrder, random_data(r, TevOrder)) if i < 3 else None for i in range(16)]
+    material.tevcolors = [None if r.random() < 0.5 else unknown_data(TevColor, random_data(r, TevColor))
+                          for i in range(4)]
+    material.tevstages = [unknown_data(TevStage, random_data(r, TevStage)) if i < 3 else None for i in range(16)]
+    material.tevstage_swapmodes = [None]*16
+    for i in range(2):
+        index = r.randrange(4)
+        material.tevstage_swapmodes[i] = unknown_data(TevSwapMode, bytes((0, index % 2, 0xFF, 0xFF)), index)
+    material.tev_swapmode_tables = [unknown_data(TevSwapModeTable, random_data(r, TevSwapModeTable))
+                                    for i in range(4)]
+    material.alphacomp = unknown_data(AlphaCompare, random_data(r, AlphaCompare))
+    material.blend = unknown_data(Blend, random_data(r, Blend))
+
+    return material
+
+
+def make_pane(r, cls, materials, i):
+    pane = cls.new()
+    pane.p_panename = "p{0:07d}".format(i)[-8:]
+    pane.p_offset_x = float(r.randrange(-300, 300))
+    pane.p_offset_y = float(r.randrange(-200, 200))
+    pane.p_size_x = float(r.randrange(1, 200))
+    pane.p_size_y = float(r.randrange(1, 200))
+    pane.p_rotation = r.choice((0.0, 0.0, 90.0, 45.5))
+    pane.p_anchor = r.randrange(9)
+
+    if cls is not Pane:
+        pane.set_default_material(r.choice(materials))
+    if cls is Textbox:
+        pane.text = "Text {0}".format(i)
+        pane.color_top = Color(*(r.randrange(256) for i in range(4)))
+    elif cls is Picture:
+        pane.color1["col1"] = tuple(r.randrange(256) for i in range(4))
+
+    return pane
+
+
+def make_layout(panes, depth, materials, textures, seed=0):
+    # Layout with the given number of panes nested up to depth levels deep
+    r = random.Random(seed)
+    blo = ScreenBlo()
+    blo.info = Information(640, 480)
+    root = blo.root
+
+    root.textures = TextureNames()
+    root.textures.references = ["timg/tex_{0:04d}.bti".format(i) for i in range(textures)]
+    fonts = FontNames()
+    fonts.references = ["font/font.bfn"]
+    root.materials = MAT1()
+    root.materials.materials = [make_material(r, "mat_{0:04d}".format(i), textures) for i in range(materials)]
+    root.children.extend((root.textures, fonts, root.materials))
+
+    top = Pane.new()
+    top.p_panename = "ROOT    "  # Names are always 8 characters
+    root.children.append(top)
+
+    # Panes that other panes can be added to, with the level of their children. The root pane is on level 1,
+    # the first panes form a chain down to the full depth.
+    containers = [(top, 2)]
+    chain = (top, 2) if depth > 2 else None
+    for i in range(panes - 1):
+        if chain is not None:
+            cls = Pane
+            parent, level = chain
+        else:
+            cls = r.choice((Pane, Picture, Picture, Window, Textbox))
+            parent, level = r.choice(containers)
+
+        pane = make_pane(r, cls, root.materials.materials, i)
+        if parent.child is None:
+            parent.child = Node()
+            parent.child.materials = root.materials
+            parent.child.textures = root.textures
+        parent.add_child(pane)
+
+        if cls is Pane and level < depth:
+            containers.append((pane, level + 1))
+            if chain is not None:
+                chain = (pane, level + 1)
+        else:
+            chain = None
+
+    return blo
+
+
+def measure(func, repeats, setup=None):
+    # Returns the times of all repeats in seconds and the result of the last run
+    times = []
+    result = None
+    for i in range(repeats):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+
+    return times, result
+
+
+def write_blo(blo):
+    out = io.BytesIO()
+    blo.write(out)
+    return out.getvalue()
+
+
+def write_json(blo):
+    out = io.StringIO()
+    blo.write_json(out)
+    return out.getvalue()
+
+
+def round_trip(data):
+    return write_blo(ScreenBlo.from_json(io.StringIO(write_json(ScreenBlo.from_file(io.BytesIO(data))))))
+
+
+def run_layout(name, panes, depth, materials, textures, seed, repeats):
+    blo = make_layout(panes, depth, materials, textures, seed)
+    data = write_blo(blo)
+
+    parsed = ScreenBlo.from_file(io.BytesIO(data))
+    write_blo(parsed)  # Loads all materials
+    text = write_json(parsed)
+
+    times = {}
+    times["from_file"], result = measure(lambda: ScreenBlo.from_file(io.BytesIO(data)), repeats)
+    times["write"], written = measure(lambda: write_blo(parsed), repeats)
+    times["serialize"], serialized = measure(parsed.serialize, repeats)
+    # deserialize replaces the texture names in the materials, every run gets a fresh copy
+    times["deserialize"], result = measure(ScreenBlo.deserialize, repeats, lambda: (json.loads(text), ))
+    times["write_json"], result = measure(lambda: write_json(parsed), repeats)
+    times["from_json"], result = measure(lambda: ScreenBlo.from_json(io.StringIO(text)), repeats)
+    times["round_trip"], roundtripped = measure(lambda: round_trip(data), repeats)
+
+    identical = {
+        "write": written == data,
+        "round_trip": roundtripped == data,
+        "write_json": text == json.dumps(serialized, indent=4, ensure_ascii=False),
+    }
+
+    return {
+        "name": name,
+        "panes": panes,
+        "depth": depth,
+        "materials": materials,
+        "textures": textures,
+        "seed": seed,
+        "blo_size": len(data),
+        "json_size": len(text),
+        "times": {operation: {"min": min(times[operation]), "median": median(times[operation]), "runs": times[operation]}
+                  for operation in OPERATIONS},
+        "identical": identical,
+    }
+
+
+def git_revision():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def compare(results, previous, threshold):
+    # Prints the fastest times relative to an earlier result file, returns the slower operations.
+    # The minimum is compared because it varies much less between runs than the median.
+    old_layouts = {layout["name"]: layout for layout in previous["layouts"]}
+    slower = []
+    for layout in results["layouts"]:
+        old = old_layouts.get(layout["name"])
+        if old is None:
+            continue
+        for operation in OPERATIONS:
+            if operation not in old["times"]:
+                continue
+            ratio = layout["times"][operation]["min"] / old["times"][operation]["min"]
+            print("{0:8} {1:12} {2:6.2f}x".format(layout["name"], operation, ratio))
+            if ratio > threshold:
+                slower.append((layout["name"], operation, ratio))
+
+    return slower
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the BLO codec on generated layouts.")
+    parser.add_argument("--panes", type=int, default=None,
+                        help="Number of panes of a custom layout. Without it the preset layouts are measured.")
+    parser.add_argument("--depth", type=int, default=8, help="Nesting depth of the custom layout.")
+    parser.add_argument("--materials", type=int, default=100, help="Number of materials of the custom layout.")
+    parser.add_argument("--textures", type=int, default=50, help="Number of textures of the custom layout.")
+    parser.add_argument("--presets", nargs="+", default=None, choices=sorted(PRESETS),
+                        help="Preset layouts to measure, default is all of them.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this path.")
+    parser.add_argument("--compare", default=None, help="Results of an earlier run to compare with.")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="With --compare, fail if the fastest run of an operation takes more than "
+                             "this many times as long as before.")
+
+    args = parser.parse_args()
+
+    # Deep layouts are written and read without recursion, the JSON module's own encoder
+    # used by the comparison still recurses
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+
+    if args.panes is not None:
+        layouts = {"custom": (args.panes, args.depth, args.materials, args.textures)}
+    else:
+        layouts = {name: PRESETS[name] for name in (args.presets or PRESETS)}
+
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": args.repeats,
+        "layouts": [],
+    }
+
+    failed = False
+    for name, (panes, depth, materials, textures) in layouts.items():
+        # The codec prints debug output
+        with open(os.devnull, "w") as devnull:
+            with redirect_stdout(devnull):
+                layout = run_layout(name, panes, depth, materials, textures, args.seed, args.repeats)
+        results["layouts"].append(layout)
+
+        print("{0}: {1} panes, depth {2}, {3} materials, {4} textures, {5} bytes".format(
+            name, panes, depth, materials, textures, layout["blo_size"]))
+        for operation in OPERATIONS:
+            times = layout["times"][operation]
+            print("    {0:12} min {1:9.2f} ms   median {2:9.2f} ms".format(
+                operation, times["min"]*1000, times["median"]*1000))
+        for check, identical in layout["identical"].items():
+            if not identical:
+                failed = True
+                print("    {0} output is NOT identical".format(check))
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        print()
+        print("Compared to revision {0}:".format(previous.get("revision")))
+        slower = compare(results, previous, args.threshold)
+        if slower:
+            failed = True
+            print()
+            for name, operation, ratio in slower:
+                print("{0} {1} got {2:.2f}x slower".format(name, operation, ratio))
+
+    if failed:
+        sys.exit(1)
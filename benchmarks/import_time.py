@@ -0,0 +1,92 @@
+import os
+import sys
+import subprocess
+from statistics import median
+
+# Measures how long importing the BLO/archive/texture modules takes, each in a fresh interpreter,
+# and checks that the data and codec modules don't pull in PyQt5 or OpenGL.
+# Run from anywhere: python benchmarks/import_time.py [repeats]
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that have to stay usable without the GUI
+CODEC_MODULES = (
+    "lib.yaz0",
+    "lib.rarc",
+    "lib.blo.readblo2",
+    "lib.blo.mat1.mat1",
+    "lib.blo.tex.bti",
+    "lib.blo.tex.texture_utils",
+    "lib.blo.tex.texture_bundle",
+    "lib.blo.batch",
+)
+
+# GUI side for comparison, only measured if PyQt5 and PyOpenGL are installed
+GUI_MODULES = (
+    "lib.blo.tex.textures",
+    "lib.object_models",
+)
+
+GUI_PACKAGES = ("PyQt5", "OpenGL")
+
+MEASURE = """
+import sys, time
+start = time.perf_counter()
+import {0}
+end = time.perf_counter()
+gui = [name for name in sys.modules if name.split(".")[0] in {1!r}]
+print(end - start, ",".join(gui) or "-")
+"""
+
+
+def measure(module):
+    # Returns the import time in seconds and the GUI packages that got imported
+    result = subprocess.run([sys.executable, "-c", MEASURE.format(module, GUI_PACKAGES)], cwd=REPO,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    seconds, gui = result.stdout.strip().splitlines()[-1].split(" ")
+    return float(seconds), set(name.split(".")[0] for name in gui.split(",") if name != "-")
+
+
+def run(modules, repeats):
+    results = {}
+    for module in modules:
+        try:
+            times = []
+            for i in range(repeats):
+                seconds, gui = measure(module)
+                times.append(seconds)
+        except RuntimeError as error:
+            print("{0:32} not importable: {1}".format(module, error))
+            continue
+
+        results[module] = (min(times), median(times), gui)
+        print("{0:32} min {1:8.1f} ms   median {2:8.1f} ms   GUI imports: {3}".format(
+            module, min(times)*1000, median(times)*1000, ", ".join(sorted(gui)) or "none"))
+
+    return results
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print("Data and codec layer:")
+    codec = run(CODEC_MODULES, repeats)
+    print()
+    print("GUI layer:")
+    gui = run(GUI_MODULES, repeats)
+
+    if gui:
+        print()
+        slowest_codec = max(result[1] for result in codec.values())
+        for module, result in gui.items():
+            print("{0} takes {1:.1f}x as long to import as the slowest codec module".format(
+                module, result[1] / slowest_codec))
+
+    failed = [module for module, result in codec.items() if result[2]]
+    if failed:
+        print()
+        print("These modules import GUI packages:", ", ".join(failed))
+        sys.exit(1)
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+from io import BytesIO
+from statistics import median
+
+import numpy
+from PIL import Image
+
+# Times the texture decoder for every GameCube image format on random image data and checks that the
+# NumPy decoder gives the same pixels as the block by block decoder it replaces. A generated image with
+# gradients, noise and a transparent hole is encoded for the formats the NumPy encoder supports and
+# checked against the block by block encoder, for C4 and C8 after reducing its colors with Pillow like
+# texture_utils.encode_image does. Encoding includes generating the palette. CMPR and C14X2 aren't encoded
+# the same way as before, for them the PSNR of the opaque pixels is shown instead, also for the slower
+# encoding of CMPR with refine_cmpr.
+#
+#   python benchmarks/texture_codec.py --size 1024 --output results.json
+#
+# The block by block decoder and encoder take seconds for large images, they're run once per format and
+# can be skipped with --skip-slow. The old C14X2 encoder compares every pixel with every palette color
+# and takes hours for large images, it's only run for sizes up to SLOW_C14X2_MAX_SIZE.
+# Exits with 1 if the results aren't the same.
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from lib.blo.tex import texture_utils
+from lib.blo.tex.texture_utils import (ImageFormat, PaletteFormat, BLOCK_WIDTHS, BLOCK_HEIGHTS, BLOCK_DATA_SIZES,
+                                       MAX_COLORS_FOR_IMAGE_FORMAT, decode_image, decode_image_slow,
+                                       encode_mipmap_image,
+                                       encode_mipmap_image_slow, generate_new_palettes_from_image,
+                                       generate_new_palettes_from_image_slow, encode_palette)
+from lib.blo.tex.texture_arrays import decode_image_array
+
+# Formats that the NumPy encoder doesn't encode the same way as the block by block encoder
+LOSSY_FORMATS = (ImageFormat.CMPR, ImageFormat.C14X2)
+
+SLOW_C14X2_MAX_SIZE = 128
+
+# Palette format used for the palette image formats
+PALETTE_FORMAT = PaletteFormat.RGB5A3
+
+
+def make_texture(image_format, width, height, seed):
+    # Random image and palette data. Every palette entry can be referred to so that there are
+    # no color indexes past the end of the palette.
+    r = random.Random(seed)
+    blocks_wide = (width + BLOCK_WIDTHS[image_format] - 1) // BLOCK_WIDTHS[image_format]
+    blocks_tall = (height + BLOCK_HEIGHTS[image_format] - 1) // BLOCK_HEIGHTS[image_format]
+    image_data = r.randbytes(blocks_wide*blocks_tall*BLOCK_DATA_SIZES[image_format])
+
+    num_colors = MAX_COLORS_FOR_IMAGE_FORMAT.get(image_format, 0)
+    palette_data = r.randbytes(num_colors*2)
+
+    return image_data, palette_data, num_colors
+
+
+def make_image(width, height, seed):
+    rng = numpy.random.default_rng(seed)
+    y, x = numpy.mgrid[0:height, 0:width]
+    pixels = numpy.empty((height, width, 4))
+    pixels[..., 0] = 128 + 127*numpy.sin(x/17)
+    pixels[..., 1] = 255*y/height
+    pixels[..., 2] = 128 + 127*numpy.cos((x+y)/29)
+    pixels[..., :3] += rng.normal(0, 12, (height, width, 3))
+    pixels[..., 3] = 255
+    pixels[(x - width/2)**2 + (y - height/2)**2 < (width/5)**2, 3] = 0
+
+    return Image.fromarray(numpy.clip(pixels, 0, 255).astype(numpy.uint8), "RGBA")
+
+
+def psnr(image_format, encoded, image):
+    # Peak signal-to-noise ratio of the opaque pixels of the encoded image data in dB
+    data, palette_data, num_colors = encoded
+    decoded = decode_image_array(data, palette_data, image_format, PALETTE_FORMAT, num_colors,
+                                 image.width, image.height).astype(numpy.float64)
+    original = numpy.asarray(image).astype(numpy.float64)
+    opaque = original[..., 3] >= 16
+    error = ((decoded[..., :3] - original[..., :3])**2)[opaque].mean()
+    if error == 0:
+        return float("inf")
+    return 10*numpy.log10(255**2 / error)
+
+
+def measure(func, repeats):
+    # Returns the times of all repeats in seconds and the result of the last run
+    times = []
+    result = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    return times, result
+
+
+def encodes_fast(image_format):
+    return texture_utils.NUMPY_INSTALLED and image_format.name in texture_utils.texture_arrays.ENCODED_FORMATS
+
+
+def run_format(image_format, size, seed, repeats, slow):
+    image_data, palette_data, num_colors = make_texture(image_format, size, size, seed)
+
+    def decode(func):
+        return lambda: func(BytesIO(image_data), BytesIO(palette_data), image_format, PALETTE_FORMAT,
+                            num_colors, size, size)
+
+    def encode(func, generate_palettes, **kwargs):
+        def run():
+            encoded_colors, color_indexes = generate_palettes(source, image_format, PALETTE_FORMAT)
+            data = func(source, image_format, color_indexes, size, size, **kwargs).getvalue()
+            return data, encode_palette(encoded_colors, PALETTE_FORMAT, image_format).getvalue(), len(encoded_colors)
+        return run
+
+    result = {"format": image_format.name, "identical": {}, "psnr": {}}
+    times, image = measure(decode(decode_image), repeats)
+    result["decode"] = {"min": min(times), "median": median(times), "runs": times}
+
+    if slow:
+        times, slow_image = measure(decode(decode_image_slow), 1)
+        result["decode_slow"] = times[0]
+        result["identical"]["decode"] = image.tobytes() == slow_image.tobytes()
+
+    if encodes_fast(image_format):
+        source = make_image(size, size, seed)
+        if image_format in (ImageFormat.C4, ImageFormat.C8):
+            source = source.quantize(MAX_COLORS_FOR_IMAGE_FORMAT[image_format]).convert("RGBA")
+        times, encoded = measure(encode(encode_mipmap_image, generate_new_palettes_from_image), repeats)
+        result["encode"] = {"min": min(times), "median": median(times), "runs": times}
+
+        if image_format in LOSSY_FORMATS:
+            result["psnr"]["encode"] = psnr(image_format, encoded, source)
+        if image_format == ImageFormat.CMPR:
+            times, refined = measure(encode(encode_mipmap_image, generate_new_palettes_from_image,
+                                            refine_cmpr=True), repeats)
+            result["refine"] = {"min": min(times), "median": median(times), "runs": times}
+            result["psnr"]["refine"] = psnr(image_format, refined, source)
+
+        if slow and (image_format != ImageFormat.C14X2 or size <= SLOW_C14X2_MAX_SIZE):
+            times, slow_encoded = measure(encode(encode_mipmap_image_slow, generate_new_palettes_from_image_slow), 1)
+            result["encode_slow"] = times[0]
+            if image_format in LOSSY_FORMATS:
+                result["psnr"]["encode_slow"] = psnr(image_format, slow_encoded, source)
+            else:
+                result["identical"]["encode"] = encoded == slow_encoded
+
+    return result
+
+
+def print_times(name, operation, result):
+    if operation not in result:
+        return
+    line = "{0:8} {1:8} min {2:9.2f} ms   median {3:9.2f} ms".format(
+        name, operation, result[operation]["min"]*1000, result[operation]["median"]*1000)
+    if operation in result["psnr"]:
+        line += "   PSNR {0:6.2f} dB".format(result["psnr"][operation])
+    slow = result.get(operation + "_slow")
+    if slow is not None:
+        line += "   block by block {0:9.1f} ms ({1:.0f}x)".format(slow*1000, slow / result[operation]["min"])
+        if operation + "_slow" in result["psnr"]:
+            line += "   PSNR {0:6.2f} dB".format(result["psnr"][operation + "_slow"])
+        elif not result["identical"][operation]:
+            line += "   NOT identical"
+    print(line)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the texture decoder and encoder for every image format.")
+    parser.add_argument("--size", type=int, default=512, help="Width and height of the images.")
+    parser.add_argument("--formats", nargs="+", default=None, choices=[x.name for x in ImageFormat],
+                        help="Image formats to measure, default is all of them.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--skip-slow", action="store_true", help="Don't run the block by block decoder and encoder.")
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this path.")
+
+    args = parser.parse_args()
+
+    if not texture_utils.NUMPY_INSTALLED:
+        print("NumPy isn't installed, the block by block decoder and encoder are used")
+
+    formats = [ImageFormat[name] for name in args.formats] if args.formats else list(ImageFormat)
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "size": args.size,
+        "repeats": args.repeats,
+        "formats": [],
+    }
+
+    print("{0}x{0} images".format(args.size))
+    failed = False
+    for image_format in formats:
+        result = run_format(image_format, args.size, args.seed, args.repeats, not args.skip_slow)
+        results["formats"].append(result)
+
+        print_times(image_format.name, "decode", result)
+        print_times(image_format.name, "encode", result)
+        print_times(image_format.name, "refine", result)
+        if not all(result["identical"].values()):
+            failed = True
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+    if failed:
+        sys.exit(1)
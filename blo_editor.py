@@ -4,7 +4,6 @@ from timeit import default_timer
 from copy import deepcopy
 from io import TextIOWrapper, BytesIO, StringIO
 from math import sin, cos, atan2
-import json
 import PyQt5.QtWidgets as QtWidgets
 import PyQt5.QtCore as QtCore
 from PyQt5.QtCore import Qt
@@ -32,6 +31,7 @@ from lib.libbol import BOL, MGEntry, Route, get_full_name
 import lib.libbol as libbol
 import lib.blo.readblo2 as readblo2
 from lib.rarc import Archive
+from lib.yaz0 import DEFAULT_LEVEL, COMPRESSION_LEVELS
 from lib.BCOllider import RacetrackCollision
 from lib.model_rendering import TexturedModel, CollisionModel, Minimap
 from widgets.editor_widgets import ErrorAnalyzer
@@ -40,6 +40,7 @@ from widgets.file_select import FileSelect
 from PyQt5.QtWidgets import QTreeWidgetItem
 from lib.bmd_render import clear_temp_folder, load_textured_bmd
 from lib.blo.readblo2 import ScreenBlo, Pane
+from lib.blo.jsonstream import write_json_file
 from widgets.texture_handler_widget import TextureHandlerMenu
 from lib.blo.tex.textures import ImageTooLarge
 from widgets.bckwidget.bckmenu import BCKAnimationMenu
@@ -75,6 +76,8 @@ class LayoutEditor(QMainWindow):
         self.level_view.visibility_menu = self.visibility_menu
         self.level_view.main_program = self
         self.level_view.texture_handler = self.texture_menu.texture_handler
+        self.texture_menu.texture_handler.textures_loaded.connect(self.textures_loaded)
+        self.texture_menu.texture_handler.textures_failed.connect(self.textures_failed)
         self.pathsconfig = self.configuration["default paths"]
         self.editorconfig = self.configuration["editor"]
         self.current_gen_path = None
@@ -349,6 +352,19 @@ class LayoutEditor(QMainWindow):
     def delete_texture(self, texture):
         self.texture_menu.texture_handler.delete_texture(texture.bound_to)
 
+    def textures_loaded(self, names):
+        # Textures are loaded in the background, a selected texture gets its editor again
+        # once its image is there
+        selected = self.level_view.selected
+        if (len(selected) == 1 and isinstance(selected[0], tree_view.Texture)
+                and selected[0].bound_to.lower() in names):
+            self.action_update_info()
+        self.update_3d()
+
+    def textures_failed(self, errors):
+        open_error_dialog("The following textures couldn't be loaded and won't be saved:\n{0}".format(
+            "\n".join("{0}: {1}".format(name, error) for name, error in errors)), self)
+
     def get_selected(self) -> Pane:
         if len(self.level_view.selected) > 0:
             return self.level_view.selected[0]
@@ -385,7 +401,7 @@ class LayoutEditor(QMainWindow):
         if blo_item.parent is not None:
             parent: readblo2.Pane = blo_item.parent
             assert blo_item in parent.child.children
-            parent.child.children.remove(blo_item)
+            self.layout_file.remove_pane(blo_item)
 
             self.layoutdatatreeview.set_objects_remember_expanded(self.layout_file)
         self.update_3d()
@@ -478,8 +494,7 @@ class LayoutEditor(QMainWindow):
                     try:
                         self.loaded_archive_file = None
                         self.loaded_archive = None
-                        json_data = json.load(f)
-                        blo_file = ScreenBlo.deserialize(json_data)
+                        blo_file = ScreenBlo.from_json(f)
 
                         self.setup_blo_file(blo_file, filepath)
                         self.layoutdatatreeview.set_objects(blo_file)
@@ -526,6 +541,25 @@ class LayoutEditor(QMainWindow):
         save_cfg(self.configuration)
         self.current_gen_path = filepath
 
+    def get_yaz0_level(self):
+        level = self.editorconfig.get("yaz0_compression", DEFAULT_LEVEL)
+        if level not in COMPRESSION_LEVELS:
+            print("Warning: Unknown yaz0_compression level {0!r} in the config, using {1!r}".format(
+                level, DEFAULT_LEVEL))
+            level = DEFAULT_LEVEL
+        return level
+
+    def write_loaded_archive(self, path):
+        # The archive is written to memory first so that an error doesn't leave a truncated file behind
+        tmp = BytesIO()
+        if path.endswith(".szs"):
+            self.loaded_archive.write_arc_compressed(tmp, pad=True, level=self.get_yaz0_level())
+        else:
+            self.loaded_archive.write_arc(tmp)
+
+        with open(path, "wb") as f:
+            f.write(tmp.getvalue())
+
     @catch_exception_with_dialog
     def button_save_file(self, *args, **kwargs):
         if self.current_gen_path is not None:
@@ -535,7 +569,7 @@ class LayoutEditor(QMainWindow):
                 scrn = root["scrn"]
 
                 tmp = BytesIO()
-                self.layout_file.write(tmp)
+                self.layout_file.write(tmp, cached=True)
 
                 blo_file = scrn[self.loaded_archive_file]
                 blo_file.seek(0)
@@ -549,24 +583,17 @@ class LayoutEditor(QMainWindow):
                     self.texture_menu.texture_handler.save_to_archive_folder(self.layout_file.root.textures.references,
                                                                              img)
 
-                with open(self.current_gen_path, "wb") as f:
-                    if self.current_gen_path.endswith(".szs"):
-                        self.loaded_archive.write_arc_compressed(f, pad=True)
-                    else:
-                        self.loaded_archive.write_arc(f)
+                self.write_loaded_archive(self.current_gen_path)
 
                 self.set_has_unsaved_changes(False)
                 self.statusbar.showMessage("Saved to {0}".format(self.current_gen_path))
 
             else:
                 if self.current_gen_path.lower().endswith(".json"):
-                    json_data = json.dumps(self.layout_file.serialize(), indent=4, ensure_ascii=False)
-
-                    with open(self.current_gen_path, "w", encoding="utf-8") as f:
-                        f.write(json_data)
+                    write_json_file(self.current_gen_path, self.layout_file)
                 else:
                     tmp = BytesIO()
-                    self.layout_file.write(tmp)
+                    self.layout_file.write(tmp, cached=True)
                     with open(self.current_gen_path, "wb") as f:
                         f.write(tmp.getvalue())
                 self.set_has_unsaved_changes(False)
@@ -610,23 +637,16 @@ class LayoutEditor(QMainWindow):
 
                 self.level_file.write(blo_file)
 
-                with open(self.current_gen_path, "wb") as f:
-                    if self.current_gen_path.endswith(".szs"):
-                        self.loaded_archive.write_arc_compressed(f, pad=True)
-                    else:
-                        self.loaded_archive.write_arc(f)
+                self.write_loaded_archive(self.current_gen_path)
 
                 self.set_has_unsaved_changes(False)
                 self.statusbar.showMessage("Saved to {0}".format(self.current_gen_path))
             else:
                 if filepath.lower().endswith(".json"):
-                    json_data = json.dumps(self.layout_file.serialize(), indent=4, ensure_ascii=False)
-
-                    with open(filepath, "w", encoding="utf-8") as f:
-                        f.write(json_data)
+                    write_json_file(filepath, self.layout_file)
                 else:
                     tmp = BytesIO()
-                    self.layout_file.write(tmp)
+                    self.layout_file.write(tmp, cached=True)
                     with open(filepath, "wb") as f:
                         f.write(tmp.getvalue())
 
@@ -1293,18 +1313,33 @@ class EditorHistory(object):
         return item
 
 
+def _find_file_name(rarc_folder, ending):
+    # Name of the first file directly in rarc_folder ending with ending, or None. The path index
+    # of the archive is case-insensitive, so its results are checked against the actual names.
+    paths = [path for path in rarc_folder.find_suffix(ending) if "/" not in path]
+    names = [path for path in paths if path.endswith(ending) and path in rarc_folder.files]
+    if len(names) == 1 and len(paths) == 1:
+        return names[0]
+    elif paths:
+        # Several matches or names only differing in case, keep the order of the folder
+        for filename in rarc_folder.files.keys():
+            if filename.endswith(ending):
+                return filename
+    return None
+
+
 def find_file(rarc_folder, ending):
-    for filename in rarc_folder.files.keys():
-        if filename.endswith(ending):
-            return filename
-    raise RuntimeError("No Course File found!")
+    filename = _find_file_name(rarc_folder, ending)
+    if filename is None:
+        raise RuntimeError("No Course File found!")
+    return filename
 
 
 def get_file_safe(rarc_folder, ending):
-    for filename in rarc_folder.files.keys():
-        if filename.endswith(ending):
-            return rarc_folder.files[filename]
-    return None
+    filename = _find_file_name(rarc_folder, ending)
+    if filename is None:
+        return None
+    return rarc_folder.files[filename]
 
 
 import sys
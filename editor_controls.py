@@ -233,6 +233,7 @@ class Gizmo2DActions(ClickDragAction):
 
                 pane.p_rotation = round(self.accumulate_rotation/5)*5
 
+        editor.layout_file.set_dirty(pane)
 
         """if editor.gizmo.was_hit["gizmo_x"]:
             editor.gizmo.hidden = True
@@ -407,6 +408,7 @@ class BoxManipulatorHandler(ClickDragAction):
             #print(diffx, diffy, diff_box_change)
 
             pane.resize(diff_change.x, -diff_change.y, diff_box_change.x, -diff_box_change.y)
+            editor.layout_file.set_dirty(pane)
 
             self.first_click.x = event.x()
             self.first_click.y = event.y()
@@ -0,0 +1,289 @@
+import os
+import sys
+import json
+import traceback
+from io import BytesIO
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+
+from .readblo2 import ScreenBlo
+from .jsonstream import write_json_file
+from ..rarc import Archive, Directory
+from ..yaz0 import COMPRESSION_LEVELS, DEFAULT_LEVEL
+
+# Converts whole directory trees of BLO files and archives containing BLO files to JSON and back
+# without the editor. Only uses the BLO and archive libraries so it doesn't need PyQt5 or OpenGL.
+#
+# tojson: x.blo -> x.blo.json, archive x.szs -> directory x.szs_json with one JSON file
+#         for every BLO in the archive, e.g. x.szs_json/blo/scrn/menu.blo.json
+# toblo:  x.blo.json -> x.blo, archive x.szs with a x.szs_json directory next to it is rebuilt
+#         with the BLO files replaced by the ones converted from the JSON files.
+#
+# Every archive is converted by one worker process, loose files are spread over all workers.
+
+MODE_TOJSON = "tojson"
+MODE_TOBLO = "toblo"
+
+BLO_EXTENSION = ".blo"
+JSON_EXTENSION = ".json"
+ARCHIVE_EXTENSIONS = (".arc", ".szs")
+ARCHIVE_JSON_SUFFIX = "_json"
+
+# Full tracebacks in the error report, set in the worker processes
+VERBOSE = False
+
+
+def blo_to_json(f, path):
+    blo = ScreenBlo.from_file(f)
+    # Same format as the JSON files saved by the editor
+    make_dirs(path)
+    write_json_file(path, blo)
+
+
+def json_to_blo(f):
+    blo = ScreenBlo.from_json(f)
+    out = BytesIO()
+    blo.write(out)
+    return out.getvalue()
+
+
+def blo_json_name(path):
+    # Name of the BLO file a JSON file is converted back to
+    if path.lower().endswith(BLO_EXTENSION + JSON_EXTENSION):
+        return path[:-len(JSON_EXTENSION)]
+    elif path.lower().endswith(JSON_EXTENSION):
+        return path[:-len(JSON_EXTENSION)] + BLO_EXTENSION
+    else:
+        return path + BLO_EXTENSION
+
+
+def make_dirs(path):
+    # Creates the directories a file is written to
+    dirpath = os.path.dirname(path)
+    if dirpath:
+        os.makedirs(dirpath, exist_ok=True)
+
+
+def write_file(path, data):
+    make_dirs(path)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def convert_blo_file(src, dst):
+    with open(src, "rb") as f:
+        blo_to_json(f, dst)
+    return [(src, dst, None)]
+
+
+def convert_json_file(src, dst):
+    with open(src, "r", encoding="utf-8") as f:
+        data = json_to_blo(f)
+    write_file(dst, data)
+    return [(src, dst, None)]
+
+
+def convert_archive_to_json(src, dst):
+    # dst is the directory the JSON files are written to
+    results = []
+    with open(src, "rb") as f:
+        archive = Archive.from_file(f)
+
+    for path in archive.glob("*" + BLO_EXTENSION):
+        name = "{0}:{1}".format(src, path)
+        outpath = os.path.join(dst, *path.split("/")) + JSON_EXTENSION
+        try:
+            file = archive.find(path)
+            file.seek(0)
+            blo_to_json(file, outpath)
+        except Exception as error:
+            results.append((name, outpath, format_error(error)))
+        else:
+            results.append((name, outpath, None))
+
+    return results
+
+
+def convert_json_to_archive(src, jsondir, dst, level):
+    # Replaces the BLO files in archive src with the converted JSON files in jsondir, writes the new archive to dst
+    results = []
+    with open(src, "rb") as f:
+        archive = Archive.from_file(f)
+
+    for dirpath, dirnames, filenames in os.walk(jsondir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.lower().endswith(JSON_EXTENSION):
+                continue
+
+            jsonpath = os.path.join(dirpath, filename)
+            path = os.path.relpath(blo_json_name(jsonpath), jsondir).replace(os.sep, "/")
+            name = "{0}:{1}".format(dst, path)
+            try:
+                file = archive.find(path)
+                if isinstance(file, Directory):
+                    raise RuntimeError("{0} is a directory in the archive".format(path))
+
+                with open(jsonpath, "r", encoding="utf-8") as f:
+                    data = json_to_blo(f)
+
+                file.seek(0)
+                file.truncate()
+                file.write(data)
+            except Exception as error:
+                results.append((jsonpath, name, format_error(error)))
+            else:
+                results.append((jsonpath, name, None))
+
+    # Nothing is written if any of the layouts couldn't be converted, half-updated archives
+    # are worse than outdated ones.
+    if any(error is not None for src_, dst_, error in results):
+        return results
+
+    try:
+        out = BytesIO()
+        if dst.lower().endswith(".szs"):
+            archive.write_arc_compressed(out, pad=True, level=level)
+        else:
+            archive.write_arc(out)
+        write_file(dst, out.getbuffer())
+    except Exception as error:
+        results.append((src, dst, format_error(error)))
+
+    return results
+
+
+def format_error(error):
+    if VERBOSE:
+        return traceback.format_exc()
+    return "{0}: {1}".format(type(error).__name__, error)
+
+
+def run_job(job):
+    # Runs in the worker processes. Converting prints a lot of debug output which is hidden
+    # unless verbose output is enabled.
+    global VERBOSE
+    func, args, verbose = job
+    VERBOSE = verbose
+
+    with open(os.devnull, "w") as devnull:
+        with redirect_stdout(sys.stdout if verbose else devnull):
+            try:
+                return func(*args)
+            except Exception as error:
+                return [(args[0], args[1], format_error(error))]
+
+
+def find_jobs(mode, inputs, outputdir, level):
+    # Returns a list of (function, arguments, size) tuples
+    jobs = []
+
+    def outpath(path, base):
+        if outputdir is None:
+            return path
+        else:
+            return os.path.join(outputdir, os.path.relpath(path, base))
+
+    for inputpath in inputs:
+        inputpath = os.path.normpath(inputpath)
+        if os.path.isdir(inputpath):
+            base = inputpath
+            paths = []
+            for dirpath, dirnames, filenames in os.walk(inputpath):
+                dirnames.sort()
+                paths.extend(os.path.join(dirpath, filename) for filename in sorted(filenames))
+        else:
+            base = os.path.dirname(inputpath)
+            paths = [inputpath]
+
+        archive_jsondirs = []
+        if mode == MODE_TOBLO:
+            for path in paths:
+                jsondir = path + ARCHIVE_JSON_SUFFIX
+                if path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isdir(jsondir):
+                    archive_jsondirs.append(jsondir + os.sep)
+                    jobs.append((convert_json_to_archive, (path, jsondir, outpath(path, base), level),
+                                 os.path.getsize(path)))
+
+        for path in paths:
+            lowerpath = path.lower()
+            if mode == MODE_TOJSON:
+                if lowerpath.endswith(BLO_EXTENSION):
+                    jobs.append((convert_blo_file, (path, outpath(path, base) + JSON_EXTENSION),
+                                 os.path.getsize(path)))
+                elif lowerpath.endswith(ARCHIVE_EXTENSIONS):
+                    jobs.append((convert_archive_to_json, (path, outpath(path, base) + ARCHIVE_JSON_SUFFIX),
+                                 os.path.getsize(path)))
+            elif lowerpath.endswith(JSON_EXTENSION):
+                # JSON files belonging to an archive are converted by the archive's job
+                if not any(path.startswith(jsondir) for jsondir in archive_jsondirs):
+                    jobs.append((convert_json_file, (path, blo_json_name(outpath(path, base))),
+                                 os.path.getsize(path)))
+
+    return jobs
+
+
+def convert(mode, inputs, outputdir=None, processes=None, level=DEFAULT_LEVEL, verbose=False):
+    # Returns a list of (source, destination, error) tuples, error is None for converted files
+    jobs = find_jobs(mode, inputs, outputdir, level)
+    # Biggest jobs first so that no worker is left with a big archive at the end
+    jobs.sort(key=lambda job: job[2], reverse=True)
+    jobs = [(func, args, verbose) for func, args, size in jobs]
+
+    results = []
+    if processes == 1 or len(jobs) <= 1:
+        for job in jobs:
+            results.extend(run_job(job))
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            for result in executor.map(run_job, jobs):
+                results.extend(result)
+
+    results.sort(key=lambda result: result[0])
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert BLO files and archives containing BLO files to JSON and back.")
+    parser.add_argument("mode", choices=(MODE_TOJSON, MODE_TOBLO),
+                        help="tojson converts .blo files and the BLO files in .arc/.szs archives to JSON. "
+                             "toblo converts .json files to .blo files and rebuilds archives that have "
+                             "a <archive>_json directory next to them.")
+    parser.add_argument("input", nargs="+",
+                        help="Files or directories, directories are searched recursively.")
+    parser.add_argument("--output", default=None,
+                        help="Directory the converted files are written to, keeping the directory structure "
+                             "of the inputs. By default they are written next to the input files.")
+    parser.add_argument("--processes", default=None, type=int,
+                        help="Number of worker processes. Default is the number of CPU cores.")
+    parser.add_argument("--yaz0level", default=DEFAULT_LEVEL, choices=COMPRESSION_LEVELS,
+                        help="Yaz0 compression level for rebuilt .szs archives. Default is {0}".format(DEFAULT_LEVEL))
+    parser.add_argument("--report", default=None,
+                        help="Write a JSON report with the result of every file to this path.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Show the debug output of the converter and full tracebacks for errors.")
+
+    args = parser.parse_args()
+
+    results = convert(args.mode, args.input, args.output, args.processes, args.yaz0level, args.verbose)
+
+    failed = 0
+    for src, dst, error in results:
+        if error is None:
+            print("Converted {0} -> {1}".format(src, dst))
+        else:
+            failed += 1
+            print("FAILED {0}: {1}".format(src, error))
+
+    print("{0} converted, {1} failed".format(len(results)-failed, failed))
+
+    if args.report is not None:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump([{"source": src, "destination": dst, "error": error} for src, dst, error in results],
+                      f, indent=4, ensure_ascii=False)
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,141 @@
+import os
+import re
+import json
+
+# Streaming JSON for BLO layouts. Layouts are written and read one pane or section at a time
+# instead of going through one big nested list or one big string, so memory use depends on
+# how deep the layout is nested and not on how large it is.
+# The text is the same as json.dumps(layout.serialize(), indent=4, ensure_ascii=False).
+
+INDENT = 4
+CHUNK_SIZE = 0x10000
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def indent(level):
+    return " "*(INDENT*level)
+
+
+def write_value(f, obj, level):
+    # Writes obj as a value that is nested level lists or dicts deep
+    text = json.dumps(obj, indent=INDENT, ensure_ascii=False)
+    if level > 0:
+        text = text.replace("\n", "\n" + indent(level))
+    f.write(text)
+
+
+def write_json_file(path, layout):
+    # The layout is written to a temporary file first so that an error halfway through
+    # doesn't leave a broken file behind
+    tmppath = path + ".tmp"
+    try:
+        with open(tmppath, "w", encoding="utf-8") as f:
+            layout.write_json(f)
+        os.replace(tmppath, path)
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+
+
+class ListWriter(object):
+    # Writes a JSON list one item at a time. Items are written with write(), or with next_item()
+    # followed by writing the item directly to the file with the list's level + 1.
+    def __init__(self, f, level):
+        self.f = f
+        self.level = level
+        self.empty = True
+        f.write("[")
+
+    def next_item(self):
+        if self.empty:
+            self.f.write("\n")
+            self.empty = False
+        else:
+            self.f.write(",\n")
+        self.f.write(indent(self.level+1))
+
+    def write(self, obj):
+        self.next_item()
+        write_value(self.f, obj, self.level+1)
+
+    def close(self):
+        if not self.empty:
+            self.f.write("\n")
+            self.f.write(indent(self.level))
+        self.f.write("]")
+
+
+class ListReader(object):
+    # Reads a JSON list from a text file one item at a time. Nested lists are returned as
+    # iterators over their items which have to be read to the end before the next item
+    # of the outer list, everything else is decoded with the json module.
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+
+    def _fill(self, size):
+        # Reads more text, returns False at the end of the file
+        data = self.f.read(size)
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _error(self, message):
+        return json.JSONDecodeError(message, self.buffer, self.pos)
+
+    def _peek(self):
+        # Skips whitespace and returns the next character, "" at the end of the file
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                return ""
+
+    def _read_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value continues after the end of the buffer. The buffer grows with every
+                # try so that large values are decoded a few times at most.
+                if not self._fill(max(self.chunk_size, len(self.buffer))):
+                    raise
+                continue
+
+            # A number at the end of the buffer might continue in the file
+            if end == len(self.buffer) and self._fill(self.chunk_size):
+                continue
+
+            self.pos = end
+            return value
+
+    def iter_list(self):
+        if self._peek() != "[":
+            raise self._error("Expecting '['")
+        self.pos += 1
+
+        if self._peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            if self._peek() == "[":
+                yield self.iter_list()
+            else:
+                yield self._read_value()
+
+            char = self._peek()
+            if char == "]":
+                self.pos += 1
+                return
+            elif char != ",":
+                raise self._error("Expecting ',' delimiter")
+            self.pos += 1
@@ -5,6 +5,8 @@ from .enums import *
 
 
 class Color(object):
+    __slots__ = ("r", "g", "b", "a")
+
     def __init__(self, r, g, b, a):
         self.r = r
         self.g = g
@@ -22,6 +24,13 @@ class Color(object):
 
         return cls(r, g, b, a)
 
+    @classmethod
+    def from_buffer(cls, data, start, i):
+        offset = start + i*4
+        r, g, b, a = data[offset:offset+4]
+
+        return cls(r, g, b, a)
+
     def write(self, f):
         write_uint8(f, self.r)
         write_uint8(f, self.g)
@@ -39,6 +48,9 @@ class Color(object):
     def __eq__(self, other):
         return self.r == other.r and self.g == other.g and self.b == other.b and self.a == other.a
 
+    def __hash__(self):
+        return hash((self.r, self.g, self.b, self.a))
+
 """
 class ChannelControl(object):
     def __init__(self):
@@ -105,6 +117,13 @@ class UnknownData(object):
         else:
             return cls.from_file(f)
 
+    @classmethod
+    def from_buffer(cls, data, start, i, remember_index=False):
+        offset = start + i*cls.size
+        obj = cls(i if remember_index else None)
+        obj.data = bytes(data[offset:offset+cls.size])
+        return obj
+
     def write(self, f):
         assert len(self.data) == self.size
         f.write(self.data)
@@ -138,6 +157,9 @@ class UnknownData(object):
         assert type(self) == type(other)
         return self.data == other.data and self.index == other.index
 
+    def __hash__(self):
+        return hash((self.data, self.index))
+
 
 class ChannelControl(UnknownData):
     size = 4
@@ -1,4 +1,5 @@
 from enum import Enum, IntEnum
+from struct import unpack_from
 from ..binary_io import *
 
 
@@ -20,6 +21,12 @@ class GXEnum(object):
         cullmode.value = cls.enum(value)
         return cullmode
 
+    @classmethod
+    def from_buffer(cls, data, start, i):
+        cullmode = cls()
+        cullmode.value = cls.enum(data[start + i])
+        return cullmode
+
     def write(self, f):
         write_uint8(f, self.value)
 
@@ -39,6 +46,9 @@ class GXEnum(object):
     def __eq__(self, other):
         return type(self) == type(other) and self.value == other.value
 
+    def __hash__(self):
+        return hash((type(self), self.value))
+
 
 class GXEnum_4_byte(GXEnum):
     @classmethod
@@ -53,6 +63,12 @@ class GXEnum_4_byte(GXEnum):
         cullmode.value = cls.enum(value)
         return cullmode
 
+    @classmethod
+    def from_buffer(cls, data, start, i):
+        cullmode = cls()
+        cullmode.value = cls.enum(unpack_from(">I", data, start + i*4)[0])
+        return cullmode
+
     def write(self, f):
         write_uint32(f, self.value)
 
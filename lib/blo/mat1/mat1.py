@@ -1,8 +1,10 @@
 import struct
+from struct import Struct, unpack_from
 from binascii import hexlify
 from copy import deepcopy
 
 from ..binary_io import *
+from ..jsonstream import ListWriter, indent
 from .enums import *
 from .datatypes import *
 
@@ -46,6 +48,20 @@ class StringTable(object):
                 stringtable.strings.append(f.read(string_length).decode("shift-jis"))
             
         return stringtable 
+
+    @classmethod
+    def from_buffer(cls, data, start):
+        stringtable = cls()
+        string_count = unpack_from(">H", data, start)[0]
+
+        for i in range(string_count):
+            hash, string_offset = unpack_from(">HH", data, start + 4 + i*4)
+            # 0-terminated string
+            string_start = start + string_offset
+            string_end = data.index(b"\x00", string_start)
+            stringtable.strings.append(bytes(data[string_start:string_end]).decode("shift-jis"))
+
+        return stringtable
             
     def hash_string(self, string):
         hash = 0
@@ -92,9 +108,44 @@ class StringTable(object):
         return stringtable
 
 
+class DataArray(object):
+    # One of the data arrays written to the MAT1 section. The values keep their order, a dict from
+    # value to the index of its first occurrence replaces searching the list for every lookup.
+    def __init__(self, values=()):
+        self.values = []
+        self.indices = {}
+
+        for value in values:
+            self.append(value)
+
+    def append(self, value):
+        if value not in self.indices:
+            self.indices[value] = len(self.values)
+        self.values.append(value)
+
+    def index_or_add(self, value):
+        index = self.indices.get(value)
+        if index is None:
+            index = len(self.values)
+            self.append(value)
+
+        return index
+
+    def __contains__(self, value):
+        return value in self.indices
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+
 def get_index_or_add(array, value):
     if value is None:
         return -1
+    elif isinstance(array, DataArray):
+        return array.index_or_add(value)
     elif value in array:
         return array.index(value)
     else:
@@ -169,168 +220,99 @@ class DebugFileInfo(object):
 debug = DebugFileInfo("debug.txt")
 
 
-class MaterialInitData(object):
-    def __init__(self):
-        self.name = ""
-        
-    @classmethod
-    def from_array(cls, f, start, i, offsets, real_i):
-        initdata = cls()
-        #start = f.tell()
-        
-        f.seek(start + i * 0xE8) # 0xE8 is size of Material Init Data entry
-        initdatastart = f.tell()
-        debug.add_offset("MaterialInitData {0}".format(i), initdatastart)
-        
-        #f.seek(start)
-        if offsets["IndirectInitData"] != 0:
-            initdata.indirectdata = IndirectInitData.from_array(f, offsets["IndirectInitData"], real_i)
-        else:
-            initdata.indirectdata = None
-
-        initdata.flag = read_int8_at(f, initdatastart + 0x0)
-        cullmodeIndex = read_int8_at(f, initdatastart + 0x1)
-
+# Material Init Data entry, 0xE8 bytes. Apart from the first 8 bytes and the TevKColor/TevKAlpha selections
+# the values are indices into the data arrays of the MAT1 section, -1 if unused.
+MATERIAL_INIT_DATA = Struct(">8b2h4h8h8h4x8hh4h16b16b16h4h16h16h4hhhh")
 
-        initdata.cullmode = CullModeSetting.from_array(f, offsets["GXCullMode"], cullmodeIndex)
 
-        colorChannelNumIndex = read_int8_at(f, initdatastart + 0x2)
-        initdata.color_channel_count = read_uint8_at(f, offsets["UcArray2_ColorChannelCount"]+colorChannelNumIndex)
+def decode_material(data, offsets, i, real_i):
+    # Returns the attributes of material init data entry i in the order MaterialInitData has them,
+    # offsets are relative to the start of data
+    values = MATERIAL_INIT_DATA.unpack_from(data, offsets["MaterialInitData"] + i * 0xE8)
+    (flag, cullmode_index, color_channel_num_index, tex_gen_num_index, tev_stage_num_index, dither_index, unk,
+     padding) = values[0:8]
 
-        texGenNumIndex = read_int8_at(f, initdatastart + 0x3)
-        initdata.tex_gen_count = read_uint8_at(f, offsets["UcArray3_TexGenCount"]+texGenNumIndex)
-        debug.add_line("TexGenCount: 0x{0:x}".format(initdata.tex_gen_count))
-        tevStageNumIndex = read_int8_at(f, initdatastart + 0x4)
-        initdata.tev_stage_count = read_uint8_at(f, offsets["UCArray6_Tevstagenums"] + tevStageNumIndex)
-
-        ditherIndex = read_int8_at(f, initdatastart + 0x5)
-        
-        initdata.dither = read_uint8_at(f, offsets["UcArray7_Dither"] + ditherIndex)
-        #debug.add_offset("ditherIndex", initdatastart + 0x5, ditherIndex, initdata.dither)
-        unk = read_int8_at(f, initdatastart + 0x6)
-        initdata.unk = unk
-        
-        # 0x7 padding
-        assert read_int8_at(f, initdatastart + 0x7) == 0x00
-        
-        # 2 Mat Colors starting at 0x8 (2 byte index)
-        matColorIndices = read_index_array(f, initdatastart + 0x8, 2, 2)
-        initdata.matcolors = []
-        for index in matColorIndices:
-            if index == -1:
-                initdata.matcolors.append(None)
-            else:
-                color = Color.from_array(f, offsets["MaterialColor"], index)
-                initdata.matcolors.append(color)
-        
-        # 4 ColorChans starting at 0xC (2 byte index) 
-        colorChanIndices = read_index_array(f, initdatastart + 0xC, 2, 4)
-        debug.add_offset("ColorChannelInfo", initdatastart + 0xC, *colorChanIndices)
-        initdata.color_channels = []
-        for i in range(4):
-            index = colorChanIndices[i]
-            if index == -1:
-                initdata.color_channels.append(None)
-            else:
-                initdata.color_channels.append(ChannelControl.from_array(f, offsets["ColorChannelInfo"], index))
-                #if i < 2 or initdata.color_channel_count != 0:
-                #    initdata.color_channels.append(ChannelControl.from_array(f, offsets["ColorChannelInfo"], index))
-                #else:
-                #    initdata.color_channels.append(None)
+    # 0x7 padding
+    assert padding == 0x00
+    # 2 byte padding at 0xE6
+    assert values[133] == 0x0000
 
+    def indexed(cls, datatype, indices, remember_index=False):
+        start = offsets[datatype]
+        return [None if index == -1 else cls.from_buffer(data, start, index, remember_index) for index in indices]
 
+    def array(datatype, index, size=1):
+        return unpack_from(">B" if size == 1 else ">h", data, offsets[datatype] + index*size)[0]
 
-        # 8 texcoords starting at 0x14 (2 byte index)
-        texCoordIndices = read_index_array(f, initdatastart + 0x14, 2, 8)
-        initdata.tex_coord_generators = []
-        for index in texCoordIndices:
-            if index == -1:
-                initdata.tex_coord_generators.append(None)
-            else:
-                texcoord = TexCoordInfo.from_array(f, offsets["TexCoordInfo"], index, True)
-                initdata.tex_coord_generators.append(texcoord)
-
-        # 8 tex matrices starting at 0x24 (2 byte index) 
-        texMatrixIndices = read_index_array(f, initdatastart + 0x24, 2, 8)
-        initdata.tex_matrices = []
-        for index in texMatrixIndices:
-            texmatrix = None if index == -1 else TexMatrix.from_array(f, offsets["TexMatrixInfo"], index)
-            initdata.tex_matrices.append(texmatrix)
+    initdata = {}
+    if offsets["IndirectInitData"] != 0:
+        initdata["indirectdata"] = IndirectInitData.from_buffer(data, offsets["IndirectInitData"], real_i)
+    else:
+        initdata["indirectdata"] = None
+
+    initdata["flag"] = flag
+    initdata["cullmode"] = CullModeSetting.from_buffer(data, offsets["GXCullMode"], cullmode_index)
+    initdata["color_channel_count"] = array("UcArray2_ColorChannelCount", color_channel_num_index)
+    initdata["tex_gen_count"] = array("UcArray3_TexGenCount", tex_gen_num_index)
+    initdata["tev_stage_count"] = array("UCArray6_Tevstagenums", tev_stage_num_index)
+    initdata["dither"] = array("UcArray7_Dither", dither_index)
+    initdata["unk"] = unk
+
+    initdata["matcolors"] = [None if index == -1 else Color.from_buffer(data, offsets["MaterialColor"], index)
+                             for index in values[8:10]]  # 0x8
+    initdata["color_channels"] = indexed(ChannelControl, "ColorChannelInfo", values[10:14])  # 0xC
+    initdata["tex_coord_generators"] = indexed(TexCoordInfo, "TexCoordInfo", values[14:22], True)  # 0x14
+    initdata["tex_matrices"] = indexed(TexMatrix, "TexMatrixInfo", values[22:30])  # 0x24
+    # 0x34-0x37 padding
+    initdata["textures"] = [None if index == -1 else array("UsArray4_TextureIndices", index, 2)
+                            for index in values[30:38]]  # 0x38
+    initdata["font"] = indexed(FontNumber, "UsArray5", values[38:39])[0]  # 0x48
+    initdata["tevkcolors"] = indexed(TevKColor, "GXColor2_TevKColors", values[39:43])  # 0x4A
+    initdata["tevkcolor_selects"] = list(values[43:59])  # 0x52
+    initdata["tevkalpha_selects"] = list(values[59:75])  # 0x62
+    initdata["tevorders"] = indexed(TevOrder, "TevOrderInfo", values[75:91])  # 0x72
+    initdata["tevcolors"] = indexed(TevColor, "GXColorS10_TevColor", values[91:95])  # 0x92
+    initdata["tevstages"] = indexed(TevStage, "TevStageInfo2", values[95:111])  # 0x9A
+    initdata["tevstage_swapmodes"] = indexed(TevSwapMode, "TevSwapModeInfo", values[111:127], True)  # 0xBA
+    initdata["tev_swapmode_tables"] = indexed(TevSwapModeTable, "TevSwapModeTableInfo", values[127:131])  # 0xDA
+    initdata["alphacomp"] = AlphaCompare.from_buffer(data, offsets["AlphaCompInfo"], values[131])  # 0xE2
+    initdata["blend"] = Blend.from_buffer(data, offsets["BlendInfo"], values[132])  # 0xE4
+
+    return initdata
 
-        # 0x34-0x37 padding
-        
-        # Textures?
-        texcount = 0
-        
-        textureIndices = read_index_array(f, initdatastart + 0x38, 2, 8)
-        initdata.textures = []
-
-        for i in range(8):
-            index = read_int16_at(f, initdatastart + 0x38 + i*2)
-            if index != -1: # Up to 0x48
-                texcount += 1
-                initdata.textures.append(read_int16_at(f, offsets["UsArray4_TextureIndices"] + index*2))
-            else:
-                initdata.textures.append(None)
 
-        font_index = read_int16_at(f, initdatastart + 0x48)
+class MaterialInitData(object):
+    def __init__(self):
+        self.name = ""
 
-        initdata.font = None if font_index == -1 else FontNumber.from_array(f, offsets["UsArray5"], font_index)
-        
-        tevkcolor_indices = read_index_array(f, initdatastart + 0x4A, 2, 4)
-        initdata.tevkcolors = []
-        for index in tevkcolor_indices:
-            tevkcolor = None if index == -1 else TevKColor.from_array(f, offsets["GXColor2_TevKColors"], index)
-            initdata.tevkcolors.append(tevkcolor)
-
-        TevKColorSels = read_index_array(f, initdatastart + 0x52, 1, 16)
-        initdata.tevkcolor_selects = TevKColorSels
-
-        TevKAlphaSels = read_index_array(f, initdatastart + 0x62, 1, 16)
-        initdata.tevkalpha_selects = TevKAlphaSels
-
-        tevOrderIndices = read_index_array(f, initdatastart + 0x72, 2, 16)
-        initdata.tevorders = []
-        for index in tevOrderIndices:
-            tevorder = None if index == -1 else TevOrder.from_array(f, offsets["TevOrderInfo"], index)
-            initdata.tevorders.append(tevorder)
-
-        tevcolor_indices = read_index_array(f, initdatastart + 0x92, 2, 4)
-        initdata.tevcolors = []
-        for index in tevcolor_indices:
-            tevcolor = None if index == -1 else TevColor.from_array(f, offsets["GXColorS10_TevColor"], index)
-            initdata.tevcolors.append(tevcolor)
-        
-        tevstageIndices = read_index_array(f, initdatastart + 0x9A, 2, 16)
-        initdata.tevstages = []
-        for index in tevstageIndices:
-            tevstage = None if index == -1 else TevStage.from_array(f, offsets["TevStageInfo2"], index)
-            initdata.tevstages.append(tevstage)
-
-        tevstageSwapModes = read_index_array(f, initdatastart + 0xBA, 2, 16)
-        initdata.tevstage_swapmodes = []
-        for index in tevstageSwapModes:
-            swapmode = None if index == -1 else TevSwapMode.from_array(f, offsets["TevSwapModeInfo"], index, True)
-            initdata.tevstage_swapmodes.append(swapmode)
-
-
-        # 4 tevswapmode tables starting at 0xDA (2 byte index)
-        tevswapmodeTableIndices = read_index_array(f, initdatastart + 0xDA, 2, 4)
-        initdata.tev_swapmode_tables = []
-        for index in tevswapmodeTableIndices:
-            swapmode_table = None if index == -1 else TevSwapModeTable.from_array(f, offsets["TevSwapModeTableInfo"], index)
-            initdata.tev_swapmode_tables.append(swapmode_table)
-
-
-        alphacompIndex = read_int16_at(f, initdatastart + 0xE2)
-        initdata.alphacomp = AlphaCompare.from_array(f, offsets["AlphaCompInfo"], alphacompIndex)
-        blendIndex = read_int16_at(f, initdatastart + 0xE4)
-        initdata.blend = Blend.from_array(f, offsets["BlendInfo"], blendIndex)
-
-        # 2 byte padding
-        assert read_int16_at(f, initdatastart + 0xE6) == 0x0000
+    @classmethod
+    def from_buffer(cls, data, offsets, i, real_i, name=""):
+        # Only the name is read here, the rest of the material is decoded on first access (see load)
+        # because most materials of a layout are never looked at.
+        initdata = cls()
+        initdata.name = name
+        initdata._source = (data, offsets, i, real_i)
         return initdata
 
+    def __getattr__(self, name):
+        # Only called for attributes that don't exist, i.e. before the material is loaded
+        if name.startswith("__") or "_source" not in self.__dict__:
+            raise AttributeError("'{0}' object has no attribute '{1}'".format(type(self).__name__, name))
+        self.load()
+        return getattr(self, name)
+
+    def load(self):
+        if "_source" not in self.__dict__:
+            return
+
+        data, offsets, i, real_i = self.__dict__.pop("_source")
+        values = {"name": self.name}
+        values.update(decode_material(data, offsets, i, real_i))
+        # Attributes that were set before the material was loaded win
+        values.update(self.__dict__)
+        self.__dict__.clear()
+        self.__dict__.update(values)
+
     def write_and_fill_data(self, f, dataarrays):
         start = f.tell()
         write_int8(f, self.flag)  # 0x00
@@ -406,6 +388,7 @@ class MaterialInitData(object):
         assert f.tell() - start == 0xE8
 
     def serialize(self):
+        self.load()
         result = {}
         for k, v in self.__dict__.items():
             if isinstance(v, (UnknownData, GXEnum, Color)):
@@ -469,12 +452,66 @@ class MaterialInitData(object):
 
         return matinitdata
 
+
+# Offsets to these parts of the section follow the MAT1 header in this order
+MAT1_SECTIONS = ("MaterialInitData", "MaterialIndexRemapTable", "MaterialNames", "IndirectInitData", "GXCullMode",
+                 "MaterialColor", "UcArray2_ColorChannelCount", "ColorChannelInfo", "UcArray3_TexGenCount",
+                 "TexCoordInfo", "TexMatrixInfo", "UsArray4_TextureIndices", "UsArray5", "TevOrderInfo",
+                 "GXColorS10_TevColor", "GXColor2_TevKColors", "UCArray6_Tevstagenums", "TevStageInfo2",
+                 "TevSwapModeInfo", "TevSwapModeTableInfo", "AlphaCompInfo", "BlendInfo", "UcArray7_Dither")
+
         
+# Serialized material with texture names instead of indices
+def serialize_material(material, textures):
+    result = material.serialize()
+    if textures is not None:
+        names = result["textures"]
+        for i, val in enumerate(names):
+            if val is not None and val < len(textures.references):
+                names[i] = textures.references[val]
+
+    return result
+
+
 class MAT1(object):
     def __init__(self):
         self.name = "MAT1"
         #self.material_names = StringTable()
-        self.materials = []
+        self._materials = []
+        self._indices = {}  # Material name -> index of the first material with that name
+        self._indexed_count = 0
+
+    # Materials should be added, removed and renamed with the methods below so that the
+    # name index stays up to date. Setting the whole list rebuilds it.
+    @property
+    def materials(self):
+        return self._materials
+
+    @materials.setter
+    def materials(self, materials):
+        self._materials = materials
+        self._rebuild_indices()
+
+    def _rebuild_indices(self):
+        self._indices = {}
+        for i, material in enumerate(self._materials):
+            if material.name not in self._indices:
+                self._indices[material.name] = i
+        self._indexed_count = len(self._materials)
+
+    def add_material(self, material):
+        self._materials.append(material)
+        if self._indexed_count == len(self._materials) - 1:
+            self._indices.setdefault(material.name, len(self._materials) - 1)
+            self._indexed_count += 1
+
+    def remove_material(self, material):
+        self._materials.remove(material)
+        self._rebuild_indices()
+
+    def rename_material(self, material, name):
+        material.name = name
+        self._rebuild_indices()
 
     def remove_texture_index(self, i):
         for material in self.materials:
@@ -496,57 +533,48 @@ class MAT1(object):
         return result
 
     def get_mat_index(self, name):
-        for i, v in enumerate(self.materials):
-            if v.name == name:
-                return i
-
-        return -1
+        # Materials appended to the list directly are picked up too
+        if self._indexed_count != len(self._materials):
+            self._rebuild_indices()
+        return self._indices.get(name, -1)
 
     @classmethod
     def from_file(cls, f):
         start = f.tell()
-        
-        magic = f.read(4)
+        header = f.read(8)
+        if header[:4] != b"MAT1":
+            raise RuntimeError("Not a MAT1 section!")
+        sectionsize = struct.unpack(">I", header[4:8])[0]
+        f.seek(start)
+
+        return cls.from_buffer(f.read(sectionsize), 0)
+
+    @classmethod
+    def from_buffer(cls, data, offset):
+        magic, sectionsize, material_count = unpack_from(">4sIH", data, offset)
         if magic != b"MAT1":
             raise RuntimeError("Not a MAT1 section!")
-        mat1 = cls()    
-        sectionsize = read_uint32(f)
-        material_count = read_uint16(f)
-        
-        f.read(2) # padding 
-        
+        mat1 = cls()
+
+        # The materials keep a reference to the section data until they are loaded,
+        # copy it so they don't keep the whole file alive.
+        data = bytes(data[offset:offset+sectionsize])
+
         # Material Index Remap:
         # If iterating over material count, take i, multiply by 2, get index in remap table, that's the index into
         # materialinitdata
-        
-        offsets = {}
-        for datatype in ("MaterialInitData", "MaterialIndexRemapTable", "MaterialNames", "IndirectInitData", "GXCullMode", "MaterialColor",
-                        "UcArray2_ColorChannelCount", "ColorChannelInfo", "UcArray3_TexGenCount", "TexCoordInfo", "TexMatrixInfo", "UsArray4_TextureIndices",
-                        "UsArray5", "TevOrderInfo", "GXColorS10_TevColor", "GXColor2_TevKColors", "UCArray6_Tevstagenums", "TevStageInfo2",
-                        "TevSwapModeInfo", "TevSwapModeTableInfo", "AlphaCompInfo", "BlendInfo", "UcArray7_Dither"):
-            
-            offsets[datatype] = start + read_uint32(f)
-            debug.add_offset("{0}".format(datatype), offsets[datatype])
-        
-        if offsets["IndirectInitData"] == start or offsets["IndirectInitData"]-offsets["MaterialNames"] < 5:
+        offsets = dict(zip(MAT1_SECTIONS, unpack_from(">{0}I".format(len(MAT1_SECTIONS)), data, 0xC)))
+
+        if offsets["IndirectInitData"] == 0 or offsets["IndirectInitData"]-offsets["MaterialNames"] < 5:
             offsets["IndirectInitData"] = 0
-        #assert offsets["IndirectInitData"] == 0
 
-        f.seek(offsets["MaterialNames"])
-        material_names = StringTable.from_file(f)
-        
-        for i in range(material_count):
-            f.seek(offsets["MaterialIndexRemapTable"] + i*2)
-            initdataindex = read_uint16(f)
-            
-            f.seek(offsets["MaterialInitData"])
-            materialinitdata = MaterialInitData.from_array(f, offsets["MaterialInitData"], initdataindex, offsets, i)
-            materialinitdata.name = material_names.strings[i]
-            mat1.materials.append(materialinitdata)
-        f.seek(start+sectionsize)
-        
-        debug.write()
-        
+        material_names = StringTable.from_buffer(data, offsets["MaterialNames"])
+        remap_table = unpack_from(">{0}H".format(material_count), data, offsets["MaterialIndexRemapTable"])
+
+        for i, initdataindex in enumerate(remap_table):
+            materialinitdata = MaterialInitData.from_buffer(data, offsets, initdataindex, i, material_names.strings[i])
+            mat1.add_material(materialinitdata)
+
         return mat1
 
     def write(self, f):
@@ -560,46 +588,41 @@ class MAT1(object):
         dataarrays = {}
 
 
-        sections = ("MaterialInitData", "MaterialIndexRemapTable", "MaterialNames", "IndirectInitData", "GXCullMode",
-            "MaterialColor",
-            "UcArray2_ColorChannelCount", "ColorChannelInfo", "UcArray3_TexGenCount", "TexCoordInfo", "TexMatrixInfo",
-            "UsArray4_TextureIndices",
-            "UsArray5", "TevOrderInfo", "GXColorS10_TevColor", "GXColor2_TevKColors", "UCArray6_Tevstagenums",
-            "TevStageInfo2",
-            "TevSwapModeInfo", "TevSwapModeTableInfo", "AlphaCompInfo", "BlendInfo", "UcArray7_Dither")
+        sections = MAT1_SECTIONS
         offsets_start = f.tell()
         for datatype in sections:
             offsets[datatype] = None
-            dataarrays[datatype] = []
+            dataarrays[datatype] = DataArray()
             f.write(b"FOOB")
 
-        dataarrays["GXCullMode"] = [CullModeSetting(2),
-                                    CullModeSetting(1),
-                                    CullModeSetting(0)]
+        dataarrays["GXCullMode"] = DataArray([CullModeSetting(2),
+                                              CullModeSetting(1),
+                                              CullModeSetting(0)])
 
         has_indirectdata = False
         offsets["MaterialInitData"] = f.tell()-start
         
         # Prefill the arrays with data
         #dataarrays["TexCoordInfo"].append(TexCoordInfo.deserialize("01043CFF"))
+        texcoords = DataArray()
+        tevswapmodes = DataArray()
         for material in self.materials:
             for texcoord in material.tex_coord_generators:
                 if (texcoord is not None 
                   and texcoord.index is not None
-                  and texcoord not in dataarrays["TexCoordInfo"]):
+                  and texcoord not in texcoords):
                     
-                    dataarrays["TexCoordInfo"].append(texcoord)
+                    texcoords.append(texcoord)
             
             for tevswapmode in material.tevstage_swapmodes:
                 if (tevswapmode is not None 
                   and tevswapmode.index is not None
-                  and tevswapmode not in dataarrays["TevSwapModeInfo"]):
+                  and tevswapmode not in tevswapmodes):
                     
-                    dataarrays["TevSwapModeInfo"].append(tevswapmode)
+                    tevswapmodes.append(tevswapmode)
         
-        dataarrays["TexCoordInfo"].sort(key=lambda x: x.index)
-        dataarrays["TevSwapModeInfo"].sort(key=lambda x: x.index)
-        print(dataarrays["TevSwapModeInfo"])
+        dataarrays["TexCoordInfo"] = DataArray(sorted(texcoords, key=lambda x: x.index))
+        dataarrays["TevSwapModeInfo"] = DataArray(sorted(tevswapmodes, key=lambda x: x.index))
         
         dataarrays["UcArray7_Dither"].append(0)
         dataarrays["UcArray7_Dither"].append(1)
@@ -679,24 +702,29 @@ class MAT1(object):
 
     # Turn indices into texture names
     def postprocess_serialize(self, textures):
-        result = self.serialize()
-        if textures is not None:
-            for material in result["Materials"]:
-                for i in range(len(material["textures"])):
-                    val = material["textures"][i]
-                    if val is not None:
-                        if val < len(textures.references):
-                            material["textures"][i] = textures.references[val]
+        result = {"type": "MAT1"}
+        result["Materials"] = [serialize_material(mat, textures) for mat in self.materials]
 
         return result
 
+    # Writes postprocess_serialize(textures) as JSON one material at a time, see jsonstream
+    def write_json(self, f, textures, level):
+        f.write("{\n")
+        f.write(indent(level+1) + '"type": "MAT1",\n')
+        f.write(indent(level+1) + '"Materials": ')
+        materials = ListWriter(f, level+1)
+        for material in self.materials:
+            materials.write(serialize_material(material, textures))
+        materials.close()
+        f.write("\n" + indent(level) + "}")
+
     @classmethod
     def deserialize(cls, obj):
         assert obj["type"] == "MAT1"
 
         mat1 = cls()
         for material in obj["Materials"]:
-            mat1.materials.append(MaterialInitData.deserialize(material))
+            mat1.add_material(MaterialInitData.deserialize(material))
 
         return mat1
     
@@ -704,22 +732,22 @@ class MAT1(object):
     @classmethod
     def preprocess_deserialize(cls, obj, textures):
         if textures is not None:
+            # First index of every name, names that aren't in TEX1 yet are added to it
+            indices = {}
+            for i, name in enumerate(textures.references):
+                indices.setdefault(name, i)
+
             for material in obj["Materials"]:
-                for i in range(len(material["textures"])):
-                    val = material["textures"][i]
+                names = material["textures"]
+                for i, val in enumerate(names):
                     if isinstance(val, str):
-                        if val in textures.references:
-                            pos = textures.references.index(val)
-                        else:
+                        pos = indices.get(val)
+                        if pos is None:
+                            pos = len(textures.references)
                             textures.references.append(val)
-                            pos = len(textures.references)-1
-                            assert textures.references[pos] == val
-                        material["textures"][i] = pos
+                            indices[val] = pos
+                        names[i] = pos
 
-            for material in obj["Materials"]:
-                for i in range(len(material["textures"])):
-                    val = material["textures"][i]
-                    assert not isinstance(val, str)
         deserialized = cls.deserialize(obj)
         for material in deserialized.materials:
             for tex in material.textures:
@@ -1,9 +1,69 @@
-from copy import copy, deepcopy
+from copy import copy
 from math import radians, sin, cos
+from io import BytesIO
+from struct import Struct
 from .binary_io import *
 from binascii import hexlify, unhexlify
-from .mat1.mat1 import MAT1
+from .mat1.mat1 import MAT1, MaterialInitData
 from .mat1.datatypes import Color
+from .jsonstream import ListWriter, ListReader
+
+# The parser works on the whole file in memory, fixed-size parts of the sections are decoded
+# with a single unpack_from each. Offsets in the comments are relative to the start of the section.
+SECTION_HEADER = Struct(">4sI")  # Magic, section size
+SCREEN_HEADER = Struct(">II")  # 0x8: total size, section count
+INFORMATION = Struct(">IHHBBBB")  # 0x4: size, width, height, 4 values
+RESOURCE_HEADER = Struct(">IHHIH")  # 0x4: size, count, 0xFFFF, header size, count again
+RESOURCE_NAME = Struct(">BB")  # 0x2, length
+PANE = Struct(">4sIHHBB2s8s8s10f")  # 0x0-0x48
+WINDOW = Struct(">H6s8s4HBB5HH2s4H4I")  # 0x50-0x90
+PICTURE = Struct(">HHH2sHHHH4H4H4B4B4B4B")  # 0x50-0x80
+TEXTBOX = Struct(">HHHhhHHBB4B4BB3sHH")  # 0x50-0x70
+
+PANE_SIZE = 0x48
+WINDOW_SIZE = 0x90
+PICTURE_SIZE = 0x80
+
+
+def section_size(data, offset):
+    return SECTION_HEADER.unpack_from(data, offset)[1]
+
+
+def read_section(f):
+    # Reads a whole variable-sized section and leaves f at the start of the next section
+    header = f.read(8)
+    size = SECTION_HEADER.unpack(header)[1]
+    return header + f.read(size-8)
+
+
+def write_cached(f, item, mat1, cache):
+    # Writes a pane or section, reusing its bytes from the last write if nothing it depends on changed.
+    # Panes and MAT1 have to be removed from the cache when they are edited (see ScreenBlo.set_dirty),
+    # the material indices of panes and the names in resource sections are checked here.
+    # Some sections pad to absolute file offsets so the alignment is part of the key.
+    align = f.tell() % 0x20
+    if isinstance(item, Pane):
+        key = tuple(mat1.get_mat_index(name) for name in item.get_material_names())
+    elif isinstance(item, ResourceReference):
+        key = tuple(item.references)
+    else:
+        key = None
+
+    cached = cache.get(item)
+    if cached is not None and cached[0] == align and cached[1] == key:
+        f.write(cached[2])
+        return
+
+    tmp = BytesIO()
+    tmp.write(b"\x00"*align)
+    if isinstance(item, Pane):
+        item.write(tmp, mat1)
+    else:
+        item.write(tmp)
+    data = tmp.getvalue()[align:]
+
+    cache[item] = (align, key, data)
+    f.write(data)
 
 
 class Node(object): 
@@ -12,165 +72,244 @@ class Node(object):
         self.materials: MAT1 = None
         self.textures = None 
 
-    def print_hierarchy(self, indent=0):
-        for child in self.children:
-            if isinstance(child, Node):
-                child.print_hierarchy(indent+4)
+    def iter_panes(self):
+        # All panes below this node, parents before their children
+        stack = [iter(self.children)]
+        while stack:
+            for child in stack[-1]:
+                if isinstance(child, Pane):
+                    yield child
+                    if child.child is not None:
+                        stack.append(iter(child.child.children))
+                        break
             else:
+                stack.pop()
+
+    def print_hierarchy(self, indent=0):
+        stack = [(iter(self.children), indent)]
+        while stack:
+            children, indent = stack[-1]
+            for child in children:
                 print("{0}{1}".format(indent*"-", child.name))
-    
+                if isinstance(child, Pane) and child.child is not None:
+                    stack.append((iter(child.child.children), indent+4))
+                    break
+            else:
+                stack.pop()
+
     @classmethod
     def from_file(cls, f, materials=None, textures=None):
+        start = f.tell()
+        node, offset = cls.from_buffer(memoryview(f.read()), 0, materials, textures)
+        f.seek(start+offset)
+
+        return node
+
+    # The methods below walk the tree with an explicit stack of the nodes above the current one
+    # instead of recursing, so that deeply nested layouts don't run into the recursion limit.
+    @classmethod
+    def from_buffer(cls, data, offset, materials=None, textures=None):
+        # Returns the node and the offset after the node's END1 section,
+        # or the offset of the EXT1 section for the root node
         node = cls()
-        node.materials = materials 
+        node.materials = materials
         node.textures = textures
 
+        stack = []
+        parent = None  # Pane the current node belongs to
         last = None
 
-        next = peek_id(f)
+        next = bytes(data[offset:offset+4])
         while next != b"EXT1":
             if next == b"BGN1":
-                f.read(8)
-
-                childnode = Node.from_file(f, node.materials, node.textures)
+                if last is None:
+                    raise RuntimeError("BGN1 without a pane at 0x{0:x}".format(offset))
+                childnode = Node()
+                childnode.materials = node.materials
+                childnode.textures = node.textures
                 last.child = childnode
-                for child in childnode.children:
-                    child.parent = last
 
-                #node.children.append(childnode)
+                stack.append((node, parent))
+                node, parent, last = childnode, last, None
+                offset += 8
+            elif next == b"END1":
+                offset += 8
+                if not stack:
+                    return node, offset
+                node, parent = stack.pop()
                 last = None
-            elif next == b"END1" or next == b"EXT1":
-                f.read(8)
-                return node 
             elif next == b"TEX1":
-                node.textures = TextureNames.from_file(f)
-                print("set the tex1", node.textures)
+                node.textures = TextureNames.from_buffer(data, offset)
                 node.children.append(node.textures)
+                offset += section_size(data, offset)
             elif next == b"FNT1":
-                node.children.append(FontNames.from_file(f))
+                node.children.append(FontNames.from_buffer(data, offset))
+                offset += section_size(data, offset)
             elif next == b"MAT1":
-                print("Set the materials")
-                thing = f.tell()
-                mat1 = MAT1.from_file(f)
-                spot = f.tell()
-                f.seek(thing)
-                Item.from_file(f)
-                print("compare", hex(spot), hex(f.tell()))
-                node.materials = mat1#Item.from_file(f)
+                node.materials = MAT1.from_buffer(data, offset)
                 node.children.append(node.materials)
-                print(len(mat1.materials), "materials")
-                #print(mat1.material_names.strings)
-            
+                offset += section_size(data, offset)
             elif next == b"PAN2":
-                last = Pane.from_file(f)
+                last = Pane.from_buffer(data, offset)
+                last.parent = parent
                 node.children.append(last)
+                offset += PANE_SIZE
             elif next == b"PIC2":
-                last = Picture.from_file(f, materials)
-
+                last = Picture.from_buffer(data, offset, node.materials)
+                last.parent = parent
                 node.children.append(last)
+                offset += PICTURE_SIZE
             elif next == b"WIN2":
-                last = Window.from_file(f, materials)
+                last = Window.from_buffer(data, offset, node.materials)
+                last.parent = parent
                 node.children.append(last)
+                offset += WINDOW_SIZE
             elif next == b"TBX2":
-                last = Textbox.from_file(f, materials)
+                last = Textbox.from_buffer(data, offset, node.materials)
+                last.parent = parent
                 node.children.append(last)
+                offset += section_size(data, offset)
             elif not next:
                 raise RuntimeError("malformed file?")
             else:
                 raise RuntimeError("Unknown: {0}".format(next))
-            
-            next = peek_id(f)
-        
-        return node 
+
+            next = bytes(data[offset:offset+4])
+
+        if stack:
+            # Missing END1 sections before EXT1
+            node = stack[0][0]
+        return node, offset
     
-    def write(self, f):
+    def write(self, f, cache=None):
+        # cache: dict of encoded panes and sections to reuse, see write_cached
         count = 0
-        for child in self.children:
-            """if isinstance(child, Node):
-                f.write(b"BGN1")
-                write_uint32(f, 8)
-                count += child.write(f) + 2
-                f.write(b"END1")
-                write_uint32(f, 8)
-            else:
+        stack = [(self, iter(self.children))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
                 count += 1
-                child.write(f)"""
-
-            count += 1
-            if isinstance(child, Pane):
-                child.write(f, self.materials)
-            else:
-                child.write(f)
-            if hasattr(child, "child") and child.child is not None:
-                f.write(b"BGN1")
-                write_uint32(f, 8)
-                if isinstance(child.child, Pane):
-                    count += child.child.write(f, self.materials) + 2
+                if cache is not None:
+                    write_cached(f, child, node.materials, cache)
+                elif isinstance(child, Pane):
+                    child.write(f, node.materials)
                 else:
-                    count += child.child.write(f) + 2
-                
-                f.write(b"END1")
-                write_uint32(f, 8)
+                    child.write(f)
+
+                if isinstance(child, Pane) and child.child is not None:
+                    f.write(b"BGN1")
+                    write_uint32(f, 8)
+                    count += 2
+                    stack.append((child.child, iter(child.child.children)))
+                    break
+            else:
+                stack.pop()
+                if stack:
+                    f.write(b"END1")
+                    write_uint32(f, 8)
 
         return count
 
     def serialize(self):
+        # Nodes are lists, they follow the pane they belong to
         result = []
-        for child in self.children:
-            if isinstance(child, MAT1):
-                result.append(child.postprocess_serialize(self.textures))
+        stack = [(self, iter(self.children), result)]
+        while stack:
+            node, children, items = stack[-1]
+            for child in children:
+                if isinstance(child, MAT1):
+                    items.append(child.postprocess_serialize(node.textures))
+                else:
+                    items.append(child.serialize())
+                    if isinstance(child, Pane) and child.child is not None:
+                        childitems = []
+                        items.append(childitems)
+                        stack.append((child.child, iter(child.child.children), childitems))
+                        break
             else:
-                result.append(child.serialize())
-                if hasattr(child, "child") and child.child is not None:
-                    result.append(child.child.serialize())
-        
+                stack.pop()
+
         return result 
+
+    def write_json(self, f, level=0):
+        # Writes serialize() as JSON one item at a time, see jsonstream
+        stack = [(self, iter(self.children), ListWriter(f, level))]
+        while stack:
+            node, children, items = stack[-1]
+            for child in children:
+                if isinstance(child, MAT1):
+                    items.next_item()
+                    child.write_json(f, node.textures, items.level+1)
+                else:
+                    items.write(child.serialize())
+                    if isinstance(child, Pane) and child.child is not None:
+                        items.next_item()
+                        stack.append((child.child, iter(child.child.children), ListWriter(f, items.level+1)))
+                        break
+            else:
+                items.close()
+                stack.pop()
     
     @classmethod 
     def deserialize(cls, obj, materials=None, textures=None):
-        node = cls()
-        node.textures = textures
-        node.materials = materials
+        # Nested nodes can be lists or iterators like the ones from ListReader
+        root = cls()
+        root.textures = textures
+        root.materials = materials
 
+        stack = [(root, iter(obj), None)]
         last = None
 
-        for item in obj:
-            add_item = True
-            if isinstance(item, list):
-                bloitem = Node.deserialize(item, node.materials, node.textures)
-                last.child = bloitem
-                for child in bloitem.children:
-                    child.parent = last
-                last = None
-                add_item = False
-            elif item["type"] == "TEX1":
-                bloitem = TextureNames.deserialize(item)
-                node.textures = bloitem
-            elif item["type"] == "FNT1":
-                bloitem = FontNames.deserialize(item)
-            elif item["type"] == "PAN2":
-                bloitem = Pane.deserialize(item)
-                last = bloitem
-            elif item["type"] == "WIN2":
-                bloitem = Window.deserialize(item)
-                last = bloitem
-            elif item["type"] == "TBX2":
-                bloitem = Textbox.deserialize(item)
-                last = bloitem
-            elif item["type"] == "PIC2":
-                bloitem = Picture.deserialize(item)
-                matindex = node.materials.get_mat_index(bloitem.material)
-                bloitem._material = node.materials.materials[matindex]
-                last = bloitem
-            elif item["type"] == "MAT1":
-                bloitem = MAT1.preprocess_deserialize(item, node.textures)
-                node.materials = bloitem
-            else:
-                raise RuntimeError("Unknown item {0}".format(item["type"]))
-            if add_item:
+        while stack:
+            node, items, parent = stack[-1]
+            for item in items:
+                if not isinstance(item, dict):
+                    if last is None:
+                        raise RuntimeError("Node without a pane before it")
+                    childnode = Node()
+                    childnode.materials = node.materials
+                    childnode.textures = node.textures
+                    last.child = childnode
+
+                    stack.append((childnode, iter(item), last))
+                    last = None
+                    break
+
+                elif item["type"] == "TEX1":
+                    bloitem = TextureNames.deserialize(item)
+                    node.textures = bloitem
+                elif item["type"] == "FNT1":
+                    bloitem = FontNames.deserialize(item)
+                elif item["type"] == "PAN2":
+                    bloitem = Pane.deserialize(item)
+                    bloitem.parent = parent
+                    last = bloitem
+                elif item["type"] == "WIN2":
+                    bloitem = Window.deserialize(item)
+                    bloitem.parent = parent
+                    last = bloitem
+                elif item["type"] == "TBX2":
+                    bloitem = Textbox.deserialize(item)
+                    bloitem.parent = parent
+                    last = bloitem
+                elif item["type"] == "PIC2":
+                    bloitem = Picture.deserialize(item)
+                    matindex = node.materials.get_mat_index(bloitem.material)
+                    bloitem._material = node.materials.materials[matindex]
+                    bloitem.parent = parent
+                    last = bloitem
+                elif item["type"] == "MAT1":
+                    bloitem = MAT1.preprocess_deserialize(item, node.textures)
+                    node.materials = bloitem
+                else:
+                    raise RuntimeError("Unknown item {0}".format(item["type"]))
+
                 node.children.append(bloitem)
+            else:
+                stack.pop()
+                last = None
         
-        return node 
+        return root 
     
         
 class Item(object):
@@ -206,7 +345,30 @@ class Item(object):
         return item 
 
 
+# Vertex settings of a picture, the lists are kept as tuples and replaced when edited
+def picture_color(unk1, unk2, unknowns, col1, col2):
+    return {"unk1": unk1, "unk2": unk2, "unknowns": tuple(unknowns), "col1": tuple(col1), "col2": tuple(col2)}
+
+
+def copy_nested(value):
+    # Window subdata, picture colors and colors only contain numbers, strings and tuples,
+    # so copying one or two levels deep is enough
+    if isinstance(value, list):
+        return [copy(item) for item in value]
+    return copy(value)
+
+
 class Pane(object):
+    TYPE = "PAN2"
+    # Everything that is saved to JSON, in the order it is written
+    FIELDS = ("p_enabled", "p_anchor", "p_size_x", "p_size_y", "p_scale_x", "p_scale_y",
+              "p_offset_x", "p_offset_y", "p_rotation", "p_panename", "p_secondaryname",
+              "p_bckindex", "p_unk4")
+    # Fields that hold lists, dicts or colors, copies of a pane get their own
+    NESTED = ()
+    # hide, animated and widget are only used by the editor, _material by the renderer
+    __slots__ = ("hide", "animated", "widget", "name", "p_name", "child", "parent", "_material") + FIELDS
+
     def __init__(self):
         self.hide = False  # Not a blo feature, hides element in editor only
         self.animated = False
@@ -227,6 +389,8 @@ class Pane(object):
         self.p_panename = None
         self.p_secondaryname = None
         self.p_bckindex = None
+        self.p_unk4 = None
+        self._material = None
 
     def add_child(self, child_pane):
         if self.child is not None:
@@ -240,17 +404,47 @@ class Pane(object):
             child_pane.parent = self
 
     def copy(self, children=False, parent=None):
-        copied = copy(self)
+        # With children=True the panes below this one are copied too
+        copied = self._copy_pane(parent)
+        stack = [(self, copied)] if children else []
+        while stack:
+            original, pane = stack.pop()
+            if original.child is not None:
+                pane.child = copy(original.child)
+                pane.child.children = []
+                for child in original.child.children:
+                    childcopy = child._copy_pane(pane)
+                    pane.child.children.append(childcopy)
+                    stack.append((child, childcopy))
+
+        return copied
+
+    # Copies the pane without its children. The values of NESTED are copied right away instead of
+    # being shared until the first edit: the pane editor keeps the objects of the pane it shows
+    # and changes them in place, so a shared value would change both panes.
+    def _copy_pane(self, parent):
+        cls = self.__class__
+        copied = cls.__new__(cls)
+        copied.hide = self.hide
+        copied.animated = self.animated
+        copied.widget = None
+        copied.name = self.name
+        copied.p_name = self.p_name
+        copied._material = self._material
+        for field in cls.FIELDS:
+            setattr(copied, field, getattr(self, field))
+        for field in cls.NESTED:
+            setattr(copied, field, copy_nested(getattr(self, field)))
         copied.parent = parent
-        if children and self.child is not None:
-            copied.child = copy(self.child)
-            copied.child.children = [child.copy(children, copied) for child in self.child.children]
-        else:
-            copied.child = None
+        copied.child = None
         return copied
 
     def set_default_material(self, mat):
         pass
+
+    # Names of the materials the pane uses
+    def get_material_names(self):
+        return ()
     @classmethod
     def new(cls):
         pane = cls()
@@ -272,41 +466,31 @@ class Pane(object):
 
     @classmethod
     def from_file(cls, f):
-        start = f.tell()
+        return cls.from_buffer(f.read(PANE_SIZE), 0)
+
+    @classmethod
+    def from_buffer(cls, data, offset):
         pane = cls()
-        pane.p_name = read_name(f)
+        (name, size, unk,
+         pane.p_bckindex,  # 0xA
+         pane.p_enabled,  # 0xC
+         pane.p_anchor,  # 0xD
+         re, panename, secondaryname,
+         pane.p_size_x, pane.p_size_y, pane.p_scale_x, pane.p_scale_y,
+         unk1, unk2,
+         pane.p_rotation, pane.p_offset_x, pane.p_offset_y, pane.p_unk4) = PANE.unpack_from(data, offset)
+
+        pane.p_name = str(name, "ascii")
         if pane.p_name not in ("PAN2", "pan2"):
-            raise RuntimeError("Not a PAN2 or pan2 section but {}".format(pane.name))
-        size = read_uint32(f)
+            raise RuntimeError("Not a PAN2 or pan2 section but {}".format(pane.p_name))
         assert size == 0x48
-        unk = read_uint16(f)
         assert unk == 0x40
-
-        pane.p_bckindex = read_uint16(f)  # 0xA
-        pane.p_enabled = read_uint8(f)  # 0xC
-        pane.p_anchor = read_uint8(f)  # 0xD
-        
-        re = f.read(2)
         assert re == b"RE" or re == b"\x00\x00"
-        pane.p_panename = f.read(0x8).decode("ascii")
-        pane.p_secondaryname = f.read(0x8).decode("ascii")
-        #unknown = f.read(0x8)
-        #assert unknown == b"\x00"*8
-        pane.p_size_x = read_float(f)
-        pane.p_size_y = read_float(f)
-        pane.p_scale_x = read_float(f)
-        pane.p_scale_y = read_float(f)
-        unk = read_float(f)
-        assert unk == 0.0 
-        unk = read_float(f)
-        assert unk == 0.0 
-        
-        pane.p_rotation = read_float(f)
-        pane.p_offset_x = read_float(f)
-        pane.p_offset_y = read_float(f)
-        pane.p_unk4 = read_float(f)
-        
-        assert f.tell() == start + 0x48
+        pane.p_panename = panename.decode("ascii")
+        pane.p_secondaryname = secondaryname.decode("ascii")
+        assert unk1 == 0.0
+        assert unk2 == 0.0
+
         return pane
 
     def write(self, f, mat1):
@@ -338,43 +522,19 @@ class Pane(object):
         assert f.tell() == start + 0x48
 
     def serialize(self):
-        result = {}
-        result["type"] = "PAN2"
-        result["p_type"] = self.p_name
-
-        for key, val in self.__dict__.items():
-            if key.startswith("_"):
-                print(key)
-                continue
-
-            if (key != "name" and key != "p_name" and key != "child" and
-                    key != "parent" and key != "widget" and key != "hide" and key != "animated"):
-                if isinstance(val, bytes):
-                    raise RuntimeError("Not Intended To Happen")
-                result[key] = val
-        return result
+        result = {"type": self.TYPE, "p_type": self.p_name}
+        for field in self.FIELDS:
+            result[field] = getattr(self, field)
 
-    def assign_value(self, src, field):
-        self.__dict__[field] = src[field]
+        return result
 
     @classmethod
     def deserialize(cls, obj):
         assert "p_type" in obj and obj["p_type"] in ("PAN2", "pan2")
         pane = cls()
         pane.p_name = obj["p_type"]
-        pane.assign_value(obj, "p_bckindex")
-        pane.assign_value(obj, "p_enabled")
-        pane.assign_value(obj, "p_anchor")
-        pane.assign_value(obj, "p_panename")
-        pane.assign_value(obj, "p_secondaryname")
-        pane.assign_value(obj, "p_size_x")
-        pane.assign_value(obj, "p_size_y")
-        pane.assign_value(obj, "p_scale_x")
-        pane.assign_value(obj, "p_scale_y")
-        pane.assign_value(obj, "p_rotation")
-        pane.assign_value(obj, "p_offset_x")
-        pane.assign_value(obj, "p_offset_y")
-        pane.assign_value(obj, "p_unk4")
+        for field in cls.FIELDS:
+            setattr(pane, field, obj[field])
 
         return pane
 
@@ -470,21 +630,16 @@ class Pane(object):
 
 # Draw a window: 4 corner elements + side and one filling material
 class Window(Pane):
+    TYPE = "WIN2"
+    __slots__ = ("size", "padding", "subdata", "unkbyte1", "unkbyte2",
+                 "unk3", "unk4", "unk5", "unk6", "unk7", "material")
+    FIELDS = Pane.FIELDS + __slots__
+    NESTED = ("subdata", )
+
     def __init__(self):
         super().__init__()
         self.name = "WIN2"
 
-    def copy(self, children=False, parent=None):
-        copied = copy(self)
-        copied.parent = parent
-        copied.subdata = deepcopy(self.subdata)
-        if children and self.child is not None:
-            copied.child = copy(self.child)
-            copied.child.children = [child.copy(children, copied) for child in self.child.children]
-        else:
-            copied.child = None
-        return copied
-
     @classmethod
     def new(cls):
         window = super(Window, cls).new()
@@ -511,53 +666,54 @@ class Window(Pane):
 
     @classmethod
     def from_file(cls, f, mat1):
-        start = f.tell()
-        name = read_name(f)
-        size = read_uint32(f)
+        return cls.from_buffer(f.read(WINDOW_SIZE), 0, mat1)
+
+    @classmethod
+    def from_buffer(cls, data, offset, mat1):
+        name, size = SECTION_HEADER.unpack_from(data, offset)
+        name = str(name, "ascii")
         assert size == 0x90
 
         if name != "WIN2":
             raise RuntimeError("Not a WIN2 section")
 
-        window = super(Window, cls).from_file(f)
+        window = super(Window, cls).from_buffer(data, offset+8)
         window.name = name
 
-        window.size = read_uint16(f)
+        values = WINDOW.unpack_from(data, offset+0x50)
+        window.size = values[0]
         assert window.size == 64
-        reserved = f.read(6)
+        reserved = values[1]
         assert reserved == b"RESERV" or reserved == b"\x00"*6
-        window.padding = str(hexlify(f.read(8)), encoding="ascii")#.decode("ascii", errors="backslashreplace")
+        window.padding = str(hexlify(values[2]), encoding="ascii")#.decode("ascii", errors="backslashreplace")
         #assert window.padding == "\xFF"*8
         window.subdata = [{}, {}, {}, {}]
         for i in range(4):
-            mat_index = read_uint16(f)
-            window.subdata[i]["material"] = mat1.materials[mat_index].name
-
-        window.unkbyte1 = read_uint8(f)
-        window.unkbyte2 = read_uint8(f)
-        window.unk3 = read_uint16(f)
-        window.unk4 = read_uint16(f)
-        window.unk5 = read_uint16(f)
-        window.unk6 = read_uint16(f)
-        window.unk7 = read_uint16(f)
-        mat_index = read_uint16(f)
-        window.material = mat1.materials[mat_index].name
-        
-        re = f.read(2)
+            window.subdata[i]["material"] = mat1.materials[values[3+i]].name
+
+        (window.unkbyte1, window.unkbyte2,
+         window.unk3, window.unk4, window.unk5, window.unk6, window.unk7) = values[7:14]
+        window.material = mat1.materials[values[14]].name
+
+        re = values[15]
         assert re == b"RE" or re == b"\x00\x00"
-        
+
         for i in range(4):
-            window.subdata[i]["sub_unk2"] = read_uint16(f)
+            window.subdata[i]["sub_unk2"] = values[16+i]
         for i in range(4):
-            window.subdata[i]["sub_unk3"] = read_uint32(f)
-        assert f.tell() == start+0x90
-        return window 
+            window.subdata[i]["sub_unk3"] = values[20+i]
+
+        return window
 
     def set_default_material(self, mat):
         for i in range(4):
             self.subdata[i]["material"] = mat.name
         self.material = mat.name
 
+    def get_material_names(self):
+        return (self.material, self.subdata[0]["material"], self.subdata[1]["material"],
+                self.subdata[2]["material"], self.subdata[3]["material"])
+
     def write(self, f, mat1):
         start = f.tell()
         write_name(f, self.name)
@@ -569,11 +725,11 @@ class Window(Pane):
         f.write(unhexlify(self.padding))
         assert len(unhexlify(self.padding)) == 8
         for i in range(4):
-            if mat1.get_mat_index(self.subdata[i]["material"]) == -1:
+            index = mat1.get_mat_index(self.subdata[i]["material"])
+            if index == -1:
                 raise RuntimeError(
                     "Window {0} cannot find its material {1} for subdata {2}".format(
                         self.name, self.subdata[i]["material"], i))
-            index = mat1.get_mat_index(self.subdata[i]["material"])
             write_int16(f, index)
 
         write_uint8(f, self.unkbyte1)
@@ -583,10 +739,6 @@ class Window(Pane):
         write_uint16(f, self.unk5)
         write_uint16(f, self.unk6)
         write_uint16(f, self.unk7)
-        if mat1.get_mat_index(self.subdata[i]["material"]) == -1:
-            raise RuntimeError(
-                "Window {0} cannot find its material {1}".format(
-                    self.name, self.materia, i))
         index = mat1.get_mat_index(self.material)
         write_int16(f, index)
 
@@ -600,51 +752,23 @@ class Window(Pane):
 
         assert f.tell() == start + 0x90
 
-    def serialize(self):
-        result = super().serialize()
-        result["type"] = "WIN2"
-        
-        return result 
-
     @classmethod
     def deserialize(cls, obj):
         assert "type" in obj and obj["type"] == "WIN2"
-        window = super(Window, cls).deserialize(obj)
-
-        window.assign_value(obj, "size")
-        window.assign_value(obj, "padding")
-        window.assign_value(obj, "subdata")
-        window.assign_value(obj, "unkbyte1")
-        window.assign_value(obj, "unkbyte2")
-        window.assign_value(obj, "unk3")
-        window.assign_value(obj, "unk4")
-        window.assign_value(obj, "unk5")
-        window.assign_value(obj, "unk6")
-        window.assign_value(obj, "unk7")
-        window.assign_value(obj, "material")
-
-        return window
+        return super(Window, cls).deserialize(obj)
 
 
 # Draw a texture in the GUI
 class Picture(Pane):
+    TYPE = "PIC2"
+    __slots__ = ("size", "unk_index", "material", "color1", "color2")
+    FIELDS = Pane.FIELDS + __slots__
+    NESTED = ("color1", "color2")
+
     def __init__(self):
         super().__init__()
         self.name = "PIC2"
 
-    def copy(self, children=False, parent=None):
-        copied = copy(self)
-        copied.parent = parent
-        copied.color1 = deepcopy(self.color1)
-        copied.color2 = deepcopy(self.color2)
-
-        if children and self.child is not None:
-            copied.child = copy(self.child)
-            copied.child.children = [child.copy(children, copied) for child in self.child.children]
-        else:
-            copied.child = None
-        return copied
-
     @classmethod
     def new(cls):
         picture = super(Picture, cls).new()
@@ -652,25 +776,8 @@ class Picture(Pane):
         picture.size = 48
         picture.unk_index = 0
         picture.material = ""
-        picture._material = None
-
-        color1 = {}
-        color2 = {}
-
-        color1["unk1"] = 0
-        color1["unk2"] = 0
-        color2["unk1"] = 0
-        color2["unk2"] = 0
-
-        color1["unknowns"] = [0, 0, 256, 0]
-        color2["unknowns"] = [0, 256, 256, 256]
-        color1["col1"] = [255 for x in range(4)]
-        color1["col2"] = [255 for x in range(4)]
-        color2["col1"] = [255 for x in range(4)]
-        color2["col2"] = [255 for x in range(4)]
-
-        picture.color1 = color1
-        picture.color2 = color2
+        picture.color1 = picture_color(0, 0, (0, 0, 256, 0), (255, 255, 255, 255), (255, 255, 255, 255))
+        picture.color2 = picture_color(0, 0, (0, 256, 256, 256), (255, 255, 255, 255), (255, 255, 255, 255))
 
         return picture
 
@@ -678,46 +785,37 @@ class Picture(Pane):
         self.material = mat.name
         self._material = mat
 
+    def get_material_names(self):
+        return (self.material, )
+
     @classmethod
     def from_file(cls, f, mat1):
-        start = f.tell()
-        name = read_name(f)
-        size = read_uint32(f)
+        return cls.from_buffer(f.read(PICTURE_SIZE), 0, mat1)
+
+    @classmethod
+    def from_buffer(cls, data, offset, mat1):
+        name, size = SECTION_HEADER.unpack_from(data, offset)
+        name = str(name, "ascii")
         if name != "PIC2":
             raise RuntimeError("Not a PIC2 section: {}".format(name))
-        picture = super(Picture, cls).from_file(f)
+        picture = super(Picture, cls).from_buffer(data, offset+8)
         picture.name = name
 
-        picture.size = read_uint16(f)
+        values = PICTURE.unpack_from(data, offset+0x50)
+        picture.size = values[0]
         assert picture.size == 48
-        picture.unk_index = read_uint16(f)
-        mat_index = read_uint16(f)
+        picture.unk_index = values[1]
+        mat_index = values[2]
 
         picture.material = mat1.materials[mat_index].name
         picture._material = mat1.materials[mat_index]
 
-        re = f.read(2)
+        re = values[3]
         assert re == b"RE" or re == b"\x00\x00"
-        color1 = {}
-        color2 = {}
-        
-        color1["unk1"] = read_uint16(f)
-        color1["unk2"] = read_uint16(f)
-        color2["unk1"] = read_uint16(f)
-        color2["unk2"] = read_uint16(f)
-        
-        color1["unknowns"] = [read_uint16(f) for x in range(4)]
-        color2["unknowns"] = [read_uint16(f) for x in range(4)]
-        color1["col1"] = [read_uint8(f) for x in range(4)]
-        color1["col2"] = [read_uint8(f) for x in range(4)]
-        color2["col1"] = [read_uint8(f) for x in range(4)]
-        color2["col2"] = [read_uint8(f) for x in range(4)]
-        
-        picture.color1 = color1 
-        picture.color2 = color2 
-        
-        assert f.tell() == start+0x80
-        return picture 
+        picture.color1 = picture_color(values[4], values[5], values[8:12], values[16:20], values[20:24])
+        picture.color2 = picture_color(values[6], values[7], values[12:16], values[24:28], values[28:32])
+
+        return picture
 
     def write(self, f, mat1):
         start = f.tell()
@@ -727,9 +825,10 @@ class Picture(Pane):
         write_uint16(f, 48)
         write_uint16(f, self.unk_index)
 
-        if mat1.get_mat_index(self.material) == -1:
+        index = mat1.get_mat_index(self.material)
+        if index == -1:
             raise RuntimeError("Picture {0} cannot find its material {1}".format(self.name, self.material))
-        write_int16(f, mat1.get_mat_index(self.material))
+        write_int16(f, index)
         f.write(b"RE")
         write_uint16(f, self.color1["unk1"])
         write_uint16(f, self.color1["unk2"])
@@ -752,45 +851,28 @@ class Picture(Pane):
 
         assert f.tell() == start + 0x80
 
-    def serialize(self):
-        result = super().serialize()
-        result["type"] = "PIC2"
-        
-        return result
-
     @classmethod
     def deserialize(cls, obj):
         assert "type" in obj and obj["type"] == "PIC2"
-        window = super(Picture, cls).deserialize(obj)
-
-        window.assign_value(obj, "size")
-        window.assign_value(obj, "unk_index")
-        window.assign_value(obj, "material")
-        window.assign_value(obj, "color1")
-        window.assign_value(obj, "color2")
+        picture = super(Picture, cls).deserialize(obj)
+        picture.color1 = picture_color(**picture.color1)
+        picture.color2 = picture_color(**picture.color2)
 
-        return window
+        return picture
 
 
 # Create text. Requires a material with font and an initialized font.
 class Textbox(Pane):
+    TYPE = "TBX2"
+    __slots__ = ("size", "unk1", "material", "signedunk3", "signedunk4", "unk5", "unk6",
+                 "unk7byte", "unk8byte", "color_top", "color_bottom", "unk11", "text_cutoff", "text")
+    FIELDS = Pane.FIELDS + __slots__
+    NESTED = ("color_top", "color_bottom")
+
     def __init__(self):
         super().__init__()
         self.name = "TBX2"
 
-    def copy(self, children=False, parent=None):
-        copied = copy(self)
-        copied.parent = parent
-        copied.color_top = deepcopy(self.color_top)
-        copied.color_bottom = deepcopy(self.color_bottom)
-
-        if children and self.child is not None:
-            copied.child = copy(self.child)
-            copied.child.children = [child.copy(children, copied) for child in self.child.children]
-        else:
-            copied.child = None
-        return copied
-
     @classmethod
     def new(cls):
         textbox = super(Textbox, cls).new()
@@ -815,38 +897,40 @@ class Textbox(Pane):
         self.material = mat.name
         self._material = mat
 
+    def get_material_names(self):
+        return (self.material, )
+
     @classmethod
     def from_file(cls, f, mat1):
-        start = f.tell()
-        name = read_name(f)
-        size = read_uint32(f)
+        return cls.from_buffer(read_section(f), 0, mat1)
+
+    @classmethod
+    def from_buffer(cls, data, offset, mat1):
+        name, size = SECTION_HEADER.unpack_from(data, offset)
+        name = str(name, "ascii")
 
         if name != "TBX2":
             raise RuntimeError("Not a TBX2 section")
-        textbox = super(Textbox, cls).from_file(f)
+        textbox = super(Textbox, cls).from_buffer(data, offset+8)
 
-        textbox.size = read_uint16(f)
-        textbox.unk1 = read_uint16(f)
-        mat_index = read_uint16(f)
+        values = TEXTBOX.unpack_from(data, offset+0x50)
+        textbox.size = values[0]
+        textbox.unk1 = values[1]
+        mat_index = values[2]
         textbox.material = mat1.materials[mat_index].name
         textbox._material = mat1.materials[mat_index]
 
-        textbox.signedunk3 = read_int16(f)
-        textbox.signedunk4 = read_int16(f)
-        textbox.unk5 = read_uint16(f)
-        textbox.unk6 = read_uint16(f)
-        textbox.unk7byte = read_uint8(f)
-        textbox.unk8byte = read_uint8(f)
-        textbox.color_top = Color.from_file(f)
-        textbox.color_bottom = Color.from_file(f)
-        textbox.unk11 = read_uint8(f)
-        res = f.read(3)
+        (textbox.signedunk3, textbox.signedunk4, textbox.unk5, textbox.unk6,
+         textbox.unk7byte, textbox.unk8byte) = values[3:9]
+        textbox.color_top = Color(*values[9:13])
+        textbox.color_bottom = Color(*values[13:17])
+        textbox.unk11 = values[17]
+        res = values[18]
         assert res == b"RES" or res == b"\x00\x00\x00"
-        textbox.text_cutoff = read_uint16(f)
-        stringlength = read_uint16(f)
-        assert f.tell() == start+0x70
-        textbox.text = f.read(stringlength).decode("shift_jis_2004")
-        f.seek(start+size)
+        textbox.text_cutoff = values[19]
+        stringlength = values[20]
+        textbox.text = str(data[offset+0x70:offset+0x70+stringlength], "shift_jis_2004")
+
         return textbox
 
     def write(self, f, mat1):
@@ -857,9 +941,10 @@ class Textbox(Pane):
         sub_size_ref = f.tell()
         write_uint16(f, self.size)
         write_uint16(f, self.unk1)
-        if mat1.get_mat_index(self.material) == -1:
+        index = mat1.get_mat_index(self.material)
+        if index == -1:
             raise RuntimeError("Textbox {0} cannot find its material {1}".format(self.name, self.material))
-        write_uint16(f, mat1.get_mat_index(self.material))
+        write_uint16(f, index)
         write_int16(f, self.signedunk3)
         write_int16(f, self.signedunk4)
         write_uint16(f, self.unk5)
@@ -889,7 +974,6 @@ class Textbox(Pane):
     
     def serialize(self):
         result = super().serialize()
-        result["type"] = "TBX2"
         result["color_top"] = self.color_top.serialize()
         result["color_bottom"] = self.color_bottom.serialize()
 
@@ -898,26 +982,11 @@ class Textbox(Pane):
     @classmethod
     def deserialize(cls, obj):
         assert "type" in obj and obj["type"] == "TBX2"
-        window = super(Textbox, cls).deserialize(obj)
-
-        window.assign_value(obj, "size")
-        window.assign_value(obj, "unk1")
-        window.assign_value(obj, "material")
-        window.assign_value(obj, "signedunk3")
-        window.assign_value(obj, "signedunk4")
-        window.assign_value(obj, "unk5")
-        window.assign_value(obj, "unk6")
-        window.assign_value(obj, "unk7byte")
-        window.assign_value(obj, "unk8byte")
-        #window.assign_value(obj, "unk9")
-        window.color_top = Color.deserialize(obj["color_top"])  #window.assign_value(obj, "unk10")
-        window.color_bottom = Color.deserialize(obj["color_bottom"])
-        window.assign_value(obj, "unk11")
-        window.assign_value(obj, "text_cutoff")
-
-        window.assign_value(obj, "text")
+        textbox = super(Textbox, cls).deserialize(obj)
+        textbox.color_top = Color.deserialize(textbox.color_top)
+        textbox.color_bottom = Color.deserialize(textbox.color_bottom)
 
-        return window
+        return textbox
 
 
 class ResourceReference(Item):
@@ -931,36 +1000,28 @@ class ResourceReference(Item):
         
     @classmethod
     def from_file(cls, f):
-        start = f.tell()
-        if f.read(4) != bytes(cls.ResName(), encoding="ascii"):
+        return cls.from_buffer(read_section(f), 0)
+
+    @classmethod
+    def from_buffer(cls, data, offset):
+        if bytes(data[offset:offset+4]) != bytes(cls.ResName(), encoding="ascii"):
             raise RuntimeError("Not a {0} section".format(cls.ResName()))
         resreference = cls()
-        size = read_uint32(f)
-        
-        rescount = read_uint16(f)
-        idk = read_uint16(f)
-        assert idk == 0xFFFF 
-        headersize = read_uint32(f)
+        size, rescount, idk, headersize, rescount2 = RESOURCE_HEADER.unpack_from(data, offset+4)
+        assert idk == 0xFFFF
         assert headersize == 0x10
-        
-        restart = f.tell()
-        
-        rescount2 = read_uint16(f)
-        assert rescount == rescount2 
-        
-        for i in range(rescount):
-            f.seek(restart + 2 + i*2)
-            offset = read_uint16(f)
-            
-            f.seek(restart + offset)
-            unk = read_uint8(f)
-            length = read_uint8(f)
-            assert unk == 0x2 
-            name = str(f.read(length), "shift_jis_2004")
-            
+        assert rescount == rescount2
+
+        restart = offset + 0x10
+
+        for resoffset in Struct(">{0}H".format(rescount)).unpack_from(data, restart+2):
+            unk, length = RESOURCE_NAME.unpack_from(data, restart+resoffset)
+            assert unk == 0x2
+            start = restart+resoffset+2
+            name = str(data[start:start+length], "shift_jis_2004")
+
             resreference.references.append(name)
-            
-        f.seek(start+size)
+
         return resreference
 
     def write(self, f):
@@ -1027,23 +1088,24 @@ class Information(object):
         self.height = height 
         self.val1 = self.val2 = self.val3 = self.val4 = 0
     
-    @classmethod 
+    @classmethod
     def from_file(cls, f):
-        if f.read(4) != b"INF1":
+        return cls.from_buffer(read_section(f), 0)
+
+    @classmethod
+    def from_buffer(cls, data, offset):
+        if bytes(data[offset:offset+4]) != b"INF1":
             raise RuntimeError("Not an INF1 section!")
-        
-        size = read_uint32(f)
+
+        size, width, height, val1, val2, val3, val4 = INFORMATION.unpack_from(data, offset+4)
         assert size == 0x20
-        width = read_uint16(f)
-        height = read_uint16(f)
         inf = cls(width, height)
-        inf.val1 = read_uint8(f)
-        inf.val2 = read_uint8(f)
-        inf.val3 = read_uint8(f)
-        inf.val4 = read_uint8(f)
-        f.read(size-0x10) # Padding
-        
-        return inf 
+        inf.val1 = val1
+        inf.val2 = val2
+        inf.val3 = val3
+        inf.val4 = val4
+
+        return inf
     
     def write(self, f):
         f.write(b"INF1")
@@ -1081,43 +1143,133 @@ class ScreenBlo(object):
     def __init__(self):
         self.root = Node()
         self.info = Information(640, 480)
+
+        # Indexes of the pane tree, built on first use. Panes added, removed or edited by the editor
+        # have to go through add_pane, remove_pane, move_pane and update_pane to keep them up to date.
+        self._panes_by_name = None  # p_panename -> panes with that name
+        self._material_users = None  # material name -> panes using the material
+        self._indexed_panes = None  # pane -> (p_panename, material names) it is indexed under
+
+        # Encoded panes and sections from the last write with cached=True
+        self._encoded = {}
     
     def print_hierarchy(self):
         print("INF1 - {0} {1}".format(self.info.width, self.info.height))
         self.root.print_hierarchy(4)
 
-    def find_elements_that_use_material(self, material, node=None):
-        if node is None:
-            node = self.root
-
-        elements = []
-
-        for child in node.children:
-            if isinstance(child, (Window, )):
-                if material.name in (
-                    child.material,
-                    child.subdata[0]["material"], child.subdata[1]["material"],
-                    child.subdata[2]["material"], child.subdata[3]["material"]
-                ):
-                    elements.append(child.p_panename)
-            elif isinstance(child, (Picture, )):
-                if child.material == material.name:
-                    elements.append(child.p_panename)
-            elif isinstance(child, (Textbox, )):
-                if child.material == material.name:
-                    elements.append(child.p_panename)
-            if isinstance(child, (Window, Picture, Textbox, Pane)) and child.child is not None:
-                elements.extend(self.find_elements_that_use_material(material, child.child))
-
-        return elements
-
-    def rename_material(self, oldname, newname, node=None):
-        if node is None:
-            node = self.root
-
-        elements = []
-
-        for child in node.children:
+    def _build_indexes(self):
+        self._panes_by_name = {}
+        self._material_users = {}
+        self._indexed_panes = {}
+
+        for pane in self.root.iter_panes():
+            self._index_pane(pane)
+
+    def _index_pane(self, pane):
+        # The inner dicts are used as ordered sets
+        names = set(pane.get_material_names())
+        self._indexed_panes[pane] = (pane.p_panename, names)
+        self._panes_by_name.setdefault(pane.p_panename, {})[pane] = None
+        for name in names:
+            self._material_users.setdefault(name, {})[pane] = None
+
+    def _unindex_pane(self, pane):
+        panename, names = self._indexed_panes.pop(pane)
+        del self._panes_by_name[panename][pane]
+        if not self._panes_by_name[panename]:
+            del self._panes_by_name[panename]
+
+        for name in names:
+            del self._material_users[name][pane]
+            if not self._material_users[name]:
+                del self._material_users[name]
+
+    def _check_indexes(self):
+        if self._indexed_panes is None:
+            self._build_indexes()
+
+    def set_dirty(self, item=None):
+        # Call after editing a pane or a material so that the next cached write encodes it again.
+        # Without item everything is encoded again.
+        if item is None:
+            self._encoded = {}
+        elif isinstance(item, MaterialInitData):
+            self._encoded.pop(self.root.materials, None)
+        else:
+            self._encoded.pop(item, None)
+
+    def update_pane(self, pane):
+        # Call after changing the name or the materials of a pane in the layout
+        self._encoded.pop(pane, None)
+        self._check_indexes()
+        if pane in self._indexed_panes:
+            self._unindex_pane(pane)
+        self._index_pane(pane)
+
+    def add_pane(self, parent, pane, index=None):
+        # Adds pane with all its children to the children of parent
+        self._check_indexes()
+        if index is None or parent.child is None:
+            parent.add_child(pane)
+        else:
+            parent.child.children.insert(index, pane)
+            pane.parent = parent
+
+        self._index_pane(pane)
+        if pane.child is not None:
+            for child in pane.child.iter_panes():
+                self._index_pane(child)
+
+    def remove_pane(self, pane):
+        # Removes pane with all its children from the layout
+        self._check_indexes()
+        pane.parent.child.children.remove(pane)
+
+        self._unindex_pane(pane)
+        self._encoded.pop(pane, None)
+        if pane.child is not None:
+            for child in pane.child.iter_panes():
+                self._unindex_pane(child)
+                self._encoded.pop(child, None)
+
+    def move_pane(self, pane, parent, index):
+        # The indexes don't depend on where a pane is in the tree, nothing to update
+        pane.parent.child.children.remove(pane)
+        if parent.child is None:
+            parent.add_child(pane)
+        else:
+            parent.child.children.insert(index, pane)
+            pane.parent = parent
+
+    def find_panes(self, panename):
+        self._check_indexes()
+        return list(self._panes_by_name.get(panename, ()))
+
+    def add_material(self, material):
+        self.root.materials.add_material(material)
+        self.set_dirty(material)
+
+    def remove_material(self, material):
+        self.root.materials.remove_material(material)
+        self.set_dirty(material)
+
+    def get_material(self, name):
+        index = self.root.materials.get_mat_index(name)
+        if index == -1:
+            return None
+        return self.root.materials.materials[index]
+
+    def find_elements_that_use_material(self, material):
+        self._check_indexes()
+        return [pane.p_panename for pane in self._material_users.get(material.name, ())]
+
+    def rename_material(self, oldname, newname):
+        # The material has to be renamed already, this updates the panes that use it
+        self._check_indexes()
+        self._encoded.pop(self.root.materials, None)
+        elements = list(self._material_users.get(oldname, ()))
+
+        for child in elements:
             if isinstance(child, (Window, )):
                 if child.material == oldname:
                     child.material = newname
@@ -1126,39 +1278,38 @@ class ScreenBlo(object):
                     if child.subdata[i]["material"] == oldname:
                         child.subdata[i]["material"] = newname
 
-            elif isinstance(child, (Picture, )):
-                if child.material == oldname:
-                    child.material = newname
-
-            elif isinstance(child, (Textbox, )):
+            elif isinstance(child, (Picture, Textbox)):
                 if child.material == oldname:
                     child.material = newname
 
-            if isinstance(child, (Window, Picture, Textbox, Pane)) and child.child is not None:
-                self.rename_material(oldname, newname, child.child)
+            self.update_pane(child)
 
         return elements
 
-
-    @classmethod 
+    @classmethod
     def from_file(cls, f):
-        magic = f.read(8)
+        return cls.from_buffer(memoryview(f.read()))
+
+    @classmethod
+    def from_buffer(cls, data):
+        # data is the whole BLO file, usually a memoryview so that nothing is copied
+        magic = bytes(data[0:8])
         if magic != b"SCRNblo2":
             raise RuntimeError("Unsupported magic: {0}".format(magic))
-        
-        total_size = read_uint32(f)
-        count = read_uint32(f)
-        
-        svr = f.read(0x10) # ignored
-        
+
+        total_size, count = SCREEN_HEADER.unpack_from(data, 8)
+        # 0x10-0x20: SVR1 section, ignored
+
         blo = cls()
-        blo.info = Information.from_file(f)
-        
-        blo.root = Node.from_file(f)
+        blo.info = Information.from_buffer(data, 0x20)
+
+        blo.root, offset = Node.from_buffer(data, 0x20 + section_size(data, 0x20))
 
         return blo
 
-    def write(self, f):
+    def write(self, f, cached=False):
+        # With cached=True panes and sections that weren't changed since the last cached write
+        # aren't encoded again, everything that was edited has to be passed to set_dirty.
         start = f.tell()
         f.write(b"SCRNblo2")
         f.write(b"ABCD0123")  # placeholder for size + count
@@ -1166,7 +1317,7 @@ class ScreenBlo(object):
         f.write(b"\xFF"*12)
 
         self.info.write(f)
-        count = self.root.write(f)
+        count = self.root.write(f, self._encoded if cached else None)
         f.write(b"EXT1")
         write_uint32(f, 0x8)
         write_pad(f, 0x20)
@@ -1184,15 +1335,30 @@ class ScreenBlo(object):
         
         return result
 
+    def write_json(self, f):
+        # Same text as json.dump(self.serialize(), f, indent=4, ensure_ascii=False)
+        items = ListWriter(f, 0)
+        items.write(self.info.serialize())
+        items.next_item()
+        self.root.write_json(f, 1)
+        items.close()
+
     @classmethod
     def deserialize(cls, obj):
+        items = iter(obj)
         blo = cls()
-        assert obj[0]["type"] == "INF1"
-        blo.info = Information.deserialize(obj[0])
-        blo.root = Node.deserialize(obj[1])
+        info = next(items)
+        assert info["type"] == "INF1"
+        blo.info = Information.deserialize(info)
+        blo.root = Node.deserialize(next(items))
 
         return blo
 
+    @classmethod
+    def from_json(cls, f):
+        # Builds the layout while reading the JSON text file f
+        return cls.deserialize(ListReader(f).iter_list())
+
 
 if __name__ == "__main__":
     """
@@ -1225,13 +1391,13 @@ if __name__ == "__main__":
             blo = ScreenBlo.from_file(f)
 
         with open(outfile, "w", encoding="utf-8") as f:
-            json.dump(blo.serialize(), f, indent=4, ensure_ascii=False)
+            blo.write_json(f)
 
     elif inputfile.endswith(".json"):
         if outfile is None:
             outfile = inputfile+".blo"
         with open(inputfile, "r", encoding="utf-8") as f:
-            blo = ScreenBlo.deserialize(json.load(f))
+            blo = ScreenBlo.from_json(f)
 
         with open(outfile, "wb") as f:
             blo.write(f)
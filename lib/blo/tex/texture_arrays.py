@@ -0,0 +1,599 @@
+import numpy as np
+from PIL import Image
+
+# NumPy versions of the block decoders in texture_utils. The whole image is decoded at once: the raw
+# pixel values of all blocks are read in one go, put in image order with reshape/transpose and turned
+# into colors with lookup tables. The results are the same as the ones of the decoders in texture_utils.
+# Formats are looked up by the names of texture_utils.ImageFormat and PaletteFormat.
+
+# Block width, block height and bytes per block of every image format
+BLOCK_SIZES = {
+  "I4"    : (8, 8, 32),
+  "I8"    : (8, 4, 32),
+  "IA4"   : (8, 4, 32),
+  "IA8"   : (4, 4, 32),
+  "RGB565": (4, 4, 32),
+  "RGB5A3": (4, 4, 32),
+  "RGBA32": (4, 4, 64),
+  "C4"    : (8, 8, 32),
+  "C8"    : (8, 4, 32),
+  "C14X2" : (4, 4, 32),
+  "CMPR"  : (8, 8, 32),
+}
+
+# Number of palette entries the color indexes of a format can refer to
+PALETTE_SIZES = {
+  "C4"   : 1<<4,
+  "C8"   : 1<<8,
+  "C14X2": 1<<14,
+}
+
+_color_tables = {}
+
+
+def swizzle_to_8_bit(v, bits):
+  # Same as texture_utils.swizzle_*_bit_to_8_bit, repeats the bits of v until there are 8
+  if bits == 3:
+    return (v << 5) | (v << 2) | (v >> 1)
+  elif bits == 4:
+    return (v << 4) | v
+  elif bits == 5:
+    return (v << 3) | (v >> 2)
+  elif bits == 6:
+    return (v << 2) | (v >> 4)
+
+def color_table(name):
+  # RGBA colors for every possible value of a pixel or palette format, built on first use
+  if name in _color_tables:
+    return _color_tables[name]
+
+  if name in ("I4", "IA4", "I8"):
+    v = np.arange(256, dtype=np.uint16)
+  else:
+    v = np.arange(1<<16, dtype=np.uint32)
+
+  if name == "I4":
+    i = swizzle_to_8_bit(v & 0xF, 4)
+    r = g = b = a = i
+  elif name == "I8":
+    r = g = b = a = v
+  elif name == "IA4":
+    r = g = b = swizzle_to_8_bit(v & 0xF, 4)
+    a = swizzle_to_8_bit((v >> 4) & 0xF, 4)
+  elif name == "IA8":
+    r = g = b = v & 0xFF
+    a = (v >> 8) & 0xFF
+  elif name == "RGB565":
+    r = swizzle_to_8_bit((v >> 11) & 0x1F, 5)
+    g = swizzle_to_8_bit((v >> 5) & 0x3F, 6)
+    b = swizzle_to_8_bit(v & 0x1F, 5)
+    a = np.full_like(v, 255)
+  elif name == "RGB5A3":
+    # Top bit 0: 0AAARRRRGGGGBBBB, top bit 1: 1RRRRRGGGGGBBBBB with alpha 0xFF
+    opaque = (v & 0x8000) != 0
+    r = np.where(opaque, swizzle_to_8_bit((v >> 10) & 0x1F, 5), swizzle_to_8_bit((v >> 8) & 0xF, 4))
+    g = np.where(opaque, swizzle_to_8_bit((v >> 5) & 0x1F, 5), swizzle_to_8_bit((v >> 4) & 0xF, 4))
+    b = np.where(opaque, swizzle_to_8_bit(v & 0x1F, 5), swizzle_to_8_bit(v & 0xF, 4))
+    a = np.where(opaque, 255, swizzle_to_8_bit((v >> 12) & 0x7, 3))
+  else:
+    raise Exception("No color table for format: %s" % name)
+
+  table = np.stack((r, g, b, a), axis=-1).astype(np.uint8)
+  _color_tables[name] = table
+  return table
+
+def decode_palette(palette_data, palette_format, num_colors):
+  # palette_data are the palette bytes, returns an array of num_colors RGBA colors
+  raw = np.frombuffer(palette_data, dtype=">u2", count=num_colors)
+  return color_table(palette_format.name)[raw]
+
+def decode_palettes(palette_data, palette_format, num_colors):
+  # Same as texture_utils.decode_palettes, a list of RGBA tuples
+  return [tuple(color) for color in decode_palette(palette_data, palette_format, num_colors).tolist()]
+
+def read_blocks(image_data, image_format, blocks_wide, blocks_tall):
+  # The blocks of the image as an array of bytes with one row per block.
+  # Mipmaps after the full size image are ignored.
+  block_width, block_height, block_data_size = BLOCK_SIZES[image_format.name]
+  count = blocks_wide*blocks_tall
+  blocks = np.frombuffer(image_data, dtype=np.uint8, count=count*block_data_size)
+  return blocks.reshape(count, block_data_size)
+
+def untile(pixels, blocks_wide, blocks_tall, block_width, block_height, image_width, image_height):
+  # pixels has one row per block with the pixels of the block row by row, optionally followed by
+  # more dimensions. Returns the pixels in image order cut down to the image size.
+  rest = pixels.shape[2:]
+  pixels = pixels.reshape((blocks_tall, blocks_wide, block_height, block_width) + rest)
+  pixels = pixels.swapaxes(1, 2)
+  pixels = pixels.reshape((blocks_tall*block_height, blocks_wide*block_width) + rest)
+  return pixels[:image_height, :image_width]
+
+def split_nibbles(blocks):
+  # Every byte holds two pixels, the high nibble comes first
+  nibbles = np.empty((blocks.shape[0], blocks.shape[1]*2), dtype=np.uint8)
+  nibbles[:, 0::2] = blocks >> 4
+  nibbles[:, 1::2] = blocks & 0xF
+  return nibbles
+
+def decode_rgba32_blocks(blocks):
+  # The first 32 bytes of a block are alpha/red pairs, the next 32 bytes green/blue pairs
+  ar = blocks[:, :32].reshape(-1, 16, 2)
+  gb = blocks[:, 32:].reshape(-1, 16, 2)
+  return np.stack((ar[:, :, 1], gb[:, :, 0], gb[:, :, 1], ar[:, :, 0]), axis=-1)
+
+def get_interpolated_cmpr_colors(color_0_rgb565, color_1_rgb565):
+  # Same as texture_utils.get_interpolated_cmpr_colors for arrays of key colors,
+  # returns an array with the four colors of every pair
+  table = color_table("RGB565")
+  color_0 = table[color_0_rgb565].astype(np.int32)
+  color_1 = table[color_1_rgb565].astype(np.int32)
+
+  colors = np.empty(color_0.shape[:-1] + (4, 4), dtype=np.int32)
+  colors[..., 0, :] = color_0
+  colors[..., 1, :] = color_1
+
+  four_colors = (color_0_rgb565 > color_1_rgb565)[..., np.newaxis]
+  colors[..., 2, :3] = np.where(four_colors, (2*color_0[..., :3] + color_1[..., :3])//3,
+                                color_0[..., :3]//2 + color_1[..., :3]//2)
+  colors[..., 3, :3] = np.where(four_colors, (color_0[..., :3] + 2*color_1[..., :3])//3, 0)
+  colors[..., 2, 3] = 255
+  colors[..., 3, 3] = np.where(four_colors[..., 0], 255, 0)
+
+  return colors.astype(np.uint8)
+
+def decode_cmpr_blocks(blocks):
+  # A block is made of 2x2 sub-blocks of 4x4 pixels with 8 bytes each: two RGB565 key colors
+  # and 2 bit color indexes for the 16 pixels, the first pixel in the top bits.
+  subblocks = blocks.reshape(-1, 4, 8)
+  color_0 = subblocks[:, :, 0:2].copy().view(">u2")[..., 0]
+  color_1 = subblocks[:, :, 2:4].copy().view(">u2")[..., 0]
+  indexes = subblocks[:, :, 4:8].copy().view(">u4")[..., 0]
+
+  # Colors are looked up as one 32 bit value each, the four colors of a sub-block follow each other
+  colors = get_interpolated_cmpr_colors(color_0, color_1).view(np.uint32).reshape(-1)
+  shifts = np.arange(30, -1, -2, dtype=np.uint32)
+  indexes = (indexes[..., np.newaxis] >> shifts) & 3
+  indexes += np.arange(0, colors.shape[0], 4, dtype=np.uint32).reshape(indexes.shape[:2] + (1, ))
+
+  pixels = colors[indexes]
+  # (block, sub-block y, sub-block x, y, x) -> (block, sub-block y, y, sub-block x, x)
+  pixels = pixels.reshape(-1, 2, 2, 4, 4).transpose(0, 1, 3, 2, 4)
+  return pixels.reshape(-1, 64).view(np.uint8).reshape(-1, 64, 4)
+
+def decode_image_array(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
+  # image_data and palette_data are bytes, returns the pixels as a height x width x 4 array of RGBA values
+  name = image_format.name
+  if name not in BLOCK_SIZES:
+    raise Exception("Unknown image format: %s" % name)
+  block_width, block_height, block_data_size = BLOCK_SIZES[name]
+  blocks_wide = (image_width + (block_width-1)) // block_width
+  blocks_tall = (image_height + (block_height-1)) // block_height
+  blocks = read_blocks(image_data, image_format, blocks_wide, blocks_tall)
+
+  if name in ("RGBA32", "CMPR"):
+    if name == "RGBA32":
+      pixels = decode_rgba32_blocks(blocks)
+    else:
+      pixels = decode_cmpr_blocks(blocks)
+    pixels = untile(pixels, blocks_wide, blocks_tall, block_width, block_height, image_width, image_height)
+    return np.ascontiguousarray(pixels)
+
+  # Everything else stores one value per pixel that is looked up in a table or palette
+  if name in ("I4", "C4"):
+    values = split_nibbles(blocks)
+  elif name in ("I8", "IA4", "C8"):
+    values = blocks
+  else:
+    values = blocks.view(">u2")
+  values = untile(values, blocks_wide, blocks_tall, block_width, block_height, image_width, image_height)
+
+  if name in PALETTE_SIZES:
+    if name == "C14X2":
+      values = values & 0x3FFF
+    # Indexes past the end of the palette only show up in blocks that bleed past the edge of the image.
+    # They are transparent here instead of being an error.
+    table = np.zeros((PALETTE_SIZES[name], 4), dtype=np.uint8)
+    palette = decode_palette(palette_data, palette_format, min(num_colors, PALETTE_SIZES[name]))
+    table[:len(palette)] = palette
+  else:
+    table = color_table(name)
+
+  # Looking up whole pixels as 32 bit values is a lot faster than looking up 4 bytes
+  pixels = table.view(np.uint32)[:, 0][values]
+  return pixels.view(np.uint8).reshape(pixels.shape + (4, ))
+
+def decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
+  pixels = decode_image_array(image_data, palette_data, image_format, palette_format, num_colors,
+                              image_width, image_height)
+  return Image.frombytes("RGBA", (image_width, image_height), pixels.tobytes())
+
+
+# Formats encode_image_data can encode
+ENCODED_FORMATS = ("I4", "I8", "IA4", "IA8", "RGB565", "RGB5A3", "RGBA32", "C4", "C8", "C14X2", "CMPR")
+
+# Value of the pixels of blocks that bleed past the edge of the image
+PADDING = {
+  "I4"    : 0xF,
+  "I8"    : 0xFF,
+  "IA4"   : 0xFF,
+  "IA8"   : 0xFF,
+  "RGB565": 0xFFFF,
+  "RGB5A3": 0xFFFF,
+  "RGBA32": 0xFF,
+  "C4"    : 0xF,
+  "C8"    : 0xFF,
+  "C14X2" : 0x3FFF,
+}
+
+def tile(pixels, block_width, block_height, padding):
+  # The opposite of untile: returns one row per block with the pixels of the block row by row.
+  # Blocks that bleed past the edge of the image are filled up with padding.
+  image_height, image_width = pixels.shape[:2]
+  rest = pixels.shape[2:]
+  blocks_wide = (image_width + (block_width-1)) // block_width
+  blocks_tall = (image_height + (block_height-1)) // block_height
+
+  padded = np.full((blocks_tall*block_height, blocks_wide*block_width) + rest, padding, dtype=pixels.dtype)
+  padded[:image_height, :image_width] = pixels
+  padded = padded.reshape((blocks_tall, block_height, blocks_wide, block_width) + rest)
+  padded = padded.swapaxes(1, 2)
+  return padded.reshape((blocks_tall*blocks_wide, block_height*block_width) + rest)
+
+def convert_rgb_to_greyscale(r, g, b):
+  # Same as texture_utils.convert_rgb_to_greyscale. round() rounds halves to the even number.
+  weighted = r.astype(np.int32)*30 + g.astype(np.int32)*59 + b.astype(np.int32)*11
+  l, remainder = np.divmod(weighted, 100)
+  l += (remainder > 50) | ((remainder == 50) & (l & 1 == 1))
+  return l
+
+def encode_pixel_values(pixels, name):
+  # The value of every pixel in the format, the same as texture_utils.convert_color_to_*
+  r, g, b, a = (pixels[..., i].astype(np.uint32) for i in range(4))
+
+  if name in ("I4", "I8", "IA4", "IA8"):
+    l = convert_rgb_to_greyscale(r, g, b).astype(np.uint32)
+    if name == "I4":
+      return (l >> 4) & 0xF
+    elif name == "I8":
+      return l & 0xFF
+    elif name == "IA4":
+      return ((l >> 4) & 0xF) | (a & 0xF0)
+    else:
+      return (l & 0xFF) | ((a << 8) & 0xFF00)
+  elif name == "RGB565":
+    return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+  elif name == "RGB5A3":
+    # Top bit 0: 0AAARRRRGGGGBBBB, top bit 1 for opaque colors: 1RRRRRGGGGGBBBBB
+    return np.where(a != 255,
+                    ((a >> 5) << 12) | ((r >> 4) << 8) | ((g >> 4) << 4) | (b >> 4),
+                    0x8000 | ((r >> 3) << 10) | ((g >> 3) << 5) | (b >> 3))
+
+# CMPR sub-blocks as they are written: two key colors and the color indexes of the 16 pixels
+CMPR_SUBBLOCK = np.dtype([("color_0", ">u2"), ("color_1", ">u2"), ("indexes", ">u4")])
+
+# How much of the first and the second key color the colors of a sub-block have, for sub-blocks
+# with four colors and for sub-blocks with three colors and transparency
+CMPR_WEIGHTS = np.array([[1, 0], [0, 1], [2/3, 1/3], [1/3, 2/3]])
+CMPR_WEIGHTS_TRANSPARENT = np.array([[1, 0], [0, 1], [1/2, 1/2], [0, 0]])
+
+def convert_colors_to_rgb565(colors):
+  # Rounds to the nearest color instead of cutting off the low bits like texture_utils.convert_color_to_rgb565
+  colors = np.clip(np.rint(colors), 0, 255).astype(np.uint32)
+  r = (colors[..., 0]*31 + 127) // 255
+  g = (colors[..., 1]*63 + 127) // 255
+  b = (colors[..., 2]*31 + 127) // 255
+  return (r << 11) | (g << 5) | b
+
+def get_cmpr_key_colors(colors, opaque):
+  # Fast guess for the key colors of every sub-block: the ends of the line through the colors of
+  # the sub-block along which they differ the most (principal component), found by power iteration.
+  # colors are the RGB colors of the pixels of every sub-block, opaque tells which pixels count.
+  weights = opaque[..., np.newaxis].astype(colors.dtype)
+  count = np.maximum(weights.sum(axis=1), 1)
+  mean = (colors*weights).sum(axis=1) / count
+  centered = (colors - mean[:, np.newaxis])*weights
+  covariance = centered.transpose(0, 2, 1) @ centered
+
+  # Starts with the column of the channel that varies the most, which can't be at a right angle to the
+  # principal component unless there's no variation at all
+  channel = covariance.diagonal(axis1=1, axis2=2).argmax(axis=1)
+  axis = np.take_along_axis(covariance, channel[:, np.newaxis, np.newaxis], axis=2)
+  for i in range(8):
+    axis = covariance @ axis
+    length = np.sqrt((axis*axis).sum(axis=1, keepdims=True))
+    axis = np.where(length > 1e-9, axis / np.maximum(length, 1e-9), 0)
+
+  projected = ((colors - mean[:, np.newaxis]) @ axis)[..., 0]
+  axis = axis[..., 0]
+  t_min = np.where(opaque, projected, np.inf).min(axis=1, initial=np.inf)
+  t_max = np.where(opaque, projected, -np.inf).max(axis=1, initial=-np.inf)
+  t_min = np.where(np.isfinite(t_min), t_min, 0)
+  t_max = np.where(np.isfinite(t_max), t_max, 0)
+
+  color_0 = mean + axis*t_max[:, np.newaxis]
+  color_1 = mean + axis*t_min[:, np.newaxis]
+  return color_0, color_1
+
+def order_cmpr_key_colors(color_0_rgb565, color_1_rgb565, has_opaque, transparent):
+  # Same rules as texture_utils.encode_image_to_cmpr_block: sub-blocks without opaque pixels use black and
+  # white, two equal colors are made different, and the colors are swapped so that sub-blocks with
+  # transparent pixels use three colors and transparency and all other sub-blocks four colors.
+  color_0_rgb565 = np.where(has_opaque, color_0_rgb565, 0x0000)
+  color_1_rgb565 = np.where(has_opaque, color_1_rgb565, 0xFFFF)
+  same = color_0_rgb565 == color_1_rgb565
+  color_1_rgb565 = np.where(same, np.where(color_0_rgb565 == 0, 0xFFFF, 0x0000), color_1_rgb565)
+
+  swap = np.where(transparent, color_0_rgb565 > color_1_rgb565, color_0_rgb565 < color_1_rgb565)
+  return np.where(swap, color_1_rgb565, color_0_rgb565), np.where(swap, color_0_rgb565, color_1_rgb565)
+
+def get_cmpr_color_indexes(colors, opaque, transparent_pixels, color_0_rgb565, color_1_rgb565):
+  # Picks the closest of the colors the key colors give for every pixel, returns the indexes
+  # and the squared error of every sub-block
+  palette = get_interpolated_cmpr_colors(color_0_rgb565, color_1_rgb565)[..., :3].astype(colors.dtype)
+  # |color - palette color|^2 = |color|^2 - 2 color*palette color + |palette color|^2
+  distances = np.einsum("nic,nkc->nik", colors, palette)
+  distances *= -2
+  distances += np.einsum("nkc,nkc->nk", palette, palette)[:, np.newaxis, :]
+  distances += np.einsum("nic,nic->ni", colors, colors)[..., np.newaxis]
+
+  # The fourth color of sub-blocks with three colors is transparent, only transparent pixels use it
+  three_colors = (color_0_rgb565 <= color_1_rgb565)[:, np.newaxis]
+  distances[:, :, 3] = np.where(three_colors, np.inf, distances[:, :, 3])
+
+  indexes = distances.argmin(axis=-1)
+  error = np.where(opaque, np.take_along_axis(distances, indexes[..., np.newaxis], axis=-1)[..., 0], 0).sum(axis=1)
+
+  indexes = np.where(opaque, indexes, 0)
+  indexes = np.where(transparent_pixels & three_colors, 3, indexes)
+  return indexes, error
+
+def refine_cmpr_key_colors(colors, opaque, indexes, color_0_rgb565, color_1_rgb565):
+  # The key colors that fit the chosen color indexes best (least squares). Every pixel is a mix of
+  # the two key colors with the weights of its index.
+  three_colors = (color_0_rgb565 <= color_1_rgb565)[:, np.newaxis, np.newaxis]
+  weights = np.where(three_colors, CMPR_WEIGHTS_TRANSPARENT[indexes], CMPR_WEIGHTS[indexes])
+  weights = weights*opaque[..., np.newaxis]
+
+  a = weights[..., 0]
+  b = weights[..., 1]
+  aa = (a*a).sum(axis=1)
+  ab = (a*b).sum(axis=1)
+  bb = (b*b).sum(axis=1)
+  a_colors = (a[..., np.newaxis]*colors).sum(axis=1)
+  b_colors = (b[..., np.newaxis]*colors).sum(axis=1)
+
+  determinant = aa*bb - ab*ab
+  solvable = np.abs(determinant) > 1e-6
+  determinant = np.where(solvable, determinant, 1)[:, np.newaxis]
+  color_0 = (bb[:, np.newaxis]*a_colors - ab[:, np.newaxis]*b_colors) / determinant
+  color_1 = (aa[:, np.newaxis]*b_colors - ab[:, np.newaxis]*a_colors) / determinant
+
+  return solvable, convert_colors_to_rgb565(color_0), convert_colors_to_rgb565(color_1)
+
+def encode_cmpr_subblocks(pixels, valid, refine=False):
+  # pixels are the RGBA colors of the 16 pixels of every sub-block, valid tells which pixels are inside
+  # the image. Pixels with an alpha below 16 are transparent like in texture_utils.encode_image_to_cmpr_block.
+  # With refine, the key colors are fit to the chosen color indexes a few times.
+  colors = pixels[..., :3].astype(np.float32)
+  transparent_pixels = valid & (pixels[..., 3] < 16)
+  opaque = valid & ~transparent_pixels
+  transparent = transparent_pixels.any(axis=1)
+  has_opaque = opaque.any(axis=1)
+
+  color_0, color_1 = get_cmpr_key_colors(colors, opaque)
+  color_0_rgb565, color_1_rgb565 = order_cmpr_key_colors(
+    convert_colors_to_rgb565(color_0), convert_colors_to_rgb565(color_1), has_opaque, transparent)
+  indexes, error = get_cmpr_color_indexes(colors, opaque, transparent_pixels, color_0_rgb565, color_1_rgb565)
+
+  if refine:
+    for i in range(2):
+      solvable, new_color_0_rgb565, new_color_1_rgb565 = refine_cmpr_key_colors(
+        colors, opaque, indexes, color_0_rgb565, color_1_rgb565)
+      new_color_0_rgb565, new_color_1_rgb565 = order_cmpr_key_colors(
+        new_color_0_rgb565, new_color_1_rgb565, has_opaque, transparent)
+      new_indexes, new_error = get_cmpr_color_indexes(
+        colors, opaque, transparent_pixels, new_color_0_rgb565, new_color_1_rgb565)
+
+      # Only sub-blocks that got better are changed
+      better = solvable & (new_error < error)
+      color_0_rgb565 = np.where(better, new_color_0_rgb565, color_0_rgb565)
+      color_1_rgb565 = np.where(better, new_color_1_rgb565, color_1_rgb565)
+      indexes = np.where(better[:, np.newaxis], new_indexes, indexes)
+      error = np.where(better, new_error, error)
+
+  subblocks = np.empty(pixels.shape[0], dtype=CMPR_SUBBLOCK)
+  subblocks["color_0"] = color_0_rgb565
+  subblocks["color_1"] = color_1_rgb565
+  # The first pixel goes into the top bits
+  shifts = np.arange(30, -1, -2, dtype=np.uint32)
+  subblocks["indexes"] = (indexes.astype(np.uint32) << shifts).sum(axis=1, dtype=np.uint32)
+  return subblocks
+
+def encode_cmpr_image_data(pixels, refine=False):
+  image_height, image_width = pixels.shape[:2]
+  blocks_wide = (image_width + 7) // 8
+  blocks_tall = (image_height + 7) // 8
+
+  padded = np.zeros((blocks_tall*8, blocks_wide*8, 4), dtype=np.uint8)
+  padded[:image_height, :image_width] = pixels
+  valid = np.zeros((blocks_tall*8, blocks_wide*8), dtype=bool)
+  valid[:image_height, :image_width] = True
+
+  # (block y, sub-block y, y, block x, sub-block x, x) -> (block y, block x, sub-block y, sub-block x, y, x)
+  padded = padded.reshape(blocks_tall, 2, 4, blocks_wide, 2, 4, 4).transpose(0, 3, 1, 4, 2, 5, 6)
+  valid = valid.reshape(blocks_tall, 2, 4, blocks_wide, 2, 4).transpose(0, 3, 1, 4, 2, 5)
+
+  return encode_cmpr_subblocks(padded.reshape(-1, 16, 4), valid.reshape(-1, 16), refine).tobytes()
+
+def pack_colors(pixels):
+  # Every RGBA color as one 32 bit number
+  return np.ascontiguousarray(pixels, dtype=np.uint8).reshape(-1, 4).view(np.uint32)[:, 0]
+
+def unpack_colors(packed):
+  return packed.view(np.uint8).reshape(-1, 4)
+
+def median_cut(colors, counts, depth):
+  # Splits the colors into 2**depth buckets like texture_utils.split_colors_into_buckets, but for all buckets
+  # of a level at once and with how often every color is used instead of a list with every pixel.
+  # Buckets are split at the median of the RGB channel with the highest range after sorting by alpha.
+  # Returns the bucket of every color and the color of every bucket, empty buckets are left out.
+  values = colors.astype(np.int64)
+  # The colors, their counts and their buckets are kept sorted by bucket. The colors are moved
+  # around packed into 32 bit numbers.
+  order = np.arange(len(colors))
+  sorted_packed = pack_colors(colors)
+  sorted_counts = counts.astype(np.int64)
+  sorted_buckets = np.zeros(len(colors), dtype=np.int32)
+
+  for level in range(depth):
+    sorted_values = unpack_colors(sorted_packed)
+    starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    ranges = (np.maximum.reduceat(sorted_values[:, :3], starts, axis=0) -
+              np.minimum.reduceat(sorted_values[:, :3], starts, axis=0))
+    r_range, g_range, b_range = ranges[:, 0], ranges[:, 1], ranges[:, 2]
+    channel = np.where((g_range >= r_range) & (g_range >= b_range), 1,
+                       np.where((r_range >= g_range) & (r_range >= b_range), 0, 2))
+    bucket_channels = np.zeros(2**level, dtype=np.intp)
+    bucket_channels[sorted_buckets[starts]] = channel
+
+    channel_values = np.take_along_axis(sorted_values, bucket_channels[sorted_buckets][:, None], axis=1)[:, 0]
+    # Sorted by bucket, then alpha, then the channel. A stable sort keeps the order of equal colors.
+    keys = (sorted_buckets.astype(np.int64) << 16) | (sorted_values[:, 3].astype(np.int64) << 8) | channel_values
+    resorted = np.argsort(keys, kind="stable")
+    order = order[resorted]
+    sorted_packed = sorted_packed[resorted]
+    sorted_counts = sorted_counts[resorted]
+    sorted_buckets = sorted_buckets[resorted]
+
+    # The first half of the pixels of a bucket stays in the first new bucket. Colors aren't divided,
+    # a color goes into the first bucket if its first pixel is in the first half.
+    total_before = np.cumsum(sorted_counts) - sorted_counts
+    bucket_sizes = np.add.reduceat(sorted_counts, starts)
+    bucket_lengths = np.diff(np.r_[starts, len(order)])
+    before = total_before - np.repeat(total_before[starts], bucket_lengths)
+    second_half = before >= np.repeat((bucket_sizes + 1)//2, bucket_lengths)
+
+    sorted_buckets = sorted_buckets*2 + second_half
+
+  buckets = np.empty(len(colors), dtype=np.int32)
+  buckets[order] = sorted_buckets
+
+  # Renumber the buckets that aren't empty
+  used, buckets = np.unique(buckets, return_inverse=True)
+
+  # Buckets with a fully transparent color keep it, the other ones get the average color of their pixels
+  weights = counts.astype(np.int64)
+  total = np.bincount(buckets, weights, minlength=len(used))
+  palette = np.empty((len(used), 4), dtype=np.int64)
+  for i in range(4):
+    palette[:, i] = np.bincount(buckets, values[:, i]*weights, minlength=len(used)) // np.maximum(total, 1)
+  transparent = np.flatnonzero(values[:, 3] == 0)
+  palette[buckets[transparent]] = values[transparent]
+
+  return buckets, palette.astype(np.uint8)
+
+def get_nearest_colors(colors, palette, chunk_size=256):
+  # Index of the nearest palette color for every color, with the distance of texture_utils.get_color_distance_fast
+  palette = palette.astype(np.int32)
+  nearest = np.empty(len(colors), dtype=np.int64)
+  for start in range(0, len(colors), chunk_size):
+    chunk = colors[start:start+chunk_size].astype(np.int32)
+    distances = np.abs(chunk[:, None, :] - palette[None, :, :]).sum(axis=2)
+    nearest[start:start+chunk_size] = distances.argmin(axis=1)
+  return nearest
+
+def generate_palette(pixels, image_format, palette_format):
+  # Vectorized texture_utils.generate_new_palettes_from_image for a height x width x 4 array of RGBA values.
+  # Returns the encoded palette colors, in the order in which they are first used, and the color indexes
+  # as the sorted packed colors of the image together with the palette index of every one of them.
+  # Images with too many colors are reduced with median cut over the colors and their counts.
+  packed = pack_colors(pixels)
+  packed_colors, inverse, counts = np.unique(packed, return_inverse=True, return_counts=True)
+  inverse = inverse.reshape(-1)
+  colors = unpack_colors(packed_colors)
+  encoded = encode_pixel_values(colors, palette_format.name)
+
+  max_colors = PALETTE_SIZES[image_format.name]
+  if len(np.unique(encoded)) > max_colors:
+    cut_colors = colors.copy()
+    cut_counts = counts.copy()
+    if palette_format.name not in ("IA8", "RGB5A3"):
+      cut_colors[:, 3] = 255
+    else:
+      # Like in texture_utils.create_limited_palette_from_image, all fully transparent colors count as
+      # one pixel with the first of them
+      transparent = np.flatnonzero(cut_colors[:, 3] == 0)
+      if len(transparent) > 0:
+        first = inverse[np.argmax(cut_colors[inverse, 3] == 0)]
+        cut_colors[transparent] = cut_colors[first]
+        cut_counts[transparent] = 0
+        cut_counts[first] = 1
+
+    buckets, palette = median_cut(cut_colors, cut_counts, max_colors.bit_length() - 1)
+    new_colors = palette[buckets]
+
+    # Transparent pixels get a transparent color if there is one, like with texture_utils.get_nearest_color_fast.
+    # The other pixels in the bucket of a transparent color get the nearest color in the palette instead.
+    transparent_palette = np.flatnonzero(palette[:, 3] == 0)
+    if len(transparent_palette) > 0:
+      misplaced = np.flatnonzero((new_colors[:, 3] == 0) & (colors[:, 3] != 0))
+      new_colors[misplaced] = palette[get_nearest_colors(colors[misplaced], palette)]
+      new_colors[colors[:, 3] < 16] = palette[transparent_palette[0]]
+    encoded = encode_pixel_values(new_colors, palette_format.name)
+
+  # Palette indexes in the order in which the encoded colors first show up in the image
+  pixel_encoded = encoded[inverse]
+  encoded_colors, first_use = np.unique(pixel_encoded, return_index=True)
+  order = np.argsort(first_use)
+  palette_indexes = np.empty(len(order), dtype=np.int64)
+  palette_indexes[order] = np.arange(len(order))
+
+  color_indexes = palette_indexes[np.searchsorted(encoded_colors, encoded)]
+  return encoded_colors[order].tolist(), (packed_colors, color_indexes)
+
+def encode_palette_data(encoded_colors):
+  return np.array(encoded_colors, dtype=">u2").tobytes()
+
+def lookup_color_indexes(pixels, color_indexes):
+  # The palette index of every pixel, color_indexes are the ones returned by generate_palette
+  colors, indexes = color_indexes
+  packed = pack_colors(pixels)
+  return indexes[np.searchsorted(colors, packed)].reshape(pixels.shape[:2])
+
+def encode_image_data(pixels, image_format, refine_cmpr=False, color_indexes=None):
+  # pixels is a height x width x 4 array of RGBA values, returns the image data of one mipmap.
+  # Palette formats need the color indexes from generate_palette.
+  # With refine_cmpr CMPR images take about three times as long and look a bit better.
+  name = image_format.name
+  if name not in ENCODED_FORMATS:
+    raise Exception("Can't encode image format: %s" % name)
+  block_width, block_height, block_data_size = BLOCK_SIZES[name]
+
+  if name == "CMPR":
+    return encode_cmpr_image_data(pixels, refine_cmpr)
+
+  if name == "RGBA32":
+    blocks = tile(pixels, block_width, block_height, PADDING[name])
+    # Alpha/red pairs of the 16 pixels followed by green/blue pairs
+    data = np.empty((blocks.shape[0], 2, 16, 2), dtype=np.uint8)
+    data[:, 0, :, 0] = blocks[:, :, 3]
+    data[:, 0, :, 1] = blocks[:, :, 0]
+    data[:, 1, :, 0] = blocks[:, :, 1]
+    data[:, 1, :, 1] = blocks[:, :, 2]
+    return data.tobytes()
+
+  if name in PALETTE_SIZES:
+    values = lookup_color_indexes(pixels, color_indexes)
+  else:
+    values = encode_pixel_values(pixels, name)
+  if name in ("IA8", "RGB565", "RGB5A3", "C14X2"):
+    values = values.astype(">u2")
+  else:
+    values = values.astype(np.uint8)
+  blocks = tile(values, block_width, block_height, PADDING[name])
+
+  if name in ("I4", "C4"):
+    # Two pixels per byte, the first one in the high nibble
+    blocks = (blocks[:, 0::2] << 4) | blocks[:, 1::2]
+
+  return blocks.tobytes()
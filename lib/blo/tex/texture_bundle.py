@@ -0,0 +1,141 @@
+import os
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait
+from PIL import Image
+from .bti import BTIFile
+
+# GUI independent part of the texture handling: loading textures into BTI files and images and
+# converting edited images back into BTI files. The QImage and OpenGL side is in textures.py.
+
+FOLDER = "Folder"
+RARC = "RARC"
+
+MAX_IMAGE_SIZE = 1024
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class TextureBundle(object):
+    # qimg is the QImage shown in the editor, None when used without the GUI
+    def __init__(self, img, qimg, bti=None):
+        self.bti = bti
+        self.img = img
+        self.qimg = qimg
+        self.dirty = True
+
+    def update_bti(self):
+        if self.dirty:
+            if self.bti is None:
+                self.bti = BTIFile.create_from_image(self.img)
+            else:
+                self.bti.replace_image(self.img)
+            self.dirty = False
+
+
+def load_image(path):
+    # Loads an image file as RGBA, raises ImageTooLarge for images that can't be used as textures
+    with Image.open(path) as img:
+        img.load()
+    img = img.convert("RGBA")
+
+    if img.width > MAX_IMAGE_SIZE or img.height > MAX_IMAGE_SIZE:
+        exception = ImageTooLarge("Image exceeds {0}x{0}!".format(MAX_IMAGE_SIZE))
+        exception.width = img.width
+        exception.height = img.height
+        raise exception
+
+    return img
+
+
+def load_bti(data):
+    # Returns the BTI file and its decoded image
+    bti = BTIFile(BytesIO(data))
+    img = bti.render()
+
+    return bti, img
+
+
+def decode_texture(source):
+    # Runs in the worker threads of TextureLoader. source is the data of a BTI file or its path,
+    # returns the BTI file, its image and the RGBA bytes of the image.
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            source = f.read()
+    bti, img = load_bti(source)
+
+    return bti, img, img.tobytes()
+
+
+class TextureLoader(object):
+    # Decodes BTI files in a thread pool so that the caller can go on while they load. Textures are
+    # tracked by their lower case name, finished ones are picked up with take_results.
+    # Threads are used instead of processes because the BTI files are edited after loading and
+    # would have to be sent back from the worker processes, most of the decoding happens in
+    # NumPy or Pillow which let other threads run in the meantime.
+    def __init__(self, workers=None):
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.executor = None
+        self.pending = {}
+
+    def start(self, sources):
+        # sources are (name, BTI data or path) pairs, textures that are still loading are dropped
+        self.cancel()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers)
+
+        for name, source in sources:
+            self.pending[name.lower()] = self.executor.submit(decode_texture, source)
+
+    def cancel(self, name=None):
+        # Drops one texture or all of them. Textures that are already being decoded still finish
+        # but aren't returned anymore.
+        if name is None:
+            names = list(self.pending.keys())
+        elif name.lower() in self.pending:
+            names = [name.lower()]
+        else:
+            names = []
+
+        for texname in names:
+            self.pending.pop(texname).cancel()
+
+    def rename(self, old, new):
+        if old.lower() in self.pending:
+            self.pending[new.lower()] = self.pending.pop(old.lower())
+
+    def is_loading(self, name=None):
+        if name is None:
+            return len(self.pending) > 0
+        return name.lower() in self.pending
+
+    def take_results(self, max_count=None):
+        # Returns (name, bti, img, rgba) for up to max_count finished textures, in the order in which
+        # they were started, and (name, error) for the textures that couldn't be decoded.
+        # Missing files are only printed, like when loading textures without the loader.
+        results = []
+        errors = []
+        for name, future in list(self.pending.items()):
+            if max_count is not None and len(results) + len(errors) >= max_count:
+                break
+            if not future.done():
+                continue
+
+            del self.pending[name]
+            try:
+                bti, img, rgba = future.result()
+            except FileNotFoundError as error:
+                print("Texture", error.filename, "not found")
+            except Exception as error:
+                print("Texture", name, "couldn't be loaded:", error)
+                errors.append((name, error))
+            else:
+                results.append((name, bti, img, rgba))
+
+        return results, errors
+
+    def wait(self):
+        # Waits for all textures and returns them like take_results
+        wait(list(self.pending.values()))
+        return self.take_results()
@@ -19,6 +19,13 @@ try:
 except ImportError:
   PY_FAST_TEXTURE_UTILS_INSTALLED = False
 
+try:
+  import numpy
+  from . import texture_arrays
+  NUMPY_INSTALLED = True
+except ImportError:
+  NUMPY_INSTALLED = False
+
 class TooManyColorsError(Exception):
   pass
 
@@ -503,6 +510,9 @@ def decode_palettes(palette_data, palette_format, num_colors, image_format):
   if image_format not in IMAGE_FORMATS_THAT_USE_PALETTES:
     return []
   
+  if NUMPY_INSTALLED:
+    return texture_arrays.decode_palettes(read_all_bytes(palette_data), palette_format, num_colors)
+  
   colors = []
   offset = 0
   for i in range(num_colors):
@@ -523,10 +533,21 @@ def decode_color(raw_color, palette_format):
   
   return color
 
+# With NumPy, the color indexes are an array of the colors in the image and one with their palette indexes
+# instead of a dict, and C14X2 images with too many colors are reduced with median cut over the distinct colors.
 def generate_new_palettes_from_image(image, image_format, palette_format):
   if image_format not in IMAGE_FORMATS_THAT_USE_PALETTES:
     return ([],{})
   
+  if NUMPY_INSTALLED:
+    return texture_arrays.generate_palette(numpy.asarray(image), image_format, palette_format)
+  
+  return generate_new_palettes_from_image_slow(image, image_format, palette_format)
+
+def generate_new_palettes_from_image_slow(image, image_format, palette_format):
+  if image_format not in IMAGE_FORMATS_THAT_USE_PALETTES:
+    return ([],{})
+  
   pixels = image.load()
   width, height = image.size
   encoded_colors = []
@@ -593,6 +614,9 @@ def encode_palette(encoded_colors, palette_format, image_format):
       )
     )
   
+  if NUMPY_INSTALLED:
+    return BytesIO(texture_arrays.encode_palette_data(encoded_colors))
+  
   offset = 0
   new_palette_data = BytesIO()
   for raw_color in encoded_colors:
@@ -604,6 +628,17 @@ def encode_palette(encoded_colors, palette_format, image_format):
 
 
 def decode_image(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
+  if NUMPY_INSTALLED:
+    return texture_arrays.decode_image(
+      read_all_bytes(image_data), read_all_bytes(palette_data),
+      image_format, palette_format, num_colors,
+      image_width, image_height
+    )
+  
+  return decode_image_slow(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height)
+
+# Decodes the image one block at a time, used when NumPy isn't installed
+def decode_image_slow(image_data, palette_data, image_format, palette_format, num_colors, image_width, image_height):
   colors = decode_palettes(palette_data, palette_format, num_colors, image_format)
   
   block_width = BLOCK_WIDTHS[image_format]
@@ -826,7 +861,7 @@ def encode_image_from_path(new_image_file_path, image_format, palette_format, mi
   new_image_data, new_palette_data, encoded_colors = encode_image(image, image_format, palette_format, mipmap_count=mipmap_count)
   return (new_image_data, new_palette_data, encoded_colors, image_width, image_height)
 
-def encode_image(image, image_format, palette_format, mipmap_count=1):
+def encode_image(image, image_format, palette_format, mipmap_count=1, refine_cmpr=False):
   image = image.convert("RGBA")
   image_width, image_height = image.size
   
@@ -837,7 +872,7 @@ def encode_image(image, image_format, palette_format, mipmap_count=1):
     max_colors = MAX_COLORS_FOR_IMAGE_FORMAT[image_format]
     if max_colors <= 256:
       # Pillow's quantize method only supports up to 256 max colors.
-      # So for C14X2 the image must be quantized by custom Python code instead (slower).
+      # So for C14X2 the image is quantized by generate_new_palettes_from_image instead.
       image = image.quantize(max_colors)
       image = image.convert("RGBA")
   
@@ -856,7 +891,8 @@ def encode_image(image, image_format, palette_format, mipmap_count=1):
     mipmap_image_data = encode_mipmap_image(
       mipmap_image, image_format,
       colors_to_color_indexes,
-      mipmap_width, mipmap_height
+      mipmap_width, mipmap_height,
+      refine_cmpr=refine_cmpr
     )
     
     mipmap_image_data.seek(0)
@@ -866,7 +902,19 @@ def encode_image(image, image_format, palette_format, mipmap_count=1):
   
   return (new_image_data, new_palette_data, encoded_colors)
 
-def encode_mipmap_image(image, image_format, colors_to_color_indexes, image_width, image_height):
+# With NumPy, CMPR key colors are picked with a faster and better method than the one used by
+# encode_image_to_cmpr_block. refine_cmpr improves them further for about three times the time.
+def encode_mipmap_image(image, image_format, colors_to_color_indexes, image_width, image_height, refine_cmpr=False):
+  if NUMPY_INSTALLED and image_format.name in texture_arrays.ENCODED_FORMATS:
+    return BytesIO(texture_arrays.encode_image_data(
+      numpy.asarray(image), image_format,
+      refine_cmpr=refine_cmpr, color_indexes=colors_to_color_indexes
+    ))
+  
+  return encode_mipmap_image_slow(image, image_format, colors_to_color_indexes, image_width, image_height)
+
+# Encodes the image one block at a time, used for the formats that can't be encoded with NumPy
+def encode_mipmap_image_slow(image, image_format, colors_to_color_indexes, image_width, image_height):
   pixels = image.load()
   offset_in_image_data = 0
   block_x = 0
@@ -1,18 +1,26 @@
 import os
 from OpenGL.GL import *
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
 from PyQt5.QtGui import QImage
-from io import BytesIO
 from lib.blo.tex.bti import BTIFile
-from PIL import Image
+from lib.blo.tex.texture_bundle import (TextureBundle, TextureLoader, ImageTooLarge, FOLDER, RARC,
+                                        load_image, load_bti)
 from lib.rarc import File
 
-from widgets.editor_widgets import open_error_dialog
-FOLDER = "Folder"
-RARC = "RARC"
+# QImage and OpenGL side of the texture handling, everything that doesn't need the GUI
+# is in texture_bundle.py
 
+# Textures are decoded in the background, the GUI thread picks up at most LOAD_BATCH_SIZE
+# finished textures every LOAD_INTERVAL milliseconds
+LOAD_INTERVAL = 15
+LOAD_BATCH_SIZE = 8
 
-class ImageTooLarge(Exception):
-    pass
+
+def create_qimage(img, rgba=None):
+    # img has to be an RGBA image, rgba are its bytes if they're already at hand
+    if rgba is None:
+        rgba = img.tobytes()
+    return QImage(rgba, img.width, img.height, img.width * 4, QImage.Format_RGBA8888)
 
 
 class GLTexture(object):
@@ -55,24 +63,14 @@ class GLTexture(object):
         self.ID = ID
 
 
-class TextureBundle(object):
-    def __init__(self, img, qimg, bti=None):
-        self.bti = bti
-        self.img = img
-        self.qimg = qimg
-        self.dirty = True
-
-    def update_bti(self):
-        if self.dirty:
-            if self.bti is None:
-                self.bti = BTIFile.create_from_image(self.img)
-            else:
-                self.bti.replace_image(self.img)
-            self.dirty = False
-
+class TextureHandler(QObject):
+    # Emitted with the lower case names of textures that finished loading in the background
+    textures_loaded = pyqtSignal(list)
+    # Emitted with (name, error) for textures that couldn't be decoded
+    textures_failed = pyqtSignal(list)
 
-class TextureHandler(object):
     def __init__(self):
+        super().__init__()
         self.textures = {}
         self.textures_render = {}
         self.origin = None
@@ -80,6 +78,11 @@ class TextureHandler(object):
         self.marked_for_deletion = []
         self.cleanup = []
 
+        self.loader = TextureLoader()
+        self.load_timer = QTimer(self)
+        self.load_timer.setInterval(LOAD_INTERVAL)
+        self.load_timer.timeout.connect(self.add_loaded_textures)
+
     def update_gl(self):
         if self.dirty:
             for texname, tex in self.textures_render.items():
@@ -109,16 +112,9 @@ class TextureHandler(object):
         return texname
 
     def replace_from_path(self, path, name):
-        with Image.open(path) as img:
-            img.load()
-        img = img.convert("RGBA")
-        qimg = QImage(img.tobytes(), img.width, img.height, img.width * 4, QImage.Format_RGBA8888)
-        #qimg = QImage(path).convertToFormat(QImage.Format_RGBA8888)
-        if qimg.width() > 1024 or qimg.height() > 1024:
-            exception = ImageTooLarge("Image exceeds 1024x1024!")
-            exception.width = qimg.width()
-            exception.height = qimg.height()
-            raise exception
+        img = load_image(path)
+        self.loader.cancel(name)
+        qimg = create_qimage(img)
         bti = BTIFile.create_placeholder()
         self.textures[name.lower()] = TextureBundle(img, qimg, bti)
         if name.lower() in self.textures_render:
@@ -133,16 +129,26 @@ class TextureHandler(object):
             return self.textures[name.lower()].bti
 
     def update_format(self, name):
-        self.textures[name.lower()].dirty = True
+        # A texture that is still loading gets its new format from the loaded BTI
+        if name.lower() in self.textures:
+            self.textures[name.lower()].dirty = True
 
     def delete_texture(self, name):
         self.marked_for_deletion.append(name.lower())
+        if self.loader.is_loading(name):
+            self.loader.cancel(name)
+            return
         del self.textures[name.lower()]
         del self.textures_render[name.lower()]
 
     def save_to_folder(self, textures, path):
+        self.finish_loading()
         for texname in textures:
             tex = texname.lower()
+            if tex not in self.textures:
+                # Textures that couldn't be loaded are left as they are
+                print("Texture", texname, "isn't loaded, not saving it")
+                continue
             texbundle = self.textures[tex]
             texbundle: TextureBundle
 
@@ -161,14 +167,18 @@ class TextureHandler(object):
         self.marked_for_deletion = []
 
     def save_to_archive_folder(self, textures, arcdir):
+        self.finish_loading()
         for texname in textures:
             tex = texname.lower()
+            if tex not in self.textures:
+                print("Texture", texname, "isn't loaded, not saving it")
+                continue
             texbundle = self.textures[tex]
             texbundle: TextureBundle
 
             texbundle.update_bti()
             try:
-                file = arcdir[tex]
+                file = arcdir.find(tex)
             except FileNotFoundError:
                 file = File(tex)
                 arcdir.files[tex] = file
@@ -179,51 +189,82 @@ class TextureHandler(object):
 
         for tex in self.marked_for_deletion:
             print("Deleting file", tex)
-            del arcdir.files[tex.lower()]
+            try:
+                file = arcdir.find(tex)
+            except FileNotFoundError:
+                pass
+            else:
+                del arcdir.files[file.name]
 
         self.marked_for_deletion = []
 
     def init_from_folder(self, textures, path):
         self.textures = {}
-        for texname, gltex in self.textures_render.items():
-            self.cleanup.extend(self.textures_render.values())
+        self.cleanup.extend(self.textures_render.values())
         self.textures_render = {}
         self.origin = FOLDER
         self.dirty = True
 
-        for filename in textures:
-            filepath = os.path.join(path, filename.lower())
-            try:
-                with open(filepath, "rb") as f:
-                    bti = BTIFile(BytesIO(f.read()))
-                    img = bti.render()
-                    qimg = QImage(img.tobytes(), bti.width, bti.height, bti.width * 4, QImage.Format_RGBA8888)
-
-                    self.textures[filename.lower()] = TextureBundle(img, qimg, bti)
-                    self.textures_render[filename.lower()] = GLTexture(qimg)
-            except FileNotFoundError:
-                print("Texture", filepath, "not found")
-                pass
+        sources = [(filename, os.path.join(path, filename.lower())) for filename in textures]
+        self.start_loading(sources)
 
     def init_from_archive_dir(self, textures, rarcdir):
         self.textures = {}
-        for texname, gltex in self.textures_render.items():
-            self.cleanup.extend(self.textures_render.values())
+        self.cleanup.extend(self.textures_render.values())
         self.textures_render = {}
         self.origin = RARC
         self.dirty = True
+
+        sources = []
         for filename in textures:
-            if filename.lower() in rarcdir.files:
-                file = rarcdir.files[filename.lower()]
-                bti = BTIFile(BytesIO(file.read()))
+            try:
+                file = rarcdir.find(filename)
+            except FileNotFoundError:
+                pass
+            else:
+                sources.append((filename, file.read()))
                 file.seek(0)
-                img = bti.render()
-                qimg = QImage(img.tobytes(), bti.width, bti.height, bti.width * 4, QImage.Format_RGBA8888)
+        self.start_loading(sources)
+
+    def start_loading(self, sources):
+        # The textures are decoded in the background and show up one batch at a time,
+        # the layout can be edited in the meantime
+        self.loader.start(sources)
+        if self.loader.is_loading():
+            self.load_timer.start()
+        else:
+            self.load_timer.stop()
+
+    def add_textures(self, results, errors):
+        if errors:
+            self.textures_failed.emit(errors)
 
-                self.textures[filename.lower()] = TextureBundle(img, qimg, bti)
-                self.textures_render[filename.lower()] = GLTexture(qimg)
+        names = []
+        for name, bti, img, rgba in results:
+            qimg = create_qimage(img, rgba)
+            self.textures[name] = TextureBundle(img, qimg, bti)
+            self.textures_render[name] = GLTexture(qimg)
+            names.append(name)
+
+        if names:
+            self.dirty = True
+            self.textures_loaded.emit(names)
+
+    def add_loaded_textures(self):
+        self.add_textures(*self.loader.take_results(LOAD_BATCH_SIZE))
+        if not self.loader.is_loading():
+            self.load_timer.stop()
+
+    def finish_loading(self):
+        # Waits for the textures that are still loading, e.g. before saving
+        self.add_textures(*self.loader.wait())
+        self.load_timer.stop()
 
     def rename(self, old, new):
+        if self.loader.is_loading(old):
+            self.loader.rename(old, new)
+            return
+
         old_lo, new_lo = old.lower(), new.lower()
         assert old_lo in self.textures
         assert new_lo not in self.textures
@@ -237,7 +278,7 @@ class TextureHandler(object):
         self.textures_render[new_lo] = tmp_render
 
     def exists(self, name):
-        return name.lower() in self.textures
+        return name.lower() in self.textures or self.loader.is_loading(name)
 
     def get_texture_image(self, texname):
         if texname.lower() in self.textures:
@@ -4,13 +4,19 @@ from math import radians
 from OpenGL.GL import *
 from .model_rendering import (GenericObject, Model, TexturedModel,
                               GenericFlyer, GenericCrystallWall, GenericLongLegs, GenericChappy, GenericSnakecrow,
-                              GenericSwimmer, Cube, PaneRender)
+                              GenericSwimmer, Cube, PaneRender, colors)
 from lib.blo.readblo2 import ScreenBlo, Pane, Window, Textbox, Picture
 from lib.vectors import Matrix4x4
 import blo_editor_widgets
 
-with open("lib/color_coding.json", "r") as f:
-    colors = json.load(f)
+# Models loaded from resources/ on first use: attribute name -> (path, keyword arguments for Model.from_obj)
+RESOURCE_MODELS = {
+    "sphere": ("resources/unitsphere.obj", {}),
+    "cylinder": ("resources/unitcylinder.obj", {}),
+    "circle": ("resources/unitcircle.obj", {}),
+    "wireframe_cube": ("resources/unitcube_wireframe.obj", {}),
+    "arrow_head": ("resources/arrow_head.obj", {"scale": 300.0}),
+}
 
 
 class ObjectModels(object):
@@ -51,20 +57,18 @@ class ObjectModels(object):
                     for name in enemies:
                         self.models[name.title()] = genericmodels[enemytype]
 
-        with open("resources/unitsphere.obj", "r") as f:
-            self.sphere = Model.from_obj(f, rotate=True)
+    def __getattr__(self, name):
+        # Only called for attributes that don't exist yet. The resource models are parsed
+        # the first time they are used, most of them are never needed for layouts.
+        if name not in RESOURCE_MODELS:
+            raise AttributeError(name)
 
-        with open("resources/unitcylinder.obj", "r") as f:
-            self.cylinder = Model.from_obj(f, rotate=True)
+        path, kwargs = RESOURCE_MODELS[name]
+        with open(path, "r") as f:
+            model = Model.from_obj(f, rotate=True, **kwargs)
+        setattr(self, name, model)
 
-        with open("resources/unitcircle.obj", "r") as f:
-            self.circle = Model.from_obj(f, rotate=True)
-
-        with open("resources/unitcube_wireframe.obj", "r") as f:
-            self.wireframe_cube = Model.from_obj(f, rotate=True)
-
-        with open("resources/arrow_head.obj", "r") as f:
-            self.arrow_head = Model.from_obj(f, rotate=True, scale=300.0)
+        return model
 
     def init_gl(self):
         for dirpath, dirs, files in os.walk("resources/objectmodels"):
@@ -229,25 +233,29 @@ class ObjectModels(object):
         if anim_transforms is None:
             anim_transforms = {}
 
-        for child in node.children:
-            if isinstance(child, Pane):
-                if child.animated and bck is not None and child.p_bckindex < len(bck.animations):
-                    anim = bck.animations[child.p_bckindex]
-                    values = anim.interpolate(frame_time)
-                    matrix = Matrix4x4.from_j2d_srt(*values)
-                    anim_transforms[child] = values
-                else:
-                    matrix = Matrix4x4.from_j2d_srt(child.p_offset_x, child.p_offset_y,
-                                                    child.p_scale_x, child.p_scale_y,
-                                                    radians(child.p_rotation))
-                if transform is not None:
-                    matrix = transform.multiply_mat4(matrix)
-                # print("Matrix for", child.p_panename, matrix)
-
-                transforms[child] = matrix
-
-                if child.child is not None:
-                    self.precompute_transforms(child.child, bck, frame_time, matrix, transforms, anim_transforms)
+        # Nodes still to be visited with the transform of the pane they belong to
+        stack = [(node, transform)]
+        while stack:
+            node, transform = stack.pop()
+            for child in node.children:
+                if isinstance(child, Pane):
+                    if child.animated and bck is not None and child.p_bckindex < len(bck.animations):
+                        anim = bck.animations[child.p_bckindex]
+                        values = anim.interpolate(frame_time)
+                        matrix = Matrix4x4.from_j2d_srt(*values)
+                        anim_transforms[child] = values
+                    else:
+                        matrix = Matrix4x4.from_j2d_srt(child.p_offset_x, child.p_offset_y,
+                                                        child.p_scale_x, child.p_scale_y,
+                                                        radians(child.p_rotation))
+                    if transform is not None:
+                        matrix = transform.multiply_mat4(matrix)
+                    # print("Matrix for", child.p_panename, matrix)
+
+                    transforms[child] = matrix
+
+                    if child.child is not None:
+                        stack.append((child.child, matrix))
 
         return transforms, anim_transforms
 
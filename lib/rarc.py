@@ -1,8 +1,12 @@
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from
 from io import BytesIO
 from itertools import chain
-from .yaz0 import decompress, compress_fast, read_uint32, read_uint16
+from fnmatch import fnmatchcase
+from .yaz0 import (decompress_data, compress_data, compress_data_parallel, read_uint32, read_uint16,
+                   COMPRESSION_LEVELS, DEFAULT_LEVEL, DEFAULT_SEGMENT_SIZE)
 
+import os
+import mmap
 import time
 
 
@@ -14,6 +18,10 @@ def write_uint16(f, val):
     f.write(pack(">H", val))
 
 
+def align32(value):
+    return (value + 0x1F) & ~0x1F
+
+
 def write_pad32(f):
     next_aligned_pos = (f.tell() + 0x1F) & ~0x1F
 
@@ -63,24 +71,19 @@ class StringTable(object):
         f.write(self._strings.getvalue())
 
 
-def stringtable_get_name(f, stringtable_offset, offset):
-    current = f.tell()
-    f.seek(stringtable_offset+offset)
-
-    stringlen = 0
-    while f.read(1) != b"\x00":
-        stringlen += 1
+def stringtable_get_name(data, stringtable_offset, offset):
+    start = stringtable_offset+offset
+    end = start
+    while data[end] != 0:
+        end += 1
 
-    f.seek(stringtable_offset+offset)
-
-    filename = f.read(stringlen)
+    filename = bytes(data[start:end])
     try:
         decodedfilename = filename.decode("shift-jis")
     except:
         print("filename", filename)
         print("failed")
         raise
-    f.seek(current)
 
     return decodedfilename
 
@@ -96,14 +99,230 @@ def split_path(path): # Splits path at first backslash encountered
     return path, None
 
 
+class EntryDict(dict):
+    # Holds the files or subdirectories of a directory. Added and removed entries are
+    # passed on to the directory so that the path index of the archive stays up to date.
+    def __init__(self, directory, entries=None):
+        super().__init__()
+        self._directory = directory
+
+        if entries is not None:
+            self.update(entries)
+
+    def __setitem__(self, name, entry):
+        if name in self:
+            self._directory._entry_removed(name, self[name])
+        super().__setitem__(name, entry)
+        self._directory._entry_added(name, entry)
+
+    def __delitem__(self, name):
+        entry = self[name]
+        super().__delitem__(name)
+        self._directory._entry_removed(name, entry)
+
+    def pop(self, name, *default):
+        if name in self:
+            entry = self[name]
+            del self[name]
+            return entry
+        elif default:
+            return default[0]
+        else:
+            raise KeyError(name)
+
+    def popitem(self):
+        name, entry = super().popitem()
+        self._directory._entry_removed(name, entry)
+        return name, entry
+
+    def setdefault(self, name, default=None):
+        if name not in self:
+            self[name] = default
+        return self[name]
+
+    def update(self, entries=(), **kwargs):
+        for name, entry in chain(dict(entries).items(), kwargs.items()):
+            self[name] = entry
+
+    def clear(self):
+        for name in list(self.keys()):
+            del self[name]
+
+
+class PathIndex(object):
+    # Case-insensitive index of the full paths of all entries in an archive.
+    # If two paths only differ in case, the one added last is used.
+    # Directories that haven't been loaded from the archive yet are only added with their entries
+    # once a lookup needs them, get() only loads the directories along the path.
+    def __init__(self):
+        self._entries = {} # lowercase path -> (path, entry)
+        self._extensions = {} # lowercase file extension -> {lowercase path: path}
+        self._unexpanded = {} # lowercase path -> (path, directory) for directories without their entries
+
+    def add(self, path, entry):
+        key = path.lower()
+        if key in self._entries:
+            self.remove(*self._entries[key])
+        self._entries[key] = (path, entry)
+
+        if isinstance(entry, Directory):
+            if entry.is_loaded():
+                self._add_entries(path, entry)
+            else:
+                self._unexpanded[key] = (path, entry)
+        else:
+            extension = get_extension(key)
+            if extension not in self._extensions:
+                self._extensions[extension] = {}
+            self._extensions[extension][key] = path
+
+    def _add_entries(self, path, directory):
+        for name, subentry in chain(directory.files.items(), directory.subdirs.items()):
+            self.add(path + "/" + name, subentry)
+
+    def _expand(self, key):
+        path, directory = self._unexpanded.pop(key)
+        self._add_entries(path, directory)
+
+    def _expand_all(self):
+        while self._unexpanded:
+            self._expand(next(iter(self._unexpanded)))
+
+    def remove(self, path, entry):
+        key = path.lower()
+        if key not in self._entries or self._entries[key][1] is not entry:
+            return
+        del self._entries[key]
+
+        if isinstance(entry, Directory):
+            # A directory that isn't loaded has no entries in the index yet
+            self._unexpanded.pop(key, None)
+            if entry.is_loaded():
+                for name, subentry in chain(entry.files.items(), entry.subdirs.items()):
+                    self.remove(path + "/" + name, subentry)
+        else:
+            del self._extensions[get_extension(key)][key]
+
+    def get(self, path):
+        key = path.lower().replace("\\", "/").rstrip("/")
+        while key not in self._entries:
+            # Adds the entries of the closest directory on the path that doesn't have them yet
+            parent = key.rpartition("/")[0]
+            while parent and parent not in self._entries:
+                parent = parent.rpartition("/")[0]
+            if parent not in self._unexpanded:
+                return None
+            self._expand(parent)
+
+        return self._entries[key]
+
+    def glob(self, pattern):
+        self._expand_all()
+        pattern = pattern.lower().replace("\\", "/")
+
+        # Patterns like "*/scrn/*.blo" only need to check paths with the right extension
+        extension = get_extension(pattern)
+        if (len(extension) > 1 and pattern.endswith("*" + extension)
+                and not any(c in extension for c in "*?[")):
+            candidates = self._extensions.get(extension, {}).items()
+        else:
+            candidates = ((key, path) for key, (path, entry) in self._entries.items())
+
+        return [path for key, path in candidates if fnmatchcase(key, pattern)]
+
+    def find_suffix(self, suffix, dirpath=None):
+        self._expand_all()
+        suffix = suffix.lower()
+        prefix = "" if dirpath is None else dirpath.lower().rstrip("/") + "/"
+        return [path for key, (path, entry) in self._entries.items()
+                if key.endswith(suffix) and key.startswith(prefix)]
+
+
+def get_extension(path):
+    name = path.rpartition("/")[2]
+    if "." in name:
+        return "." + name.rpartition(".")[2]
+    else:
+        return ""
+
+
 class Directory(object):
     def __init__(self, dirname, nodeindex=None):
-        self.files = {}
-        self.subdirs = {}
+        self._files = EntryDict(self)
+        self._subdirs = EntryDict(self)
         self.name = dirname
         self._nodeindex = nodeindex
 
         self.parent = None
+        self._archive = None # Only set on the root directory of an archive
+
+        # Directories of a loaded archive only read their entries from the archive
+        # when files or subdirs are accessed for the first time, see from_node.
+        self._entrysource = None
+
+    @property
+    def files(self):
+        if self._entrysource is not None:
+            self._load_entries()
+        return self._files
+
+    @files.setter
+    def files(self, files):
+        if self._entrysource is not None:
+            self._load_entries()
+        self._files.clear()
+        self._files.update(files)
+
+    @property
+    def subdirs(self):
+        if self._entrysource is not None:
+            self._load_entries()
+        return self._subdirs
+
+    @subdirs.setter
+    def subdirs(self, subdirs):
+        if self._entrysource is not None:
+            self._load_entries()
+        self._subdirs.clear()
+        self._subdirs.update(subdirs)
+
+    def is_loaded(self):
+        return self._entrysource is None
+
+    def path(self):
+        names = []
+        dir = self
+        while dir is not None:
+            names.append(dir.name)
+            dir = dir.parent
+
+        return "/".join(reversed(names))
+
+    def _get_pathindex(self):
+        dir = self
+        while dir.parent is not None:
+            dir = dir.parent
+
+        if dir._archive is None:
+            return None
+        else:
+            return dir._archive._pathindex
+
+    def _entry_added(self, name, entry):
+        if isinstance(entry, Directory):
+            entry.parent = self
+
+        pathindex = self._get_pathindex()
+        if pathindex is not None:
+            pathindex.add(self.path() + "/" + name, entry)
+
+    def _entry_removed(self, name, entry):
+        pathindex = self._get_pathindex()
+        if pathindex is not None:
+            pathindex.remove(self.path() + "/" + name, entry)
+
+        if isinstance(entry, Directory) and entry.parent is self:
+            entry.parent = None
 
     @classmethod
     def from_dir(cls, path, follow_symlinks=False):
@@ -128,7 +347,7 @@ class Directory(object):
 
 
     @classmethod
-    def from_node(cls, f, _name, stringtable_offset, globalentryoffset, dataoffset, nodelist, currentnodeindex, parents=None):
+    def from_node(cls, data, _name, stringtable_offset, globalentryoffset, dataoffset, nodelist, currentnodeindex, parents=None):
         #print("=============================")
         #print("Creating new node with index", currentnodeindex)
         name, unknown, entrycount, entryoffset = nodelist[currentnodeindex]
@@ -136,20 +355,24 @@ class Directory(object):
             name = _name 
 
         newdir = cls(name, currentnodeindex)
+        newdir._entrysource = (data, stringtable_offset, globalentryoffset, dataoffset, nodelist, currentnodeindex, parents)
+
+        return newdir
+
+    def _load_entries(self):
+        data, stringtable_offset, globalentryoffset, dataoffset, nodelist, currentnodeindex, parents = self._entrysource
+        self._entrysource = None
+
+        name, unknown, entrycount, entryoffset = nodelist[currentnodeindex]
 
-        firstentry = globalentryoffset+entryoffset
         #print("Node", currentnodeindex, name, entrycount, entryoffset)
-        #print("offset", f.tell())
         for i in range(entrycount):
             offset = globalentryoffset + (entryoffset+i)*20
-            f.seek(offset)
 
-            fileentry_data = f.read(20)
+            fileid, hashcode, flags, padbyte, nameoffset, filedataoffset, datasize, padding = unpack_from(">HHBBHIII", data, offset)
+            #print("offset", hex(offset), fileid, flags, nameoffset)
 
-            fileid, hashcode, flags, padbyte, nameoffset, filedataoffset, datasize, padding = unpack(">HHBBHIII", fileentry_data)
-            #print("offset", hex(firstentry+i*20), fileid, flags, nameoffset)
-
-            name = stringtable_get_name(f, stringtable_offset, nameoffset)
+            name = stringtable_get_name(data, stringtable_offset, nameoffset)
 
             #print("name", name, fileid)
 
@@ -162,7 +385,6 @@ class Directory(object):
                 #nodeindex, datasize, padding = unpack(">III", fileentrydata)
                 nodeindex = filedataoffset
 
-                name = stringtable_get_name(f, stringtable_offset, nameoffset)
                 #print(name, hashcode, hash_name(name))
 
 
@@ -176,18 +398,17 @@ class Directory(object):
                     print("Skipping")
                     continue
 
-                subdir = Directory.from_node(f, name, stringtable_offset, globalentryoffset, dataoffset, nodelist, nodeindex, parents=newparents)
-                subdir.parent = newdir
+                subdir = Directory.from_node(data, name, stringtable_offset, globalentryoffset, dataoffset, nodelist, nodeindex, parents=newparents)
+                subdir.parent = self
 
-                newdir.subdirs[subdir.name] = subdir
+                # Entries are added without notifying the path index, it adds the entries
+                # of this directory itself when a lookup needs them.
+                dict.__setitem__(self._subdirs, subdir.name, subdir)
 
 
             else: # entry is a file
-                f.seek(offset)
-                file = File.from_fileentry(f, stringtable_offset, dataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize)
-                newdir.files[file.name] = file
-
-        return newdir
+                file = File.from_fileentry(data, stringtable_offset, dataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize)
+                dict.__setitem__(self._files, file.name, file)
 
     def walk(self, _path=None):
         if _path is None:
@@ -222,12 +443,12 @@ class Directory(object):
         name, rest = split_path(path)
 
         if rest is None or rest.strip() == "":
-            if isinstance(name, File):
+            if isinstance(entry, File):
                 if name in self.subdirs:
                     raise FileExistsError("Cannot add file, '{}' already exists as a directory".format(path))
 
                 self.files[name] = entry
-            elif isinstance(name, Directory):
+            elif isinstance(entry, Directory):
                 if name in self.files:
                     raise FileExistsError("Cannot add directory, '{}' already exists as a file".format(path))
 
@@ -238,7 +459,63 @@ class Directory(object):
         elif name in self.files:
             raise RuntimeError("File", name, "is a directory in path", path, "which should not happen!")
         else:
-            return self.subdirs[name][rest]
+            self.subdirs[name][rest] = entry
+
+    def __delitem__(self, path):
+        name, rest = split_path(path)
+
+        if rest is None or rest.strip() == "":
+            if name in self.subdirs:
+                del self.subdirs[name]
+            elif name in self.files:
+                del self.files[name]
+            else:
+                raise FileNotFoundError(path)
+        elif name in self.subdirs:
+            del self.subdirs[name][rest]
+        else:
+            raise FileNotFoundError(path)
+
+    def find(self, path):
+        # Case-insensitive lookup of a path relative to this directory. Uses the path index
+        # of the archive if the directory is part of one.
+        root = self
+        while root.parent is not None:
+            root = root.parent
+
+        if root._archive is not None:
+            return root._archive.find(self.path() + "/" + path)
+
+        entry = self
+        for name in path.replace("\\", "/").strip("/").split("/"):
+            if not isinstance(entry, Directory):
+                raise FileNotFoundError(path)
+
+            for entryname, subentry in chain(entry.files.items(), entry.subdirs.items()):
+                if entryname.lower() == name.lower():
+                    entry = subentry
+                    break
+            else:
+                raise FileNotFoundError(path)
+
+        return entry
+
+    def find_suffix(self, suffix):
+        # Paths relative to this directory of all entries in it and its subdirectories
+        # ending with suffix, case-insensitive
+        prefix = self.path() + "/"
+        root = self
+        while root.parent is not None:
+            root = root.parent
+
+        if root._archive is not None:
+            paths = root._archive.find_suffix(suffix, self.path())
+        else:
+            pathindex = PathIndex()
+            pathindex.add(self.path(), self)
+            paths = pathindex.find_suffix(suffix, self.path())
+
+        return [path[len(prefix):] for path in paths]
 
     def listdir(self, path):
         if path == ".":
@@ -273,6 +550,12 @@ class File(BytesIO):
         self._hashcode = hashcode
         self._flags = flags
 
+        # Files loaded from an archive are read-only views into the archive's buffer
+        # so that the data isn't copied for every file. The data is only copied into
+        # the BytesIO once the file is written to.
+        self._view = None
+        self._viewpos = 0
+
     @classmethod
     def from_file(cls, filename, f):
         file = cls(filename)
@@ -283,8 +566,8 @@ class File(BytesIO):
         return file
 
     @classmethod
-    def from_fileentry(cls, f, stringtable_offset, globaldataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize):
-        filename = stringtable_get_name(f, stringtable_offset, nameoffset)
+    def from_fileentry(cls, data, stringtable_offset, globaldataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize):
+        filename = stringtable_get_name(data, stringtable_offset, nameoffset)
         """print("-----")
         print("File", len(filename))
         print("size", datasize)
@@ -292,21 +575,146 @@ class File(BytesIO):
         print(hex(datasize))"""
         file = cls(filename, fileid, hashcode, flags)
 
-        f.seek(globaldataoffset+filedataoffset)
-        file.write(f.read(datasize))
+        start = globaldataoffset+filedataoffset
+        file._view = data[start:start+datasize]
         DATA[0] += datasize
-        # Reset file position
-        file.seek(0)
 
         return file
 
+    def is_view(self):
+        return self._view is not None
+
+    def materialize(self):
+        # Copies the data into the BytesIO, after that the file can be modified
+        if self._view is not None:
+            view = self._view
+            pos = self._viewpos
+            self._view = None
+
+            super().write(view)
+            super().seek(pos)
+
+    def size(self):
+        if self._view is not None:
+            return len(self._view)
+        else:
+            return len(self.getbuffer())
+
+    def read(self, size=-1):
+        if self._view is None:
+            return super().read(size)
+
+        start = self._viewpos
+        end = len(self._view)
+        if size is not None and size >= 0 and start + size < end:
+            end = start + size
+        if start >= end:
+            return b""
+
+        self._viewpos = end
+        return self._view[start:end].tobytes()
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def readinto(self, buffer):
+        if self._view is None:
+            return super().readinto(buffer)
+
+        start = self._viewpos
+        size = min(len(buffer), len(self._view) - start)
+        if size <= 0:
+            return 0
+
+        buffer[:size] = self._view[start:start+size]
+        self._viewpos = start + size
+        return size
+
+    def seek(self, pos, whence=0):
+        if self._view is None:
+            return super().seek(pos, whence)
+
+        if whence == 0:
+            newpos = pos
+        elif whence == 1:
+            newpos = self._viewpos + pos
+        elif whence == 2:
+            newpos = len(self._view) + pos
+        else:
+            raise ValueError("invalid whence ({0}, should be 0, 1 or 2)".format(whence))
+
+        if newpos < 0:
+            raise ValueError("negative seek value {0}".format(newpos))
+
+        self._viewpos = newpos
+        return newpos
+
+    def tell(self):
+        if self._view is None:
+            return super().tell()
+        return self._viewpos
+
+    def getvalue(self):
+        if self._view is None:
+            return super().getvalue()
+        return self._view.tobytes()
+
+    def getbuffer(self):
+        self.materialize()
+        return super().getbuffer()
+
+    def readline(self, size=-1):
+        self.materialize()
+        return super().readline(size)
+
+    def readlines(self, hint=-1):
+        self.materialize()
+        return super().readlines(hint)
+
+    def __iter__(self):
+        self.materialize()
+        return super().__iter__()
+
+    def write(self, data):
+        self.materialize()
+        return super().write(data)
+
+    def writelines(self, lines):
+        self.materialize()
+        return super().writelines(lines)
+
+    def truncate(self, size=None):
+        self.materialize()
+        return super().truncate(size)
+
     def dump(self, f):
-        f.write(self.getvalue())
+        if self._view is not None:
+            f.write(self._view)
+        else:
+            f.write(self.getbuffer())
 
 
 class Archive(object):
     def __init__(self):
-        self.root = None
+        self._root = None
+
+        # Case-insensitive index of all paths, created on first use by find, glob and find_suffix
+        self._pathindex = None
+
+    @property
+    def root(self):
+        return self._root
+
+    @root.setter
+    def root(self, root):
+        if self._root is not None:
+            self._root._archive = None
+        if root is not None:
+            root._archive = self
+            root.parent = None
+
+        self._root = root
+        self._pathindex = None
 
     @classmethod
     def from_dir(cls, path, follow_symlinks=False):
@@ -318,8 +726,10 @@ class Archive(object):
 
 
     @classmethod
-    def from_file(cls, f):
-        newarc = cls()
+    def from_file(cls, f, use_mmap=False):
+        # With use_mmap uncompressed archives are memory mapped instead of being read into memory.
+        # The mapping stays open as long as any of the archive's files haven't been written to,
+        # on Windows the archive file can't be overwritten during that time.
         print("ok")
         header = f.read(4)
 
@@ -327,55 +737,53 @@ class Archive(object):
             # Decompress first
             print("Yaz0 header detected, decompressing...")
             start = time.time()
-            tmp = BytesIO()
-            f.seek(0)
-            decompress(f, tmp)
-            #with open("decompressed.bin", "wb") as g:
-            #    decompress(f,)
-            f = tmp
             f.seek(0)
+            data = decompress_data(f.read()).toreadonly()
 
-            header = f.read(4)
             print("Finished decompression.")
             print("Time taken:", time.time() - start)
+        elif use_mmap and header == b"RARC":
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        else:
+            f.seek(0)
+            data = memoryview(f.read())
+
+        return cls.from_buffer(data)
+
+    @classmethod
+    def from_buffer(cls, data):
+        # Parses an uncompressed archive from a read-only buffer. The archive's files keep
+        # views into the buffer instead of copies of the data.
+        newarc = cls()
+        header = bytes(data[0:4])
 
         if header == b"RARC":
             pass
         else:
             raise RuntimeError("Unknown file header: {} should be Yaz0 or RARC".format(header))
 
-        size = read_uint32(f)
-        f.read(4) #unknown
-
-        data_offset = read_uint32(f) + 0x20
-        f.read(16) # Unknown
-        node_count = read_uint32(f)
-        f.read(8) # Unknown
-        file_entry_offset = read_uint32(f) + 0x20
-        f.read(4) # Unknown
-        stringtable_offset = read_uint32(f) + 0x20
-        f.read(8) # Unknown
+        size = unpack_from(">I", data, 0x4)[0]
+        data_offset = unpack_from(">I", data, 0xC)[0] + 0x20
+        node_count = unpack_from(">I", data, 0x20)[0]
+        file_entry_offset = unpack_from(">I", data, 0x2C)[0] + 0x20
+        stringtable_offset = unpack_from(">I", data, 0x34)[0] + 0x20
         nodes = []
 
         print("Archive has", node_count, " total directories")
 
-                
-        
         #print("data offset", hex(data_offset))
         for i in range(node_count):
-            nodetype = f.read(4)
-            nodedata = f.read(4+2+2+4)
-            nameoffset, unknown, entrycount, entryoffset = unpack(">IHHI", nodedata)
+            nameoffset, unknown, entrycount, entryoffset = unpack_from(">IHHI", data, 0x40 + i*16 + 4)
 
             if i == 0:
-                dir_name = stringtable_get_name(f, stringtable_offset, nameoffset)
+                dir_name = stringtable_get_name(data, stringtable_offset, nameoffset)
             else:
                 dir_name = None 
                 
             nodes.append((dir_name, unknown, entrycount, entryoffset))
 
         rootfoldername = nodes[0][0]
-        newarc.root = Directory.from_node(f, rootfoldername, stringtable_offset, file_entry_offset, data_offset, nodes, 0)
+        newarc.root = Directory.from_node(data, rootfoldername, stringtable_offset, file_entry_offset, data_offset, nodes, 0)
 
         return newarc
 
@@ -413,15 +821,60 @@ class Archive(object):
         else:
             self.root[rest] = entry
 
+    def __delitem__(self, path):
+        dirname, rest = split_path(path)
+
+        if rest is None or rest.strip() == "":
+            raise RuntimeError("Cannot delete the root directory.")
+        elif dirname != self.root.name:
+            raise FileNotFoundError(path)
+        else:
+            del self.root[rest]
+
+    def _get_pathindex(self):
+        if self._pathindex is None:
+            self._pathindex = PathIndex()
+            if self.root is not None:
+                self._pathindex.add(self.root.name, self.root)
+
+        return self._pathindex
+
+    def find(self, path):
+        # Case-insensitive lookup of a full path, including the root directory
+        result = self._get_pathindex().get(path)
+        if result is None:
+            raise FileNotFoundError(path)
+
+        return result[1]
+
+    def glob(self, pattern):
+        # Full paths of all entries matching a pattern like "*/scrn/*.blo" (case-insensitive).
+        # Unlike in shells, * also matches slashes.
+        return self._get_pathindex().glob(pattern)
+
+    def find_suffix(self, suffix, dirpath=None):
+        # Full paths of all entries ending with suffix, optionally only inside of dirpath
+        return self._get_pathindex().find_suffix(suffix, dirpath)
+
     def extract_to(self, path):
         self.root.extract_to(path)
 
-    def write_arc_compressed(self, f, pad=False):
-        temp = BytesIO()
-        self.write_arc(temp)
-        temp.seek(0)
-
-        compress_fast(temp, f)
+    def write_arc_compressed(self, f, pad=False, level=DEFAULT_LEVEL, parallel=False, segment_size=DEFAULT_SEGMENT_SIZE):
+        # The archive is assembled into a single bytes object for the compressor,
+        # the file data is copied straight from the files' buffers.
+        parts, exported = self._get_arc_parts()
+        try:
+            data = b"".join(parts)
+        finally:
+            for view in exported:
+                view.release()
+        del parts, exported
+
+        if parallel:
+            # Compresses segments of the archive on all CPU cores, see compress_data_parallel
+            f.write(compress_data_parallel(data, level, segment_size))
+        else:
+            f.write(compress_data(data, level))
 
         # Pikmin 2 SZS files require extra padding to prevent
         # the last file in a SZS from getting corrupted and crashing the game
@@ -429,165 +882,118 @@ class Archive(object):
             write_pad32(f)
 
     def write_arc(self, f):
+        # Writes the archive front to back without seeking, so f doesn't need to be seekable
+        parts, exported = self._get_arc_parts()
+        try:
+            for part in parts:
+                f.write(part)
+        finally:
+            for view in exported:
+                view.release()
+
+    def _get_arc_parts(self):
+        # Lays out the whole archive from the directory tree and file sizes alone and returns
+        # the archive as a list of bytes-like parts. File data is included as views of the files'
+        # buffers instead of copies. The second list contains views exported from BytesIO objects,
+        # they need to be released once the parts have been written.
         stringtable = StringTable()
 
-        nodes = BytesIO()
-        entries = BytesIO()
-        data = BytesIO()
-
-        nodecount = 1
-        entries = 0
+        # Directories in node order, depth-first like walk
+        dirlist = []
+        stack = [self.root]
+        while stack:
+            dir = stack.pop()
+            dirlist.append(dir)
+            stack.extend(reversed(list(dir.subdirs.values())))
 
         # Set up string table with all directory and file names
         stringtable.write_string(".")
         stringtable.write_string("..")
         stringtable.write_string(self.root.name)
 
-        for dir, subdirnames, filenames in self.root.walk():
-            nodecount += len(subdirnames)
-            entries += len(subdirnames) + len(filenames)
+        for i, dir in enumerate(dirlist):
+            dir._nodeindex = i
+            stringtable.write_string(dir.name)
 
-            for name in subdirnames:
+            for name in dir.subdirs.keys():
                 stringtable.write_string(name)
 
-            for name in filenames:
+            for name in dir.files.keys():
                 stringtable.write_string(name)
 
-        f.write(b"RARC")
-        f.write(b"FOO ") # placeholder for filesize
-        write_uint32(f, 0x20)  #Unknown but often 0x20?
-        f.write(b"BAR ") # placeholder for data offset
-        f.write(b"\x00"*16) # 4 unknown ints
-
-        write_uint32(f, nodecount)
-        write_uint32(f, 0x20) # unknown
-        f.write(b"\x00"*4) # 1 unknown ints
-
-        #aligned_file_entry_offset = (0x20 + 44 + (nodecount*16) + 0x1F) & 0x20
-        #write_uint32(f, aligned_file_entry_offset)  # Offset to file entries aligned to multiples of 0x20
-        write_uint32(f, 0xF0F0F0F0)
-
-        f.write(b"\x00"*4) # 1 unknown int
-
-        #aligned_stringtable_offset = aligned_file_entry_offset + ((entries * 20) + 0x1F) & 0x20
-        #write_uint32(f, aligned_stringtable_offset)
-        write_uint32(f, 0xF0F0F0F0)
-
-        f.write(b"\x00"*8) # 2 unknown ints
-
-        node_offset = f.tell()
-
+        nodecount = len(dirlist)
+        nodes = bytearray()
         first_file_entry_index = 0
 
-        dirlist = []
-
-        #aligned_data_offset = aligned_stringtable_offset + (stringtable.size() + 0x1F) & 0x20
-
-        for i, dirinfo in enumerate(self.root.walk()):
-            dirpath, dirnames, filenames = dirinfo
-            dir = self[dirpath]
-            dir._nodeindex = i
-
-            dirlist.append(dir)
-
+        for i, dir in enumerate(dirlist):
             if i == 0:
                 nodetype = b"ROOT"
             else:
-                nodetype = dir.name.upper().encode("shift-jis")[:4]
-                if len(nodetype) < 4:
-                    nodetype = nodetype + (b"\x00"*(4 - len(nodetype)))
-
-            f.write(nodetype)
-            write_uint32(f, stringtable.get_string_offset(dir.name))
-            hash = hash_name(dir.name)
+                nodetype = dir.name.upper().encode("shift-jis")[:4] # Padded with zeros by pack
 
-            entrycount = len(dirnames) + len(filenames)
-            write_uint16(f, hash)
-            write_uint16(f, entrycount+2)
+            entrycount = len(dir.subdirs) + len(dir.files)
+            nodes += pack(">4sIHHI", nodetype, stringtable.get_string_offset(dir.name), hash_name(dir.name),
+                          entrycount+2, first_file_entry_index)
 
-            write_uint32(f, first_file_entry_index)
             first_file_entry_index += entrycount + 2 # Each directory has two special entries being the current and the parent directories
 
-        write_pad32(f)
+        total_file_entries = first_file_entry_index
 
-        current_file_entry_offset = f.tell()
-        #assert f.tell() == aligned_file_entry_offset
+        entries = bytearray()
+        filedata = []
+        exported = []
+        data_size = 0
         fileid = 0
 
         for dir in dirlist:
             for filename, file in dir.files.items():
-                write_uint16(f, fileid)
-                write_uint16(f, hash_name(filename))
-                f.write(b"\x11\x00") # Flag for file+padding
-                write_uint16(f, stringtable.get_string_offset(filename))
-
-                filedata_offset = data.tell()
-                write_uint32(f, filedata_offset) # Write file data offset
-                data.write(file.getvalue()) # Write file data
-                write_uint32(f, data.tell()-filedata_offset) # Write file size
-                write_pad32(data)
-                write_uint32(f, 0)
+                if file.is_view():
+                    view = file._view
+                else:
+                    view = file.getbuffer()
+                    exported.append(view)
+
+                entries += pack(">HHBBHIII", fileid, hash_name(filename), 0x11, 0x00, # Flag for file+padding
+                                stringtable.get_string_offset(filename), data_size, len(view), 0)
+
+                filedata.append(view)
+                padding = -len(view) % 0x20
+                if padding:
+                    filedata.append(b"\x00"*padding)
+                data_size += len(view) + padding
 
                 fileid += 1
 
             specialdirs = [(".", dir), ("..", dir.parent)]
 
             for subdirname, subdir in chain(specialdirs, dir.subdirs.items()):
-                write_uint16(f, 0xFFFF)
-                write_uint16(f, hash_name(subdirname))
-                f.write(b"\x02\x00") # Flag for directory+padding
-                write_uint16(f, stringtable.get_string_offset(subdirname))
-
                 if subdir is None:
                     child_nodeindex = 0xFFFFFFFF
                 else:
                     child_nodeindex = subdir._nodeindex
-                write_uint32(f, child_nodeindex)
-                write_uint32(f, 0x10)
-                write_uint32(f, 0) # Padding
-
-        write_pad32(f)
-        assert f.tell() % 0x20 == 0
-        current_stringtable_offset = f.tell()
-        stringtable.write_to(f)
-
-        write_pad32(f)
-        stringtablesize = f.tell() - current_stringtable_offset
-
-        current_data_offset = f.tell()
-
-        f.write(data.getvalue())
-
-        rarc_size = f.tell()
-
-        f.seek(4)
-        write_uint32(f, rarc_size)
-        f.seek(12)
-        write_uint32(f, current_data_offset-0x20)
-        write_uint32(f, rarc_size - current_data_offset)
-        write_uint32(f, rarc_size - current_data_offset)
-
-        f.seek(40)
-
-        total_file_entries = first_file_entry_index
-        write_uint32(f, total_file_entries)
-        write_uint32(f, current_file_entry_offset-0x20)
-        write_uint32(f, stringtablesize)
-        write_uint32(f, current_stringtable_offset-0x20)
-
-
-
-
-
-
-
-
 
+                entries += pack(">HHBBHIII", 0xFFFF, hash_name(subdirname), 0x02, 0x00, # Flag for directory+padding
+                                stringtable.get_string_offset(subdirname), child_nodeindex, 0x10, 0)
 
+        strings = stringtable._strings.getvalue()
 
+        file_entry_offset = align32(0x40 + len(nodes))
+        stringtable_offset = align32(file_entry_offset + len(entries))
+        stringtablesize = align32(len(strings))
+        data_offset = stringtable_offset + stringtablesize
+        rarc_size = data_offset + data_size
 
+        header = pack(">4sIIIIIII", b"RARC", rarc_size, 0x20, data_offset-0x20, data_size, data_size, 0, 0)
+        header += pack(">IIIIIIII", nodecount, 0x20, total_file_entries, file_entry_offset-0x20,
+                       stringtablesize, stringtable_offset-0x20, 0, 0)
 
+        parts = [header,
+                 nodes, b"\x00"*(file_entry_offset - 0x40 - len(nodes)),
+                 entries, b"\x00"*(stringtable_offset - file_entry_offset - len(entries)),
+                 strings, b"\x00"*(stringtablesize - len(strings))]
+        parts.extend(filedata)
 
+        return parts, exported
 
 
 if __name__ == "__main__":
@@ -599,6 +1005,13 @@ if __name__ == "__main__":
                         help="Path to the archive file (usually .arc or .szs) to be extracted or the directory to be packed into an archive file.")
     parser.add_argument("--yaz0fast", action="store_true",
                         help="Encode archive as yaz0 when doing directory->.arc/.szs")
+    parser.add_argument("--yaz0level", default=DEFAULT_LEVEL, choices=COMPRESSION_LEVELS,
+                        help="Yaz0 compression level used with --yaz0fast. Default is {0}".format(DEFAULT_LEVEL))
+    parser.add_argument("--yaz0parallel", action="store_true",
+                        help="Compress segments of the archive on all CPU cores when used with --yaz0fast")
+    parser.add_argument("--segmentsize", default=DEFAULT_SEGMENT_SIZE, type=lambda x: int(x, 0),
+                        help="Segment size in bytes for --yaz0parallel. Smaller segments compress slightly worse. "
+                             "Default is 0x{0:X}".format(DEFAULT_SEGMENT_SIZE))
     parser.add_argument("output", default=None, nargs = '?',
                         help="Output path to which the archive is extracted or a new archive file is written, depending on input.")
 
@@ -649,7 +1062,8 @@ if __name__ == "__main__":
 
         with open(outputpath, "wb") as f:
             if args.yaz0fast:
-                archive.write_arc_compressed(f)
+                archive.write_arc_compressed(f, level=args.yaz0level, parallel=args.yaz0parallel,
+                                             segment_size=args.segmentsize)
             else:
                 archive.write_arc(f)
         print("Done")
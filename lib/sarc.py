@@ -6,7 +6,7 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
 
-from lib.yaz0 import decompress, read_uint32, read_uint16, compress_fast
+from lib.yaz0 import decompress_data, read_uint32, read_uint16, compress as compress_yaz0, COMPRESSION_LEVELS, DEFAULT_LEVEL
 
 
 def write_uint32(f, val):
@@ -134,7 +134,7 @@ class SARCArchive(object):
                     print("Permission denied:", os.path.join(dirpath, filename), "skipping...")
         return arc
 
-    def to_file(self, f, compress=False, padding=0x20):
+    def to_file(self, f, compress=False, padding=0x20, level=DEFAULT_LEVEL):
         if compress:
             file = BytesIO()
         else:
@@ -192,7 +192,7 @@ class SARCArchive(object):
 
         if compress:
             file.seek(0)
-            compress_fast(file, f)
+            compress_yaz0(file, f, level)
 
 
     @classmethod
@@ -205,13 +205,8 @@ class SARCArchive(object):
             # Decompress first
             print("Yaz0 header detected, decompressing...")
             start = time.time()
-            tmp = BytesIO()
-            f.seek(0)
-            decompress(f, tmp)
-            #with open("decompressed.bin", "wb") as g:
-            #    decompress(f,)
-            f = tmp
             f.seek(0)
+            f = BytesIO(decompress_data(f.read()))
 
             header = f.read(4)
             print("Finished decompression.")
@@ -303,6 +298,8 @@ if __name__ == "__main__":
                         help="Path to the archive file (usually .arc or .szs) to be extracted or the directory to be packed into an archive file.")
     parser.add_argument("--yaz0fast", action="store_true",
                         help="Encode archive as yaz0 when doing directory->.arc/.szs")
+    parser.add_argument("--yaz0level", default=DEFAULT_LEVEL, choices=COMPRESSION_LEVELS,
+                        help="Yaz0 compression level used with --yaz0fast. Default is {0}".format(DEFAULT_LEVEL))
     parser.add_argument("output", default=None, nargs='?',
                         help="Output path to which the archive is extracted or a new archive file is written, depending on input.")
     parser.add_argument("--padding", default=0x20, type=int,
@@ -337,7 +334,7 @@ if __name__ == "__main__":
     if dir2arc:
         sarc = SARCArchive.from_folder(inputpath)
         with open(outputpath, "wb") as f:
-            sarc.to_file(f, padding=args.padding, compress=args.yaz0fast)
+            sarc.to_file(f, padding=args.padding, compress=args.yaz0fast, level=args.yaz0level)
     else:
         with open(inputpath, "rb") as f:
             sarc = SARCArchive.from_file(f)
@@ -3,7 +3,8 @@
 ## Implementation of a yaz0 decoder/encoder in Python, by Yoshi2
 ## Using the specifications in http://www.amnoid.de/gc/yaz0.txt
 
-from struct import unpack, pack
+from struct import unpack, unpack_from, pack
+from array import array
 import os
 import re
 import hashlib
@@ -11,6 +12,7 @@ import math
 
 from timeit import default_timer as time
 from io import BytesIO
+from itertools import repeat
 #from cStringIO import StringIO
 
 #class yaz0():
@@ -28,133 +30,475 @@ def read_uint16(f):
 def read_uint8(f):
     return f.read(1)[0]
 
+
+def code_byte_runs(code_byte):
+    # Splits the 8 tokens of a code byte into runs of literals (amount of literals)
+    # and back-references (0), starting with the highest bit.
+    runs = []
+    literals = 0
+    for i in range(8):
+        if (code_byte << i) & 0x80:
+            literals += 1
+        else:
+            if literals:
+                runs.append(literals)
+                literals = 0
+            runs.append(0)
+    if literals:
+        runs.append(literals)
+    return tuple(runs)
+
+
+CODE_BYTE_RUNS = [code_byte_runs(i) for i in range(256)]
+
+
 def write_limited(f, data, limit):
     if f.tell() >= limit:
         pass
     else:
         f.write(data)
     
+def decompress_data(data):
+    # Decompresses Yaz0 data (bytes, bytearray or memoryview) into a preallocated
+    # bytearray of the size given in the header and returns a memoryview of it.
+    header = bytes(data[0:4])
+    if header != b"Yaz0":
+        raise RuntimeError("File is not Yaz0-compressed! Header: {0}".format(header))
+
+    decompressed_size = unpack_from(">I", data, 4)[0]
+    out = bytearray(decompressed_size)
+    maxsize = len(data)
+
+    src = 0x10
+    dst = 0
+
+    try:
+        while dst < decompressed_size:
+            code_byte = data[src]
+            src += 1
+
+            for run in CODE_BYTE_RUNS[code_byte]:
+                if run:
+                    # Consecutive literals are copied as a whole. The last code byte can have
+                    # more literal bits set than there are bytes left to decompress.
+                    if dst + run > decompressed_size:
+                        run = decompressed_size - dst
+                    if src + run > maxsize:
+                        raise IndexError
+                    out[dst:dst+run] = data[src:src+run]
+                    src += run
+                    dst += run
+                else:
+                    infobyte = data[src] << 8 | data[src+1]
+                    src += 2
+
+                    bytecount = infobyte >> 12
+                    if bytecount == 0:
+                        bytecount = data[src] + 0x12
+                        src += 1
+                    else:
+                        bytecount += 2
+
+                    distance = (infobyte & 0x0FFF) + 1
+                    seekback = dst - distance
+
+                    if seekback < 0:
+                        raise RuntimeError("Malformed Yaz0 file: Seek back position goes below 0")
+                    if dst + bytecount > decompressed_size:
+                        bytecount = decompressed_size - dst
+
+                    if distance >= bytecount:
+                        out[dst:dst+bytecount] = out[seekback:seekback+bytecount]
+                    else:
+                        # Copy source and copy distance overlap which essentially means that
+                        # we have to repeat the copied source to make up for the difference
+                        pattern = out[seekback:dst]
+                        out[dst:dst+bytecount] = (pattern*(bytecount//distance + 1))[:bytecount]
+
+                    dst += bytecount
+
+                if dst >= decompressed_size:
+                    break
+    except IndexError:
+        # The compressed data ended before everything was decompressed
+        raise RuntimeError("Didn't decompress correctly, notify the developer!")
+
+    return memoryview(out)
+
+
 def decompress(f, out):
-    #if out is None:
-    #    out = BytesIO()
-    
-    # A way to discover the total size of the input data that
-    # should be compatible with most file-like objects.
-    f.seek(0, 2)
-    maxsize = f.tell()
     f.seek(0)
-    
-    #data = f.read()
-    #assert len(data) == maxsize
-    #f.seek(0)
+    out.write(decompress_data(f.read()))
 
 
-    header = f.read(4)
-    if header != b"Yaz0":
-        raise RuntimeError("File is not Yaz0-compressed! Header: {0}".format(header))
-    
-    decompressed_size = read_uint32(f)
-    f.read(8) # padding
-        
-    eof = False
-
-    # Some micro optimization, can save up to a second on bigger files
-    file_read = f.read
-    file_tell = f.tell
-
-    out_read = out.read
-    out_write = out.write
-    out_tell = out.tell
-    out_seek = out.seek
-
-    range_8 = [i for i in range(8)]
-
-    while out_tell() < decompressed_size and not eof:
-        code_byte = file_read(1)[0]
-        
-        for i in range_8:
-            #is_set = ((code_byte << i) & 0x80) != 0
-            
-            if (code_byte << i) & 0x80:
-                out_write(file_read(1)) # Write next byte as-is without requiring decompression
-            else:
-                if file_tell() >= maxsize-1:
-                    eof = True
+# Yaz0 back-references can reach at most 0x1000 bytes back and copy 3 to 0x111 bytes
+WINDOW_SIZE = 0x1000
+MIN_MATCH = 3
+MAX_MATCH = 0xFF + 0x12
+
+# The hash chain links are kept in a ring buffer instead of one entry per input byte.
+# It has to be larger than the window so that a link is never overwritten while it
+# can still be reached from inside the window.
+CHAIN_MASK = 0x1FFF
+
+# Compression levels, from fastest to smallest output.
+# Throughput measured with CPython 3.11 on a 1 MB RARC archive (the lib folder packed
+# with Archive.from_dir), output size relative to the uncompressed archive:
+#   store:   ~20 MB/s, 112.5% (every byte is written as a literal)
+#   fast:    ~1 MB/s, 38.2% (greedy matching, short hash chains)
+#   lazy:    ~0.55 MB/s, 36.2% (lazy matching)
+#   optimal: ~0.1 MB/s, 35.8% (cheapest parse of the longest matches at every position)
+LEVEL_STORE = "store"
+LEVEL_FAST = "fast"
+LEVEL_LAZY = "lazy"
+LEVEL_OPTIMAL = "optimal"
+COMPRESSION_LEVELS = (LEVEL_STORE, LEVEL_FAST, LEVEL_LAZY, LEVEL_OPTIMAL)
+DEFAULT_LEVEL = LEVEL_LAZY
+
+# Hash chain settings per level: (max chain length, lazy matching, insert limit)
+# The max chain length is how many earlier occurrences of a 3-byte prefix are checked per position.
+# Positions covered by a match longer than the insert limit are not added to the hash chains.
+LEVEL_SETTINGS = {
+    LEVEL_FAST: (8, False, 16),
+    LEVEL_LAZY: (32, True, None),
+    LEVEL_OPTIMAL: (64, False, None)
+}
+
+# Encoded size in bits of a literal, a 2 byte match (3 to 0x11 bytes) and a 3 byte match,
+# including the bit in the code byte. Used by the optimal parse.
+LITERAL_COST = 9
+SHORT_MATCH_COST = 17
+LONG_MATCH_COST = 25
+
+# Positions inside of a match longer than this don't get searched again by the optimal parse
+OPTIMAL_NICE_LENGTH = 0x20
+
+# Size of the independently compressed segments in compress_data_parallel.
+# Matches can't cross segment borders so smaller segments lose some compression,
+# on the 1 MB archive used above the lazy level produces 0.14% more data with
+# 256 KiB segments and 0.85% more with 64 KiB segments than single-threaded compression.
+DEFAULT_SEGMENT_SIZE = 0x40000
+
+# Turns the flags from split_tokens into the digits of a code byte
+FLAG_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+
+
+def find_match(data, pos, size, head, prev, max_chain):
+    # Walks the hash chain of the 3 bytes at pos and returns the longest
+    # match inside the sliding window as (length, position).
+    # All positions before pos need to have been inserted into the chain.
+    best_len = 0
+    best_pos = -1
+
+    if pos + MIN_MATCH > size:
+        return best_len, best_pos
+
+    candidate = head.get(data[pos:pos+MIN_MATCH], -1)
+    lowest = pos - WINDOW_SIZE if pos > WINDOW_SIZE else 0
+    maxlen = size - pos
+    if maxlen > MAX_MATCH:
+        maxlen = MAX_MATCH
+
+    while candidate >= lowest and max_chain > 0:
+        # A longer match has to agree on the byte right after the current best match,
+        # checking that first rejects most candidates cheaply.
+        if best_len == 0 or data[candidate+best_len] == data[pos+best_len]:
+            length = MIN_MATCH
+            while length + 16 <= maxlen and data[candidate+length:candidate+length+16] == data[pos+length:pos+length+16]:
+                length += 16
+            while length < maxlen and data[candidate+length] == data[pos+length]:
+                length += 1
+
+            if length > best_len:
+                best_len = length
+                best_pos = candidate
+                if length == maxlen:
                     break
 
-                data = file_read(2)
-                infobyte = data[0] << 8 | data[1]
-                
-
-                bytecount = infobyte >> 12 
-                
-                if bytecount == 0:
-                    if file_tell() > maxsize-1:
-                        eof = True
-                        break
-                    bytecount = file_read(1)[0] + 0x12
+        candidate = prev[candidate & CHAIN_MASK]
+        max_chain -= 1
+
+    return best_len, best_pos
+
+
+def compress_store(data):
+    # Every byte is written as a literal
+    size = len(data)
+    result = bytearray()
+
+    for start in range(0, size - size % 8, 8):
+        result.append(0xFF)
+        result += data[start:start+8]
+
+    leftover = size % 8
+    if leftover:
+        result.append((0xFF00 >> leftover) & 0xFF)
+        result += data[size-leftover:]
+
+    return result
+
+
+def compress_lz77(data, max_chain, lazy, insert_limit=None):
+    # LZ77 compression with hash chains for finding matches in the window.
+    # With lazy matching a match is only taken if the match starting at the next byte
+    # isn't longer, otherwise a literal is written and the next match is used instead.
+    size = len(data)
+
+    head = {}
+    prev = [-1]*(CHAIN_MASK+1)
+    last_insertable = size - MIN_MATCH
+
+    result = bytearray()
+    code_pos = 0
+    token_count = 0
+
+    pos = 0
+    inserted = 0  # Every position below this one is in the hash chain
+    pending = None
+
+    while pos < size:
+        if pending is not None:
+            match_len, match_pos = pending
+            pending = None
+        else:
+            match_len, match_pos = find_match(data, pos, size, head, prev, max_chain)
+
+        if lazy and MIN_MATCH <= match_len < MAX_MATCH and pos < last_insertable:
+            if inserted == pos:
+                key = data[pos:pos+MIN_MATCH]
+                prev[pos & CHAIN_MASK] = head.get(key, -1)
+                head[key] = pos
+                inserted += 1
+
+            next_len, next_pos = find_match(data, pos+1, size, head, prev, max_chain)
+            if next_len > match_len:
+                pending = (next_len, next_pos)
+                match_len = 0
+
+        if token_count & 7 == 0:
+            code_pos = len(result)
+            result.append(0)
+
+        if match_len < MIN_MATCH:
+            result[code_pos] |= 0x80 >> (token_count & 7)
+            result.append(data[pos])
+            pos += 1
+        else:
+            distance = pos - match_pos - 1
+            if match_len >= 0x12:
+                result.append(distance >> 8)
+                result.append(distance & 0xFF)
+                result.append(match_len - 0x12)
+            else:
+                result.append(((match_len - 2) << 4) | (distance >> 8))
+                result.append(distance & 0xFF)
+            pos += match_len
+
+        token_count += 1
+
+        # Positions covered by the token still need to go into the chain for later matches
+        end = pos if pos < last_insertable else last_insertable
+        if insert_limit is not None and end - inserted > insert_limit:
+            inserted = end - 1
+        while inserted < end:
+            key = data[inserted:inserted+MIN_MATCH]
+            prev[inserted & CHAIN_MASK] = head.get(key, -1)
+            head[key] = inserted
+            inserted += 1
+
+    return result
+
+
+def compress_optimal(data, max_chain):
+    # Finds the longest match at every position first, then picks the cheapest
+    # sequence of literals and matches going backwards from the end of the data.
+    # Any shorter prefix of a match is also a valid match so every length
+    # between 3 and the longest match is considered.
+    size = len(data)
+
+    head = {}
+    prev = [-1]*(CHAIN_MASK+1)
+    last_insertable = size - MIN_MATCH
+
+    lengths = array("i", bytes(4*size))
+    positions = array("i", bytes(4*size))
+
+    match_len = match_pos = 0
+    for pos in range(size):
+        if match_len > OPTIMAL_NICE_LENGTH:
+            # Inside of a long match the rest of that match is almost always the best
+            # match as well, searching for it again would be very slow.
+            match_len -= 1
+            match_pos += 1
+        else:
+            match_len, match_pos = find_match(data, pos, size, head, prev, max_chain)
+
+        if match_len >= MIN_MATCH:
+            lengths[pos] = match_len
+            positions[pos] = match_pos
+
+        if pos < last_insertable:
+            key = data[pos:pos+MIN_MATCH]
+            prev[pos & CHAIN_MASK] = head.get(key, -1)
+            head[key] = pos
+
+    # cost[i] is the smallest amount of bits needed for encoding data[i:].
+    # The chosen token length at every position is stored in lengths, 0 means literal.
+    cost = [0]*(size+1)
+    for pos in range(size-1, -1, -1):
+        best = cost[pos+1] + LITERAL_COST
+        chosen = 0
+        match_len = lengths[pos]
+
+        if match_len >= MIN_MATCH:
+            shortest = cost[pos+MIN_MATCH:pos+min(match_len, 0x11)+1]
+            remaining = min(shortest)
+            if remaining + SHORT_MATCH_COST < best:
+                best = remaining + SHORT_MATCH_COST
+                chosen = shortest.index(remaining) + MIN_MATCH
+
+            if match_len >= 0x12:
+                longest = cost[pos+0x12:pos+match_len+1]
+                remaining = min(longest)
+                if remaining + LONG_MATCH_COST < best:
+                    best = remaining + LONG_MATCH_COST
+                    chosen = longest.index(remaining) + 0x12
+
+        cost[pos] = best
+        lengths[pos] = chosen
+
+    result = bytearray()
+    code_pos = 0
+    token_count = 0
+    pos = 0
+
+    while pos < size:
+        if token_count & 7 == 0:
+            code_pos = len(result)
+            result.append(0)
+
+        match_len = lengths[pos]
+        if match_len == 0:
+            result[code_pos] |= 0x80 >> (token_count & 7)
+            result.append(data[pos])
+            pos += 1
+        else:
+            distance = pos - positions[pos] - 1
+            if match_len >= 0x12:
+                result.append(distance >> 8)
+                result.append(distance & 0xFF)
+                result.append(match_len - 0x12)
+            else:
+                result.append(((match_len - 2) << 4) | (distance >> 8))
+                result.append(distance & 0xFF)
+            pos += match_len
+
+        token_count += 1
+
+    return result
+
+
+def compress_data(data, level=DEFAULT_LEVEL):
+    # Returns the Yaz0 compressed data including the header
+    if level == LEVEL_STORE:
+        body = compress_store(data)
+    elif level == LEVEL_OPTIMAL:
+        body = compress_optimal(data, LEVEL_SETTINGS[level][0])
+    elif level in LEVEL_SETTINGS:
+        body = compress_lz77(data, *LEVEL_SETTINGS[level])
+    else:
+        raise RuntimeError("Unknown Yaz0 compression level: {0}".format(level))
+
+    return b"Yaz0" + pack(">I", len(data)) + b"\x00"*8 + body
+
+
+def split_tokens(body):
+    # Splits compressed data (without header) into one flag byte per token (1 for literals),
+    # the encoded size of every token and the token data without the code bytes.
+    flags = bytearray()
+    sizes = bytearray()
+    payload = bytearray()
+    size = len(body)
+    pos = 0
+
+    while pos < size:
+        code_byte = body[pos]
+        pos += 1
+        start = pos
+
+        for i in range(8):
+            if pos >= size:
+                break
+
+            if (code_byte << i) & 0x80:
+                flags.append(1)
+                sizes.append(1)
+                pos += 1
+            else:
+                flags.append(0)
+                if body[pos] >> 4 == 0:
+                    sizes.append(3)
+                    pos += 3
                 else:
-                    bytecount += 2
-                
-                offset = infobyte & 0x0FFF
-                
-                current = out_tell()
-                seekback = current - (offset+1)
-                
-                if seekback < 0:
-                    raise RuntimeError("Malformed Yaz0 file: Seek back position goes below 0")
-
-                out_seek(seekback)
-                copy = out_read(bytecount)
-                out_seek(current)
-                
-                write_limited(out, copy, decompressed_size)
-
-                copy_length = len(copy)
-                
-                if copy_length < bytecount:
-                    # Copy source and copy distance overlap which essentially means that
-                    # we have to repeat the copied source to make up for the difference
-                    j = 0
-                    for i in range(bytecount-copy_length):
-                        #write_limited(out, copy[j:j+1], decompressed_size)
-                        if out_tell() < decompressed_size:
-                            out_write(copy[j:j+1])
-                        else:
-                            break
-
-                        j = (j+1) % copy_length
-                
-    if out.tell() < decompressed_size:
-        #print("this isn't right")
-        raise RuntimeError("Didn't decompress correctly, notify the developer!")
-    if out.tell() > decompressed_size:
-        print(  "Warning: output is longer than decompressed size for some reason: "
-                "{}/decompressed: {}".format(out.tell(), decompressed_size))
+                    sizes.append(2)
+                    pos += 2
+
+        payload += body[start:pos]
+
+    return bytes(flags), bytes(sizes), bytes(payload)
+
+
+def compress_segment(data, level):
+    # Used by the worker processes of compress_data_parallel
+    if level == LEVEL_STORE:
+        body = compress_store(data)
+    elif level == LEVEL_OPTIMAL:
+        body = compress_optimal(data, LEVEL_SETTINGS[level][0])
+    else:
+        body = compress_lz77(data, *LEVEL_SETTINGS[level])
+
+    return split_tokens(body)
+
+
+def compress_data_parallel(data, level=DEFAULT_LEVEL, segment_size=DEFAULT_SEGMENT_SIZE, processes=None):
+    # Splits the data into segments of segment_size bytes and compresses them in a process pool.
+    # Matches never reach back into the previous segment, which keeps the segments independent,
+    # the tokens of all segments are then regrouped into one regular Yaz0 stream.
+    # processes is the amount of worker processes, by default one per CPU core.
+    if level not in COMPRESSION_LEVELS:
+        raise RuntimeError("Unknown Yaz0 compression level: {0}".format(level))
+    if segment_size < WINDOW_SIZE:
+        raise RuntimeError("Segment size has to be at least 0x{0:X} bytes".format(WINDOW_SIZE))
+
+    if level == LEVEL_STORE or len(data) <= segment_size:
+        return compress_data(data, level)
+
+    # Imported here because the multiprocessing machinery takes a while to import
+    # and most users of this module never compress in parallel
+    from concurrent.futures import ProcessPoolExecutor
+
+    segments = [data[start:start+segment_size] for start in range(0, len(data), segment_size)]
+    with ProcessPoolExecutor(processes) as executor:
+        results = list(executor.map(compress_segment, segments, repeat(level, len(segments))))
+
+    flags = b"".join(result[0] for result in results)
+    sizes = b"".join(result[1] for result in results)
+    payload = b"".join(result[2] for result in results)
+
+    body = bytearray()
+    offset = 0
+    for start in range(0, len(flags), 8):
+        body.append(int(flags[start:start+8].translate(FLAG_DIGITS).ljust(8, b"0"), 2))
+        end = offset + sum(sizes[start:start+8])
+        body += payload[offset:end]
+        offset = end
+
+    return b"Yaz0" + pack(">I", len(data)) + b"\x00"*8 + body
+
+
+def compress(f, out, level=DEFAULT_LEVEL):
+    out.write(compress_data(f.read(), level))
 
 
 def compress_fast(f, out):
-    data = f.read()
-    
-    maxsize = len(data)
-    
-    out.write(b"Yaz0")
-    out.write(pack(">I", maxsize))
-    out.write(b"\x00"*8)
-
-    out_write = out.write
-    print("size:", hex(maxsize))
-    print(maxsize//8, maxsize/8.0)
-    for i in range(int(math.ceil(maxsize/8))):
-        start = i*8 
-        end = (i+1)*8
-        print(hex(start), hex(end))
-        if end > maxsize:
-            # Pad data with 0's up to 8 bytes
-            tocopy = data[start:maxsize] + b"\x00"*(end-maxsize)
-            print("padded")
-        else:
-            tocopy = data[start:end]
-        
-        out_write(b"\xFF") # Set all bits in the code byte to 1 to mark the following 8 bytes as copy
-        out_write(tocopy)
+    compress(f, out, LEVEL_STORE)
@@ -115,6 +115,7 @@ class BCKControls(QWidget):
                 element.p_offset_x, element.p_offset_y = anim_values[0:2]
                 element.p_scale_x, element.p_scale_y = anim_values[2:4]
                 element.p_rotation = anim_values[4]
+                self.main_editor.layout_file.set_dirty(element)
                 self.main_editor.pik_control.update_info()
                 self.main_editor.level_view.do_redraw()
 
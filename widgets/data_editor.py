@@ -89,6 +89,17 @@ class DataEditor(QWidget):
 
         self.setup_widgets()
 
+        # Every edit marks the edited object as changed so that it's encoded again on the next save
+        for widget in self.findChildren(QLineEdit):
+            widget.editingFinished.connect(self.set_dirty)
+        for widget in self.findChildren(QComboBox):
+            widget.currentIndexChanged.connect(self.set_dirty)
+        for widget in self.findChildren(QCheckBox):
+            widget.stateChanged.connect(self.set_dirty)
+
+    def set_dirty(self, *args):
+        self.main_editor.parent.layout_file.set_dirty(self.bound_to)
+
     def add_widget(self, widget):
         self.vbox.addWidget(widget)
         return widget
@@ -476,6 +487,7 @@ class DataEditor(QWidget):
     def _change_material(self, mat_dict, text):
         self.bound_to._material = mat_dict[text]
         self.bound_to.material = text
+        self.main_editor.parent.layout_file.update_pane(self.bound_to)
         self.emit_3d_update.emit()
 
 
@@ -696,7 +708,9 @@ def dict_setter_int(var, field):
 
 def dict_setter_int_list(var, field, i):
     def setter(x):
-        var[field][i] = int(x)
+        values = list(var[field])
+        values[i] = int(x)
+        var[field] = tuple(values)
 
     return setter
 
@@ -836,7 +850,7 @@ class MaterialEditor(DataEditor):
         #line_edit.setValidator(PythonSameNameValidator())
         layout = self.create_labeled_widget(self, "Name", self.line_edit)
         mat = self.bound_to.bound_to
-        materials = self.main_editor.parent.layout_file.root.materials.materials
+        mat1 = self.main_editor.parent.layout_file.root.materials
 
         # line_edit.setMaxLength(maxlength)
 
@@ -846,11 +860,11 @@ class MaterialEditor(DataEditor):
             # text = text.rjust(maxlength, pad)
             if text == self.bound_to.bound_to.name:
                 pass
-            elif text in [x.name for x in materials]:
+            elif mat1.get_mat_index(text) != -1:
                 open_error_dialog("Cannot use name, name already in use!", self)
             else:
                 oldname = mat.name
-                mat.name = text
+                mat1.rename_material(mat, text)
 
                 self.main_editor.parent.layout_file.rename_material(oldname, mat.name)
             #setattr(self.bound_to, attribute, text)
@@ -902,6 +916,9 @@ class MaterialEditor(DataEditor):
     def update_name(self):
         self.bound_to.setText(0, self.bound_to.bound_to.name)
 
+    def set_dirty(self, *args):
+        self.main_editor.parent.layout_file.set_dirty(self.bound_to.bound_to)
+
 
 class PictureColorEditor(SubEditor):
     def __init__(self, color, *args, **kwargs):
@@ -991,6 +1008,7 @@ class WindowSubSettingEdit(SubEditor):
     def _change_material(self, mat_dict, text):
         #self.bound_to._material = mat_dict[text]
         self.subdata["material"] = text
+        self.main_editor.parent.layout_file.update_pane(self.parent.bound_to)
         self.parent.emit_3d_update.emit()
 
     def update_data(self):
@@ -1010,6 +1028,7 @@ class PaneEdit(DataEditor):
                                      "p_panename", "Name", maxlength=8, pad="\x00",
                                      preprocess_func=lambda x: x.lstrip("\x00"))
         self.name.editingFinished.connect(self.update_name)
+        self.name.editingFinished.connect(self.update_index)
         self.secondaryname = self.add_updater(self.add_text_input, self.bound_to,
                                               "p_secondaryname", "Secondary Name", maxlength=8, pad="\x00",
                                               preprocess_func=lambda x: x.lstrip("\x00"))
@@ -1053,6 +1072,9 @@ class PaneEdit(DataEditor):
             return
         self.bound_to.widget.update_name()
 
+    def update_index(self):
+        self.main_editor.parent.layout_file.update_pane(self.bound_to)
+
 
 class WindowEditor(PaneEdit):
     def setup_widgets(self):
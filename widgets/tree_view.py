@@ -246,15 +246,10 @@ class LayoutDataTreeView(QTreeWidget):
         if not self.item_is_ancestor_of(widget, item_drop):
             if item_drop in mimedata_to_item.values():
                 blo_item = widget.bound_to
-                blo_item.parent.child.children.remove(blo_item)
                 if item_drop.parent() == self.layout:
-                    new_blo_item = item_drop.bound_to
-                    new_blo_item.child.children.insert(0, blo_item)
-                    blo_item.parent = new_blo_item
+                    self.blo.move_pane(blo_item, item_drop.bound_to, 0)
                 else:
-                    new_blo_item = parent_item.bound_to
-                    new_blo_item.child.children.insert(index.row(), blo_item)
-                    blo_item.parent = new_blo_item
+                    self.blo.move_pane(blo_item, parent_item.bound_to, index.row())
                 self.rebuild_tree.emit()
                 e.acceptProposedAction()
 
@@ -293,16 +288,19 @@ class LayoutDataTreeView(QTreeWidget):
     def handle_paste_item(self, pos):
         item = self.itemAt(pos)
         if isinstance(item, (PaneItem,)):
-            item.bound_to.add_child(self._copied_object.copy(children=True))
-            self.rebuild_tree.emit()
+            pane = self._copied_object.copy(children=True)
+            self.blo.add_pane(item.bound_to, pane)
+            self.add_pane_items(pane, item)
+            self.main_editor.update_3d()
 
     def handle_add_item(self, pos, itemcls):
         item = self.itemAt(pos)
         if isinstance(item, (PaneItem,)):
             pane = itemcls.new()
             pane.set_default_material(self.blo.root.materials.materials[0])
-            item.bound_to.add_child(pane)
-            self.rebuild_tree.emit()
+            self.blo.add_pane(item.bound_to, pane)
+            self.add_pane_items(pane, item)
+            self.main_editor.update_3d()
 
     def handle_duplicate(self, pos):
         item = self.itemAt(pos)
@@ -317,7 +315,7 @@ class LayoutDataTreeView(QTreeWidget):
 
             mat.name = new_name
 
-            self.blo.root.materials.materials.append(mat)
+            self.blo.add_material(mat)
             self.rebuild_tree.emit()
 
     def handle_delete_texture(self, delete_file, pos):
@@ -339,11 +337,13 @@ class LayoutDataTreeView(QTreeWidget):
                         self.delete_texture.emit(item)
                         self.blo.root.textures.references.pop(index)
                         self.blo.root.materials.remove_texture_index(index)
+                        self.blo.set_dirty(self.blo.root.materials)
                         self.rebuild_tree.emit()
                 else:
 
                     self.blo.root.textures.references.pop(index)
                     self.blo.root.materials.remove_texture_index(index)
+                    self.blo.set_dirty(self.blo.root.materials)
                     self.rebuild_tree.emit()
 
 
@@ -371,7 +371,7 @@ class LayoutDataTreeView(QTreeWidget):
 
             result = self.blo.find_elements_that_use_material(mat)
             if len(result) == 0:
-                self.blo.root.materials.materials.remove(mat)
+                self.blo.remove_material(mat)
                 self.rebuild_tree.emit()
             else:
                 result = list(map(lambda x: x.strip("\x00"), result))
@@ -413,7 +413,7 @@ class LayoutDataTreeView(QTreeWidget):
             delete_texture_entry.triggered.connect(partial(self.handle_delete_texture, True, pos))
             context_menu.addAction(delete_texture_entry)
 
-            if item.bound_to.lower() not in self.main_editor.texture_menu.texture_handler.textures:
+            if not self.main_editor.texture_menu.texture_handler.exists(item.bound_to):
                 delete_texture_entry.setEnabled(False)
 
             context_menu.exec(self.mapToGlobal(pos))
@@ -517,38 +517,61 @@ class LayoutDataTreeView(QTreeWidget):
         self.font_list.remove_children()
 
     def set_node_objects(self, node, parent=None):
-        for child in node.children:
-            if not isinstance(child, (TextureNames, MAT1, FontNames)):
-                assert not isinstance(child, Node)
-                assert child.name in ("PAN2", "WIN2", "PIC2", "TBX2")
-
-                if child.name == "PAN2":
-                    child_item = PaneItem(parent, child.p_panename, child, None)
-                elif child.name == "WIN2":
-                    child_item = WindowItem(parent, child.p_panename, child, None)
-                elif child.name == "PIC2":
-                    child_item = PictureItem(parent, child.p_panename, child, None)
-                elif child.name == "TBX2":
-                    child_item = TextboxItem(parent, child.p_panename, child, None)
-
-                if child.child is not None:
-                    self.set_node_objects(child.child, child_item)
+        # Items are created parents first, nodes still to be added are kept on a stack
+        stack = [(iter(node.children), parent)]
+        while stack:
+            children, parent = stack[-1]
+            for child in children:
+                if not isinstance(child, (TextureNames, MAT1, FontNames)):
+                    assert not isinstance(child, Node)
+                    child_item = self.create_pane_item(parent, child)
+
+                    if child.child is not None:
+                        stack.append((iter(child.child.children), child_item))
+                        break
+            else:
+                stack.pop()
+
+    def create_pane_item(self, parent, pane):
+        assert pane.name in ("PAN2", "WIN2", "PIC2", "TBX2")
+
+        if pane.name == "PAN2":
+            return PaneItem(parent, pane.p_panename, pane, None)
+        elif pane.name == "WIN2":
+            return WindowItem(parent, pane.p_panename, pane, None)
+        elif pane.name == "PIC2":
+            return PictureItem(parent, pane.p_panename, pane, None)
+        elif pane.name == "TBX2":
+            return TextboxItem(parent, pane.p_panename, pane, None)
+
+    def add_pane_items(self, pane, parent_item):
+        # Adds the items for a pane that was just added to the layout and for everything below it,
+        # the rest of the tree stays as it is
+        item = self.create_pane_item(parent_item, pane)
+        if pane.child is not None:
+            self.set_node_objects(pane.child, item)
+        parent_item.setExpanded(True)
+        return item
+
+    def iter_items(self, root):
+        # root and all items below it, parents before their children
+        stack = [root]
+        while stack:
+            item = stack.pop()
+            yield item
+            for i in reversed(range(item.childCount())):
+                stack.append(item.child(i))
 
     def get_item_for_obj(self, obj, root: PaneItem=None):
         if self.layout.childCount() == 0:
             return None
 
         if root is None:
-            return self.get_item_for_obj(obj, self.layout.child(0))
-        else:
-            if root.bound_to == obj:
-                return root
-            else:
-                for i in range(root.childCount()):
-                    child = root.child(i)
-                    result = self.get_item_for_obj(obj, child)
-                    if result is not None:
-                        return result
+            root = self.layout.child(0)
+
+        for item in self.iter_items(root):
+            if item.bound_to == obj:
+                return item
         return None
 
     def set_objects(self, screen_data: ScreenBlo):
@@ -566,21 +589,17 @@ class LayoutDataTreeView(QTreeWidget):
         self.set_node_objects(screen_data.root, self.layout)
 
     def save_expand_status(self, expand, child: NamedItemWithChildren):
-        if child.isExpanded():
-            expand[child.bound_to] = True
-
-        for i in range(child.childCount()):
-            self.save_expand_status(expand, child.child(i))
+        for item in self.iter_items(child):
+            if item.isExpanded():
+                expand[item.bound_to] = True
 
     def restore_expand_status(self, expand, child: NamedItemWithChildren):
-        expanded = False
-        if child.bound_to in expand:
-            expanded = expand[child.bound_to]
-
-        child.setExpanded(expanded)
+        for item in self.iter_items(child):
+            expanded = False
+            if item.bound_to in expand:
+                expanded = expand[item.bound_to]
 
-        for i in range(child.childCount()):
-            self.restore_expand_status(expand, child.child(i))
+            item.setExpanded(expanded)
 
     def set_objects_remember_expanded(self, screen_data: ScreenBlo):
         matlist_expanded = self.material_list.isExpanded()